@@ -1,17 +1,41 @@
 import sqlite3
+import asyncio
+import functools
 import random
 import json
+import csv
+import re
+import bisect
+import hashlib
+import time
+import zlib
+import contextvars
+import cProfile
+import pstats
+import shutil
+from itertools import accumulate, chain, islice, permutations
+from math import perm
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 from datetime import datetime, timedelta
 from pathlib import Path
-from PIL import Image, ImageDraw, ImageFont
-from astrbot.api.event import filter, AstrMessageEvent
+from astrbot.api.event import filter, AstrMessageEvent, MessageChain
 from astrbot.api.star import Context, Star, register
-from astrbot.core.message.components import At
+from astrbot.core.message.components import At, Node, Nodes, Plain
 from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import AiocqhttpMessageEvent
 from astrbot.core.star import StarTools
 from astrbot.api import logger
 from copy import deepcopy
 
+try:
+    import ormsgpack  # 可选依赖：用于缓存编译后的配置快照
+except ImportError:
+    ormsgpack = None
+
+try:
+    import filelock  # 可选依赖：多个进程共享数据目录时，让迁移/归档等维护操作互斥
+except ImportError:
+    filelock = None
+
 # --- 默认配置数据 (如果JSON文件不存在，将使用这些数据创建) ---
 
 # --- 默认 宠物数据 (v1.5 新增 "闪电") ---
@@ -109,8 +133,8 @@ DEFAULT_WALK_EVENTS = [
     {"type": "nothing", "weight": 10, "description": "「{pet_name}」悠闲地散了一圈，什么特别的事情都没发生。"}
 ]
 
-# --- 静态游戏数据定义 (商店) (v1.5 更新) ---
-SHOP_ITEMS = {
+# --- 默认 商店数据 (如果 shop.json 不存在，将使用这些数据创建) ---
+DEFAULT_SHOP_ITEMS = {
     # 食物
     "普通口粮": {"price": 10, "type": "food", "satiety": 20, "mood": 5, "description": "能快速填饱肚子的基础食物。"},
     "美味罐头": {"price": 30, "type": "food", "satiety": 50, "mood": 15, "description": "营养均衡，宠物非常爱吃。"},
@@ -126,6 +150,339 @@ SHOP_ITEMS = {
     "技能光盘-剧毒": {"price": 500, "type": "tm", "move_name": "剧毒", "description": "一次性光盘，让宠物学会「剧毒」。"}
 }
 # --- 静态游戏数据定义 (状态中文名映射) (v1.5 更新) ---
+# --- 默认 插件设置 (settings.json，缺失的键会自动补全为默认值) ---
+DEFAULT_SETTINGS = {
+    # 命令限流: 每个开销等级分别设置群级与用户级令牌桶 (capacity: 桶容量, refill_per_second: 每秒回复令牌数)
+    "rate_limit": {
+        "enabled": True,
+        "budgets": {
+            "render": {"group": {"capacity": 20, "refill_per_second": 0.2}, "user": {"capacity": 3, "refill_per_second": 0.05}},
+            "battle": {"group": {"capacity": 30, "refill_per_second": 0.5}, "user": {"capacity": 5, "refill_per_second": 0.1}},
+            "write": {"group": {"capacity": 60, "refill_per_second": 1.0}, "user": {"capacity": 10, "refill_per_second": 0.5}},
+            "read": {"group": {"capacity": 60, "refill_per_second": 2.0}, "user": {"capacity": 10, "refill_per_second": 0.5}}
+        }
+    },
+    # 性能指标: 定期以 Prometheus 文本格式写入数据目录，供本地采集器读取
+    "metrics": {
+        "export_enabled": True,
+        "export_interval_seconds": 60,
+        "export_file": "metrics.prom"
+    },
+    # SQL 追踪 (默认关闭): 统计每个命令执行的语句，超过阈值的语句连同执行计划写入慢查询日志
+    "sql_trace": {
+        "enabled": False,
+        "slow_query_ms": 50,
+        "slow_log_file": "slow_queries.log",
+        "slow_log_max_kb": 5120
+    },
+    # 冷数据归档: 超过 inactive_days 没有任何活动的宠物 (连同背包) 移入归档表，主人下次使用命令时自动恢复
+    "archive": {
+        "enabled": True,
+        "inactive_days": 90,
+        "interval_seconds": 3600,
+        "batch_size": 50
+    },
+    # 存储: shards > 1 时按群号把数据分散到多个 SQLite 文件 (修改前需停机运行 tools/reshard.py)
+    # busy_timeout_ms: 每次尝试中 SQLite 自身等待锁的时间 (在事件循环线程中阻塞，不宜过长)；
+    # 仍失败时回滚整个事务，异步退避后从头重试命令，最多 busy_retries 次
+    "storage": {
+        "shards": 1,
+        "busy_timeout_ms": 500,
+        "busy_retries": 3,
+        "busy_backoff_ms": 100
+    },
+    # 战斗输出: condensed 只发送关键时刻摘要 (完整战报用 /战斗详情 查看)，full 发送完整战报；
+    # 单条消息超过 max_message_chars 时截断或分页
+    "battle_output": {
+        "mode": "condensed",
+        "max_message_chars": 1500,
+        "detail_ttl_seconds": 600
+    },
+    # 饥饿/心情提醒: 仅对用 /宠物提醒 开启的群生效，预计饱食度或心情低于阈值的宠物每段饥饿期只提醒一次
+    "alerts": {
+        "interval_seconds": 1800,
+        "satiety_threshold": 20,
+        "mood_threshold": 20,
+        "max_mentions": 20
+    },
+    # 在线备份: 用 SQLite 在线备份 API 每步复制 pages_per_step 页，步间暂停 step_pause_ms 让出数据库，命令照常执行；
+    # 副本通过完整性校验后才算一份备份，backups/ 下只保留最近 keep 份
+    "backup": {
+        "enabled": True,
+        "interval_hours": 24,
+        "keep": 7,
+        "pages_per_step": 100,
+        "step_pause_ms": 5
+    }
+}
+
+# --- 商店分类 (未在物品中指定 category 时按物品类型归类) ---
+ITEM_CATEGORY_MAP = {
+    "food": "食物",
+    "status_heal": "药品",
+    "held_item": "持有物",
+    "tm": "技能光盘"
+}
+SHOP_PAGE_SIZE = 8
+SHOP_RELOAD_CHECK_SECONDS = 5
+
+# --- 物品效果处理器注册表: 物品类型 -> 处理函数 ---
+ITEM_EFFECT_HANDLERS = {}
+
+
+def item_effect(item_type: str):
+    """
+    注册某类物品的使用效果处理器。
+    处理器签名为 (plugin, pet_state, item_name, item_info) -> (是否消耗, 回复文本)，
+    只允许修改 pet_state 中的字段，由 /使用 统一写回数据库。
+    """
+    def decorator(func):
+        ITEM_EFFECT_HANDLERS[item_type] = func
+        return func
+    return decorator
+
+
+# --- 批量维护操作 (/宠物批量) ---
+BULK_CHUNK_SIZE = 500
+BULK_SAMPLE_LIMIT = 20
+BULK_PROGRESS_SECONDS = 5
+# 四个技能栏中存在重复技能 (NULL 不参与比较)
+DUPLICATE_MOVES_SQL = ("(move1 IS NOT NULL AND move1 IN (move2, move3, move4)) "
+                       "OR (move2 IS NOT NULL AND move2 IN (move3, move4)) "
+                       "OR (move3 IS NOT NULL AND move3 = move4)")
+
+# --- 批量使用物品 (/使用 物品 数量、/使用 物品Ax3 物品Bx2) ---
+USE_ITEM_MAX_QUANTITY = 99
+ITEM_QUANTITY_PATTERN = re.compile(r"^(.+?)[xX×*](\d+)$")
+
+
+def parse_item_batch(tokens: list[str], known_items) -> dict[str, int]:
+    """
+    解析 /使用 的参数，返回 {物品名: 数量} (按首次出现的顺序，同名物品数量合并)。
+    支持 "物品 数量" 与 "物品名x数量 ..." 两种写法；数量不合法时抛出 ValueError。
+    """
+    if len(tokens) == 2 and tokens[1].isdigit():
+        pairs = [(tokens[0], tokens[1])]
+    else:
+        pairs = []
+        for token in tokens:
+            match = ITEM_QUANTITY_PATTERN.match(token)
+            # 物品名本身以 "x数字" 结尾时按完整名称处理
+            pairs.append((match.group(1), match.group(2)) if match and token not in known_items else (token, "1"))
+
+    batch: dict[str, int] = {}
+    for name, quantity_text in pairs:
+        try:
+            quantity = int(quantity_text)
+        except ValueError:
+            raise ValueError(f"「{name}」的数量必须是一个数字。") from None
+        if quantity <= 0:
+            raise ValueError(f"「{name}」的数量必须大于0。")
+        batch[name] = batch.get(name, 0) + quantity
+        if batch[name] > USE_ITEM_MAX_QUANTITY:
+            raise ValueError(f"一次最多使用 {USE_ITEM_MAX_QUANTITY} 个「{name}」。")
+    return batch
+
+
+# --- 群数据导出/导入 (/宠物导出 /宠物导入) ---
+EXPORT_DIR_NAME = "exports"
+EXPORT_FORMAT = "astrbot_plugin_pet.group_export"
+EXPORT_FORMAT_VERSION = 1
+IMPORT_CHUNK_ROWS = 500
+IMPORT_POLICIES = {"跳过": "skip", "覆盖": "overwrite", "合并": "merge"}
+INVENTORY_COLUMNS = ("user_id", "group_id", "item_name", "quantity")
+
+# --- 批量维护操作注册表: 操作名 -> (说明, 处理函数) ---
+BULK_OPERATIONS = {}
+
+
+def bulk_operation(name: str, description: str):
+    """
+    注册一个批量维护操作。
+    处理函数签名为 (plugin, conn, group_id | None, dry_run)，是一个生成器：
+    每处理完一块数据 yield (命中条数, 样例列表)，非试运行时自行写入并按块提交。
+    """
+    def decorator(func):
+        BULK_OPERATIONS[name] = (description, func)
+        return func
+    return decorator
+
+
+def iter_rowid_chunks(conn: sqlite3.Connection, table: str, columns: str, where: str, params: tuple,
+                      chunk_size: int = BULK_CHUNK_SIZE):
+    """按 rowid 键集分页流式读取表中满足条件的行，每块第一列为 rowid。块与块之间不持有事务。"""
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            f"SELECT rowid, {columns} FROM {table} WHERE rowid > ? AND ({where}) ORDER BY rowid LIMIT ?",
+            (last_rowid, *params, chunk_size)).fetchall()
+        if not rows:
+            return
+        last_rowid = rows[-1][0]
+        yield rows
+
+
+def iso_to_epoch(value: str | None) -> int | None:
+    """把旧版的 ISO 时间文本转换为整数时间戳 (按本地时间解释)，无法解析时返回 None。"""
+    if not value:
+        return None
+    try:
+        return int(datetime.fromisoformat(value).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+
+def upgrade_legacy_times(pet: dict) -> dict:
+    """为旧版宠物数据 (归档、导出文件) 补上整数时间列，并去掉旧的 ISO 文本列。"""
+    for legacy, column in EPOCH_TIME_COLUMNS.items():
+        if legacy in pet:
+            value = pet.pop(legacy)
+            if pet.get(column) is None:
+                pet[column] = iso_to_epoch(value)
+    return pet
+
+
+# --- 限流被拒绝时的固定回复 ---
+RATE_LIMIT_REPLIES = {
+    "user": "你的操作太频繁啦，请稍后再试。",
+    "group": "本群宠物指令太火爆啦，请稍后再试。"
+}
+RATE_LIMIT_BUCKET_IDLE_SECONDS = 600
+INIT_FAILED_REPLY = "宠物插件初始化失败，请联系管理员查看日志。"
+
+# --- 冷却时间与临时状态存储参数 ---
+WALK_COOLDOWN_SECONDS = 5 * 60
+DUEL_COOLDOWN_SECONDS = 30 * 60
+DISCARD_CONFIRM_SECONDS = 30
+EPHEMERAL_WHEEL_SLOTS = 512
+EPHEMERAL_TICK_SECONDS = 1.0
+EPHEMERAL_MAX_ENTRIES = 100_000
+
+# --- 性能指标 ---
+METRIC_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+METRIC_PHASES = ("db", "render", "battle", "lock")
+# 当前命令各阶段的耗时累加器 (每个事件处理任务独立)
+_PHASE_TIMES: contextvars.ContextVar[dict | None] = contextvars.ContextVar("pet_phase_times", default=None)
+
+# 当前命令的 SQL 追踪上下文: {"command": 命令名, "statements": 已执行语句数}
+_SQL_CONTEXT: contextvars.ContextVar[dict | None] = contextvars.ContextVar("pet_sql_context", default=None)
+SQL_TRACE_MAX_STATEMENTS = 1000
+SQL_TRACE_PARAM_SETS = 3         # executemany 只取前几组参数用于执行计划与慢查询日志，不展开整个序列
+SQL_TRACE_PARAM_CHARS = 300      # 慢查询日志中参数的最大长度
+SQL_TRACE_LOG_BACKUPS = 3        # 慢查询日志超过大小上限时轮转为 .1 ~ .3
+
+# --- 多进程访问 ---
+DB_BUSY_ERRORS = ("database is locked", "database is busy", "database table is locked")
+MAINTENANCE_LOCK_FILE = "maintenance.lock"
+MAINTENANCE_INIT_LOCK_TIMEOUT_SECONDS = 60  # 启动建表/迁移时等待其他进程维护完成的上限
+
+# --- 按需剖析 (/宠物剖析) ---
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+PROFILE_TOP_N = 10
+PROFILE_KEEP_FILES = 10
+
+# --- 时间列 ---
+# 旧版以 ISO 文本存储的时间列 -> 新的整数时间戳 (epoch 秒) 列
+EPOCH_TIME_COLUMNS = {
+    "last_fed_time": "last_fed_at",
+    "last_walk_time": "last_walk_at",
+    "last_duel_time": "last_duel_at",
+    "last_updated_time": "last_updated_at",
+    "last_signin_time": "last_signin_at",
+}
+EPOCH_MIGRATION_BATCH = 500
+
+# --- 冷数据归档 ---
+# 宠物最后一次活动的时间。pets 上有同一表达式的索引，查询时必须原样使用该字符串才能命中
+PET_LAST_ACTIVE_SQL = ("MAX(COALESCE(last_updated_at, 0), COALESCE(last_walk_at, 0), "
+                       "COALESCE(last_duel_at, 0), COALESCE(last_signin_at, 0))")
+# 归档条件: 时间全为 NULL (如旧数据中无法解析的 ISO 时间) 的宠物表达式值为 0，不知道多久没活动，不归档
+PET_INACTIVE_SINCE_SQL = f"{PET_LAST_ACTIVE_SQL} > 0 AND {PET_LAST_ACTIVE_SQL} < ?"
+ARCHIVE_BATCH_PAUSE_SECONDS = 0.05
+
+# --- 状态衰减与饥饿提醒 ---
+SATIETY_DECAY_PER_HOUR = 3
+MOOD_DECAY_PER_HOUR = 2
+# 预计归零时间 = 上次结算时间 + 当前值 × 每点耗时；由触发器维护，提醒扫描只需在索引上做范围查询
+SATIETY_EMPTY_AT_SQL = f"NEW.last_updated_at + NEW.satiety * {3600 // SATIETY_DECAY_PER_HOUR}"
+MOOD_EMPTY_AT_SQL = f"NEW.last_updated_at + NEW.mood * {3600 // MOOD_DECAY_PER_HOUR}"
+ALERT_SEND_PAUSE_SECONDS = 0.5
+
+# --- 战斗输出 ---
+BATTLE_HIGHLIGHT_LIMIT = 6     # 摘要中最多列出的关键时刻数
+BATTLE_DETAIL_NODE_NAME = "宠物战报"
+
+
+def paginate_lines(lines: list[str], max_chars: int) -> list[str]:
+    """把多行文本按行拼成不超过 max_chars 的若干页，单行过长时强制切开。"""
+    max_chars = max(1, max_chars)
+    pages, current = [], ""
+    for line in lines:
+        while len(line) > max_chars:
+            if current:
+                pages.append(current)
+                current = ""
+            pages.append(line[:max_chars])
+            line = line[max_chars:]
+        candidate = f"{current}\n{line}" if current else line
+        if len(candidate) > max_chars:
+            pages.append(current)
+            candidate = line
+        current = candidate
+    if current:
+        pages.append(current)
+    return pages
+
+
+def paginate_with_footer(lines: list[str], max_chars: int, footer) -> list[str]:
+    """
+    分页并给每页加上 footer(页码, 总页数) 返回的页脚，页脚也计入 max_chars。
+    页脚长度随页数位数变化，预留空间不够时缩小正文上限重新分页；上限连页脚都放不下时不加页脚。
+    """
+    reserve = 0
+    while True:
+        pages = paginate_lines(lines, max_chars - reserve)
+        needed = max(len(footer(number, len(pages))) for number in range(1, len(pages) + 1))
+        if needed <= reserve:
+            break
+        if needed >= max_chars:
+            return paginate_lines(lines, max_chars)
+        reserve = needed
+    return [page + footer(number, len(pages)) for number, page in enumerate(pages, 1)]
+
+
+# --- 金钱流水 (/账单) ---
+LEDGER_RETENTION_DAYS = 30       # 超过该天数的流水会被合并进快照
+LEDGER_COMPACT_INTERVAL_SECONDS = 3600
+LEDGER_COMPACT_BATCH = 2000
+LEDGER_PAGE_SIZE = 10
+LEDGER_MAX_PAGES = 50            # 直接跳页时退回 OFFSET 扫描，页码设上限
+LEDGER_CURSOR_TTL_SECONDS = 600  # 记住每页最后一条流水的 id，下一页从它继续 (keyset 分页)
+WALK_MONEY_REASONS = {"reward": "散步拾获", "pve": "野外战斗赏金", "minigame": "散步小游戏"}
+
+# --- 在线备份 (/宠物备份) ---
+BACKUP_DIR_NAME = "backups"
+BACKUP_PARTIAL_SUFFIX = ".partial"          # 未完成或未通过校验的备份目录，完成后改名去掉后缀
+BACKUP_STALE_PARTIAL_SECONDS = 86400        # 超过该时间的未完成目录 (进程中途退出留下的) 会被清理
+BACKUP_RETRY_DELAY_SECONDS = 600            # 定时备份失败后至少等待该时间再试
+BACKUP_MAX_RESTARTS = 3                     # 分步备份被并发写入打断重来的次数上限，超过后一次性复制
+
+# --- 全服排行 ---
+RANKING_SKIPLIST_MAX_LEVEL = 16
+RANKING_SKIPLIST_P = 0.25
+LEADERBOARD_RECONCILE_SECONDS = 600
+LEADERBOARD_TOP_N = 10
+
+# --- 宠物锁分片数 ---
+PET_LOCK_STRIPES = 256
+PET_LOCK_SLOW_WAIT_SECONDS = 1.0
+
+# --- 配置快照格式版本 (快照结构变化时递增，旧快照将被忽略) ---
+CONFIG_SNAPSHOT_VERSION = 2
+WALK_EVENT_TYPES = {"reward", "pve", "minigame", "nothing"}
+WALK_NOTHING_EVENT = {"type": "nothing", "description": "「{pet_name}」散了一圈, 但什么也没发生。"}
+
 STAT_MAP = {
     "exp": "经验值",
     "mood": "心情值",
@@ -136,6 +493,1183 @@ STAT_MAP = {
 }
 
 
+class WalkEventTable:
+    """预编译的单个散步事件池：累计权重 + 二分查找，每次抽取为 O(log n)。"""
+    __slots__ = ("events", "cum_weights", "total_weight")
+
+    def __init__(self, events: list[dict]):
+        self.events = []
+        weights = []
+        for event in events:
+            if not isinstance(event, dict):
+                logger.warning(f"忽略格式错误的散步事件: {event}")
+                continue
+            try:
+                weight = max(0.0, float(event.get('weight', 0) or 0))
+            except (TypeError, ValueError):
+                logger.warning(f"散步事件权重无效，按 0 处理: {event.get('weight')}")
+                weight = 0.0
+            self.events.append(event)
+            weights.append(weight)
+        self.cum_weights = list(accumulate(weights))
+        self.total_weight = self.cum_weights[-1] if self.cum_weights else 0.0
+
+    def to_state(self) -> dict:
+        return {"events": self.events, "cum_weights": self.cum_weights}
+
+    @classmethod
+    def from_state(cls, state: dict) -> "WalkEventTable":
+        table = cls.__new__(cls)
+        table.events = state["events"]
+        table.cum_weights = state["cum_weights"]
+        table.total_weight = table.cum_weights[-1] if table.cum_weights else 0.0
+        return table
+
+    def pick(self) -> dict | None:
+        if not self.events:
+            return None
+        if self.total_weight <= 0:
+            return random.choice(self.events)
+        roll = random.random() * self.total_weight
+        # bisect_right 会跳过权重为 0 的事件，与旧版 `roll < current_weight` 的线性扫描等价
+        return self.events[bisect.bisect_right(self.cum_weights, roll)]
+
+
+class WalkEventPools:
+    """
+    散步事件池集合，在加载配置时一次性编译。
+    walk_events.json 既可以是旧版的事件列表，也可以是如下结构:
+    {
+      "default": [...],
+      "level_pools": [{"min_level": 1, "max_level": 9, "events": [...]}],
+      "group_pools": {"群号": [...] 或 {"default": [...], "level_pools": [...]}}
+    }
+    选择顺序: 群专属事件池 -> 等级事件池 -> 默认事件池。
+    """
+    __slots__ = ("default", "level_starts", "level_pools", "group_pools")
+
+    def __init__(self, default: WalkEventTable, level_pools: list[tuple[int, int | None, WalkEventTable]],
+                 group_pools: dict[str, "WalkEventPools"]):
+        self.default = default
+        self.level_pools = sorted(level_pools, key=lambda p: p[0])
+        self.level_starts = [p[0] for p in self.level_pools]
+        self.group_pools = group_pools
+
+    @classmethod
+    def from_config(cls, raw: dict | list) -> "WalkEventPools":
+        if isinstance(raw, list):
+            return cls(WalkEventTable(raw), [], {})
+        if not isinstance(raw, dict):
+            logger.error("walk_events.json 格式错误，应为列表或对象，将使用空事件池。")
+            return cls(WalkEventTable([]), [], {})
+
+        level_pools = []
+        for pool in raw.get('level_pools', []):
+            try:
+                min_level = int(pool.get('min_level', 1))
+                max_level = pool.get('max_level')
+                max_level = int(max_level) if max_level is not None else None
+            except (AttributeError, TypeError, ValueError):
+                logger.warning(f"忽略格式错误的等级事件池: {pool}")
+                continue
+            level_pools.append((min_level, max_level, WalkEventTable(pool.get('events', []))))
+
+        group_pools = {}
+        for gid, pool in raw.get('group_pools', {}).items():
+            group_pools[str(gid)] = cls.from_config(pool)
+
+        return cls(WalkEventTable(raw.get('default', [])), level_pools, group_pools)
+
+    def to_state(self) -> dict:
+        return {
+            "default": self.default.to_state(),
+            "level_pools": [[lo, hi, table.to_state()] for lo, hi, table in self.level_pools],
+            "group_pools": {gid: pools.to_state() for gid, pools in self.group_pools.items()},
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "WalkEventPools":
+        return cls(
+            WalkEventTable.from_state(state["default"]),
+            [(lo, hi, WalkEventTable.from_state(table)) for lo, hi, table in state["level_pools"]],
+            {gid: cls.from_state(pools) for gid, pools in state["group_pools"].items()},
+        )
+
+    def table_for(self, level: int | None = None) -> WalkEventTable:
+        if level is not None and self.level_pools:
+            idx = bisect.bisect_right(self.level_starts, level) - 1
+            if idx >= 0:
+                _, max_level, table = self.level_pools[idx]
+                if (max_level is None or level <= max_level) and table.events:
+                    return table
+        return self.default
+
+    def pick(self, group_id: str | None = None, level: int | None = None) -> dict | None:
+        pools = self.group_pools.get(str(group_id), self) if group_id is not None else self
+        event = pools.table_for(level).pick()
+        if event is None and pools is not self:
+            event = self.table_for(level).pick()
+        return event
+
+
+class LearnsetIndex:
+    """
+    单个种族的技能学习表索引，在加载配置时一次性编译。
+    levels 为升序的解锁等级，unlocked[i] / unlocked_sets[i] 为达到 levels[i] 时累计可学的技能，
+    查询“某等级可学哪些技能”只需一次二分查找。
+    """
+    __slots__ = ("levels", "unlocked", "unlocked_sets", "new_by_level")
+
+    def __init__(self, learnset: dict):
+        by_level: dict[int, list[str]] = {}
+        for lvl_str, moves in learnset.items():
+            try:
+                lvl = int(lvl_str)
+            except (TypeError, ValueError):
+                logger.warning(f"忽略格式错误的技能学习等级: {lvl_str}")
+                continue
+            by_level.setdefault(lvl, []).extend(moves or [])
+
+        self.levels = sorted(by_level)
+        self.unlocked: list[tuple[str, ...]] = []
+        self.unlocked_sets: list[frozenset[str]] = []
+        self.new_by_level: dict[int, tuple[str, ...]] = {}
+        current: dict[str, None] = {}  # 利用 dict 保持顺序并去重
+        for lvl in self.levels:
+            self.new_by_level[lvl] = tuple(by_level[lvl])
+            current.update(dict.fromkeys(by_level[lvl]))
+            self.unlocked.append(tuple(current))
+            self.unlocked_sets.append(frozenset(current))
+
+    def to_state(self) -> dict:
+        return {
+            "levels": self.levels,
+            "unlocked": [list(moves) for moves in self.unlocked],
+            "new_by_level": [[lvl, list(moves)] for lvl, moves in self.new_by_level.items()],
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "LearnsetIndex":
+        index = cls.__new__(cls)
+        index.levels = state["levels"]
+        index.unlocked = [tuple(moves) for moves in state["unlocked"]]
+        index.unlocked_sets = [frozenset(moves) for moves in index.unlocked]
+        index.new_by_level = {lvl: tuple(moves) for lvl, moves in state["new_by_level"]}
+        return index
+
+    def _index_for(self, level: int) -> int:
+        return bisect.bisect_right(self.levels, level) - 1
+
+    def available(self, level: int) -> tuple[str, ...]:
+        """返回该等级下累计可学的技能（按解锁等级排序、已去重）。"""
+        idx = self._index_for(level)
+        return self.unlocked[idx] if idx >= 0 else ()
+
+    def can_learn(self, level: int, move_name: str) -> bool:
+        idx = self._index_for(level)
+        return idx >= 0 and move_name in self.unlocked_sets[idx]
+
+    def new_at(self, level: int) -> tuple[str, ...]:
+        """返回恰好在该等级新解锁的技能。"""
+        return self.new_by_level.get(level, ())
+
+
+EMPTY_LEARNSET = LearnsetIndex({})
+
+
+WILD_MOVE_PERMUTATION_LIMIT = 720  # 每个模板预展开的技能栏排列数上限
+
+
+class WildPetPool:
+    """
+    野生宠物模板池，在加载配置时一次性编译。
+    每个种族按技能学习表的解锁等级切分等级段，同一段内可用技能相同，预先生成一份紧凑模板，
+    并预先展开所有可能的技能栏排列 (数量不超过 WILD_MOVE_PERMUTATION_LIMIT 时)；
+    遭遇时只需抽取种族、二分定位等级段、复制模板并随机取一种排列。
+    种族按 walk_events.json 中的遭遇表抽取 (未配置或等级不在任何遭遇表内时所有种族等概率):
+    "encounter_tables": [{"min_level": 1, "max_level": 9, "species": {"草叶猫": 3, "火小犬": 1}}]
+    """
+    __slots__ = ("bands", "default_table", "table_starts", "tables")
+
+    def __init__(self, bands: dict[str, tuple[list[int], list[list]]], default_table: WalkEventTable,
+                 tables: list[tuple[int, int | None, WalkEventTable]]):
+        self.bands = bands  # 种族 -> (等级段起点, [[基础字段, 攻击, 防御, 可用技能, 技能栏排列], ...])
+        self.default_table = default_table
+        self.tables = sorted(tables, key=lambda t: t[0])
+        self.table_starts = [t[0] for t in self.tables]
+
+    @classmethod
+    def build(cls, pets_data: dict, learnsets: dict[str, LearnsetIndex], encounter_tables: list) -> "WildPetPool":
+        bands = {}
+        for type_name, info in pets_data.items():
+            learnset = learnsets.get(type_name, EMPTY_LEARNSET)
+            starts = sorted({1, *(lvl for lvl in learnset.levels if lvl > 1)})
+            base = {
+                "user_id": "0", "group_id": "0",  # 假ID
+                "pet_name": f"野生的{type_name}", "pet_type": type_name,
+                "satiety": 100, "mood": 100,
+                "status_condition": None, "held_item": None  # 野生宠物默认无状态
+            }
+            attack, defense = int(info['base_stats']['attack']), int(info['base_stats']['defense'])
+            templates = []
+            for start in starts:
+                moves = list(learnset.available(start)) or ["撞击"]
+                slots = min(len(moves), 4)
+                # 与 random.sample(moves, slots) 同分布；排列过多时退回遭遇时现场抽取
+                choices = ([list(p) + [None] * (4 - slots) for p in permutations(moves, slots)]
+                           if perm(len(moves), slots) <= WILD_MOVE_PERMUTATION_LIMIT else [])
+                templates.append([base, attack, defense, moves, choices])
+            bands[type_name] = (starts, templates)
+
+        tables = []
+        for table in encounter_tables or []:
+            try:
+                min_level = int(table.get('min_level', 1))
+                max_level = int(table['max_level']) if table.get('max_level') is not None else None
+                species = [{"species": name, "weight": float(weight)} for name, weight in table['species'].items()]
+            except (AttributeError, KeyError, TypeError, ValueError):
+                logger.warning(f"忽略格式错误的遭遇表: {table}")
+                continue
+            unknown = [entry['species'] for entry in species if entry['species'] not in bands]
+            if unknown:
+                logger.warning(f"遭遇表引用了不存在的宠物: {', '.join(unknown)} (已忽略)")
+            tables.append((min_level, max_level, WalkEventTable([e for e in species if e['species'] in bands])))
+        default_table = WalkEventTable([{"species": name, "weight": 1} for name in bands])
+        return cls(bands, default_table, tables)
+
+    def to_state(self) -> dict:
+        return {
+            "bands": {name: [starts, templates] for name, (starts, templates) in self.bands.items()},
+            "default": self.default_table.to_state(),
+            "tables": [[lo, hi, table.to_state()] for lo, hi, table in self.tables],
+        }
+
+    @classmethod
+    def from_state(cls, state: dict) -> "WildPetPool":
+        return cls(
+            {name: (starts, templates) for name, (starts, templates) in state["bands"].items()},
+            WalkEventTable.from_state(state["default"]),
+            [(lo, hi, WalkEventTable.from_state(table)) for lo, hi, table in state["tables"]],
+        )
+
+    def _table_for(self, level: int) -> WalkEventTable:
+        idx = bisect.bisect_right(self.table_starts, level) - 1
+        if idx >= 0:
+            _, max_level, table = self.tables[idx]
+            if (max_level is None or level <= max_level) and table.events:
+                return table
+        return self.default_table
+
+    def spawn(self, level: int) -> dict | None:
+        """生成一只指定等级的野生宠物；没有任何种族时返回 None。"""
+        entry = self._table_for(level).pick()
+        if entry is None:
+            return None
+        starts, templates = self.bands[entry['species']]
+        base, attack, defense, moves, choices = templates[bisect.bisect_right(starts, level) - 1]
+        chosen = choices[int(random.random() * len(choices))] if choices else random.sample(moves, 4)
+        npc = base.copy()
+        npc.update(level=level, attack=attack + level, defense=defense + level,
+                   move1=chosen[0], move2=chosen[1], move3=chosen[2], move4=chosen[3])
+        return npc
+
+
+class ShopCatalog:
+    """编译后的商店目录：按类型校验过的物品注册表，以及每个分类预先排版好的分页文本。"""
+    __slots__ = ("items", "categories", "pages", "version")
+
+    def __init__(self, raw: dict, version: int):
+        self.version = version
+        self.items: dict[str, dict] = {}
+        by_category: dict[str, list[str]] = {}
+        for name, item in (raw.items() if isinstance(raw, dict) else []):
+            try:
+                valid = int(item['price']) >= 0 and item['type'] in ITEM_EFFECT_HANDLERS
+            except (KeyError, TypeError, ValueError):
+                valid = False
+            if not valid:
+                logger.error(f"商店物品「{name}」配置无效 (需包含 price 与已知的 type)，已忽略。")
+                continue
+            self.items[name] = item
+            category = item.get('category') or ITEM_CATEGORY_MAP.get(item['type'], "其他")
+            by_category.setdefault(category, []).append(name)
+
+        self.categories = list(by_category)
+        self.pages: dict[str | None, list[str]] = {None: self._render_pages(list(self.items), None)}
+        for category, names in by_category.items():
+            self.pages[category] = self._render_pages(names, category)
+
+    def _render_pages(self, names: list[str], category: str | None) -> list[str]:
+        chunks = [names[i:i + SHOP_PAGE_SIZE] for i in range(0, len(names), SHOP_PAGE_SIZE)] or [[]]
+        title = f"欢迎光临宠物商店！【{category}】" if category else "欢迎光临宠物商店！"
+        pages = []
+        for page_no, chunk in enumerate(chunks, 1):
+            reply = f"{title}\n--------------------\n"
+            for name in chunk:
+                item = self.items[name]
+                reply += f"【{name}】 ${item['price']}\n效果: {item.get('description', '')}\n"
+            reply += "--------------------\n"
+            if len(chunks) > 1:
+                page_cmd = f"/宠物商店 {category} [页码]" if category else "/宠物商店 [页码]"
+                reply += f"第 {page_no}/{len(chunks)} 页，使用 `{page_cmd}` 翻页。\n"
+            if len(self.categories) > 1:
+                reply += f"分类: {'、'.join(self.categories)} (使用 `/宠物商店 [分类]` 筛选)\n"
+            reply += "使用 `/购买 [物品名] [数量]` 来购买。"
+            pages.append(reply)
+        return pages
+
+
+@contextmanager
+def metric_phase(name: str):
+    """将代码块的耗时计入当前命令的某个阶段 (嵌套时只计算自身耗时，不重复统计)。"""
+    acc = _PHASE_TIMES.get()
+    if acc is None:
+        yield
+        return
+    outer_child = acc.get("_child", 0.0)
+    acc["_child"] = 0.0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        acc[name] = acc.get(name, 0.0) + elapsed - acc["_child"]
+        acc["_child"] = outer_child + elapsed
+
+
+def timed_phase(name: str):
+    """装饰器版本的 metric_phase。"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metric_phase(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_phase_time(name: str, seconds: float):
+    acc = _PHASE_TIMES.get()
+    if acc is not None:
+        acc[name] = acc.get(name, 0.0) + seconds
+
+
+@functools.lru_cache(maxsize=1024)
+def normalize_sql(sql: str) -> str:
+    """归一化 SQL：合并空白、把字面量替换为 ?，便于按语句聚合。"""
+    sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    sql = re.sub(r"\b\d+(?:\.\d+)?\b", "?", sql)
+    return " ".join(sql.split())
+
+
+class SqlTracer:
+    """按命令统计 SQL 语句数量与耗时，并把慢查询连同 EXPLAIN QUERY PLAN 写入日志。"""
+
+    def __init__(self, slow_query_seconds: float, slow_log_path: Path, slow_log_max_bytes: int):
+        self.slow_query_seconds = slow_query_seconds
+        self.slow_log_path = slow_log_path
+        self.slow_log_max_bytes = slow_log_max_bytes
+        self.commands: dict[str, dict] = {}  # 命令 -> {"invocations", "statements", "seconds", "max_statements"}
+        self.statements: dict[tuple[str, str], list] = {}  # (命令, 归一化SQL) -> [次数, 总耗时, 最大耗时]
+        self.slow_queries = 0
+
+    def _command_stats(self, command: str) -> dict:
+        stats = self.commands.get(command)
+        if stats is None:
+            stats = self.commands[command] = {"invocations": 0, "statements": 0, "seconds": 0.0, "max_statements": 0}
+        return stats
+
+    def record(self, connection: sqlite3.Connection, sql: str, param_sets: list, seconds: float):
+        """param_sets: 本次执行的 (前几组) 参数，execute 为一组，executemany 最多 SQL_TRACE_PARAM_SETS 组。"""
+        context = _SQL_CONTEXT.get()
+        command = context['command'] if context else "background"
+        if context:
+            context['statements'] += 1
+
+        stats = self._command_stats(command)
+        stats['statements'] += 1
+        stats['seconds'] += seconds
+
+        key = (command, normalize_sql(sql))
+        entry = self.statements.get(key)
+        if entry is None:
+            if len(self.statements) >= SQL_TRACE_MAX_STATEMENTS:
+                key = (command, "(其它语句)")
+            entry = self.statements.setdefault(key, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+
+        if seconds >= self.slow_query_seconds:
+            self._log_slow_query(connection, command, sql, param_sets, seconds)
+
+    def end_command(self, context: dict):
+        stats = self._command_stats(context['command'])
+        stats['invocations'] += 1
+        stats['max_statements'] = max(stats['max_statements'], context['statements'])
+
+    def _log_slow_query(self, connection: sqlite3.Connection, command: str, sql: str, param_sets: list, seconds: float):
+        self.slow_queries += 1
+        plan = []
+        if sql.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE", "INSERT", "WITH")):
+            try:
+                # 绕过埋点，避免 EXPLAIN 本身被再次统计
+                rows = sqlite3.Connection.execute(connection, f"EXPLAIN QUERY PLAN {sql}",
+                                                  param_sets[0] if param_sets else ()).fetchall()
+                plan = [f"    {row[-1]}" for row in rows]
+            except sqlite3.Error as e:
+                plan = [f"    (无法获取执行计划: {e})"]
+        lines = [f"[{datetime.now().isoformat(timespec='seconds')}] {command} {seconds * 1000:.1f}ms {normalize_sql(sql)}"]
+        if param_sets:
+            params_text = ", ".join(repr(params) for params in param_sets)
+            if len(params_text) > SQL_TRACE_PARAM_CHARS:
+                params_text = params_text[:SQL_TRACE_PARAM_CHARS] + "…"
+            lines.append(f"    参数: {params_text}")
+        lines.extend(plan)
+        try:
+            self._rotate_slow_log()
+            with open(self.slow_log_path, 'a', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+        except OSError as e:
+            logger.warning(f"写入慢查询日志失败: {e}")
+
+    def _rotate_slow_log(self):
+        """日志超过大小上限时依次改名为 .1 ~ .N，最旧的一份被丢弃。"""
+        try:
+            if self.slow_log_path.stat().st_size < self.slow_log_max_bytes:
+                return
+        except FileNotFoundError:
+            return
+        for index in range(SQL_TRACE_LOG_BACKUPS - 1, 0, -1):
+            older = self.slow_log_path.with_name(f"{self.slow_log_path.name}.{index}")
+            if older.exists():
+                older.replace(self.slow_log_path.with_name(f"{self.slow_log_path.name}.{index + 1}"))
+        self.slow_log_path.replace(self.slow_log_path.with_name(f"{self.slow_log_path.name}.1"))
+
+    def summary(self, command: str | None = None, top: int = 5) -> str:
+        if not self.commands:
+            return "暂无 SQL 追踪数据。"
+        if command is not None:
+            stats = self.commands.get(command)
+            if not stats:
+                return f"没有命令「{command}」的 SQL 追踪数据。"
+            invocations = max(stats['invocations'], 1)
+            reply = (f"🔍 {command}: {stats['invocations']}次调用，共 {stats['statements']} 条语句 "
+                     f"(平均 {stats['statements'] / invocations:.1f} 条，最多 {stats['max_statements']} 条)，"
+                     f"耗时 {stats['seconds'] * 1000:.1f}ms\n--------------------\n")
+            entries = sorted(((sql, e) for (cmd, sql), e in self.statements.items() if cmd == command),
+                             key=lambda item: -item[1][1])[:top]
+            for sql, (count, total, worst) in entries:
+                reply += f"{count}次 共{total * 1000:.1f}ms 最慢{worst * 1000:.1f}ms\n  {sql}\n"
+            return reply.rstrip()
+
+        reply = f"🔍 SQL 追踪统计 (慢查询 {self.slow_queries} 条)\n--------------------\n"
+        for cmd, stats in sorted(self.commands.items(), key=lambda kv: -kv[1]['seconds']):
+            invocations = max(stats['invocations'], 1)
+            reply += (f"{cmd}: 平均 {stats['statements'] / invocations:.1f} 条/次，"
+                      f"最多 {stats['max_statements']} 条，累计 {stats['seconds'] * 1000:.1f}ms\n")
+        reply += "使用 `/宠物SQL统计 [命令名]` 查看某个命令的语句明细。"
+        return reply
+
+
+def is_busy_error(error: Exception) -> bool:
+    return isinstance(error, sqlite3.OperationalError) and any(text in str(error) for text in DB_BUSY_ERRORS)
+
+
+class BusyRetryPolicy:
+    """
+    SQLite 忙错误的重试策略 (以事务为单位)。每次尝试中的等待由 SQLite 的 busy_timeout 完成；
+    仍返回 "database is locked" 时，出错的事务已随连接回滚 (语句级重试无法解开两个事务互相等待的死锁)，
+    按抖动指数退避后从头重试整个事务。命令在事件循环中用 asyncio.sleep 退避 (见 pet_command)，
+    工作线程中的任务用 run_blocking。
+    """
+
+    def __init__(self, max_retries: int, backoff_seconds: float):
+        self.max_retries = max(0, max_retries)
+        self.backoff_seconds = max(0.0, backoff_seconds)
+        self.busy_transactions = 0  # 遇到过忙错误的事务数
+        self.retries = 0
+        self.failures = 0           # 重试耗尽 (或已提交过写入无法重试) 后仍失败的事务数
+        self.wait_seconds = 0.0     # 这些事务从首次尝试到成功/失败的总耗时 (含 SQLite 内部等待)
+
+    def next_delay(self, error: sqlite3.OperationalError, attempt: int, start: float, retryable: bool = True) -> float:
+        """第 attempt 次尝试遇到忙错误后调用：返回下次重试前的退避秒数；不能再重试时记录并重新抛出该错误。"""
+        if attempt == 0:
+            self.busy_transactions += 1
+        if attempt >= self.max_retries or not retryable:
+            self.failures += 1
+            self.wait_seconds += time.perf_counter() - start
+            logger.error(f"数据库持续被锁，重试 {attempt} 次后放弃: {error}")
+            raise error
+        self.retries += 1
+        return self.backoff_seconds * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def succeeded(self, attempt: int, start: float):
+        if attempt:
+            self.wait_seconds += time.perf_counter() - start
+
+    def run_blocking(self, transaction):
+        """在工作线程中执行可整体重做的事务函数 (如建表迁移)，遇到忙错误时阻塞退避后重做。"""
+        attempt, start = 0, time.perf_counter()
+        while True:
+            try:
+                result = transaction()
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e):
+                    raise
+                time.sleep(self.next_delay(e, attempt, start))
+                attempt += 1
+                continue
+            self.succeeded(attempt, start)
+            return result
+
+    def stats(self) -> dict:
+        return {"busy_transactions": self.busy_transactions, "retries": self.retries,
+                "failures": self.failures, "wait_seconds": self.wait_seconds}
+
+
+def _run_statement(connection: sqlite3.Connection, sql: str, param_sets: list, run):
+    """执行语句：耗时计入 db 阶段，开启追踪时同时交给 SqlTracer 记录。"""
+    tracer = getattr(connection, "tracer", None)
+    start = time.perf_counter()
+    with metric_phase("db"):
+        result = run()
+    if tracer is not None:
+        tracer.record(connection, sql, param_sets, time.perf_counter() - start)
+    return result
+
+
+def _peek_parameters(tracer: SqlTracer | None, seq_of_parameters) -> tuple[list, object]:
+    """追踪开启时取出 executemany 的前几组参数，返回 (前几组参数, 交给 SQLite 的完整序列)；生成器不会被整个展开。"""
+    if tracer is None:
+        return [], seq_of_parameters
+    if isinstance(seq_of_parameters, (list, tuple)):
+        return list(seq_of_parameters[:SQL_TRACE_PARAM_SETS]), seq_of_parameters
+    iterator = iter(seq_of_parameters)
+    head = list(islice(iterator, SQL_TRACE_PARAM_SETS))
+    return head, chain(head, iterator)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """执行耗时计入 db 阶段的游标。"""
+
+    def execute(self, sql, parameters=()):
+        return _run_statement(self.connection, sql, [parameters],
+                              lambda: super(InstrumentedCursor, self).execute(sql, parameters))
+
+    def executemany(self, sql, seq_of_parameters):
+        head, seq_of_parameters = _peek_parameters(getattr(self.connection, "tracer", None), seq_of_parameters)
+        return _run_statement(self.connection, sql, head,
+                              lambda: super(InstrumentedCursor, self).executemany(sql, seq_of_parameters))
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """执行耗时计入 db 阶段的数据库连接，可挂载 SqlTracer 进行语句追踪；提交次数计入当前命令 (决定忙错误能否重试)。"""
+    tracer: SqlTracer | None = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return _run_statement(self, sql, [parameters],
+                              lambda: super(InstrumentedConnection, self).execute(sql, parameters))
+
+    def executemany(self, sql, seq_of_parameters):
+        head, seq_of_parameters = _peek_parameters(self.tracer, seq_of_parameters)
+        return _run_statement(self, sql, head,
+                              lambda: super(InstrumentedConnection, self).executemany(sql, seq_of_parameters))
+
+    def commit(self):
+        has_changes = self.in_transaction
+        with metric_phase("db"):
+            super().commit()
+        context = _SQL_CONTEXT.get()
+        if has_changes and context is not None:
+            context['commits'] += 1
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # sqlite3.Connection 自带的 __exit__ 不会调用子类的 commit，这里改为显式调用以便计数
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+class LatencyHistogram:
+    """固定分桶的耗时直方图。"""
+    __slots__ = ("bucket_counts", "count", "total")
+
+    def __init__(self):
+        self.bucket_counts = [0] * (len(METRIC_LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float):
+        self.bucket_counts[bisect.bisect_left(METRIC_LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def quantile(self, q: float) -> float:
+        """按分桶上界估算分位数。"""
+        target, cumulative = q * self.count, 0
+        for idx, bucket_count in enumerate(self.bucket_counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return METRIC_LATENCY_BUCKETS[idx] if idx < len(METRIC_LATENCY_BUCKETS) else float("inf")
+        return 0.0
+
+
+def _prom_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        escaped.append(f'{key}="{value}"')
+    return "{" + ",".join(escaped) + "}"
+
+
+class PluginMetrics:
+    """按命令、按群统计调用次数、错误次数与分阶段耗时。"""
+
+    def __init__(self):
+        self.calls: dict[str, int] = {}
+        self.errors: dict[str, int] = {}
+        self.latency: dict[tuple[str, str], LatencyHistogram] = {}
+        self.group_calls: dict[str, int] = {}
+        self.group_errors: dict[str, int] = {}
+        self.group_seconds: dict[str, float] = {}
+
+    def observe_command(self, command: str, group_id: str | None, seconds: float, phases: dict, failed: bool):
+        group = str(group_id or "private")
+        self.calls[command] = self.calls.get(command, 0) + 1
+        self.group_calls[group] = self.group_calls.get(group, 0) + 1
+        self.group_seconds[group] = self.group_seconds.get(group, 0.0) + seconds
+        if failed:
+            self.errors[command] = self.errors.get(command, 0) + 1
+            self.group_errors[group] = self.group_errors.get(group, 0) + 1
+
+        self._histogram(command, "total").observe(seconds)
+        for phase in METRIC_PHASES:
+            if phase in phases:
+                self._histogram(command, phase).observe(phases[phase])
+
+    def _histogram(self, command: str, phase: str) -> LatencyHistogram:
+        histogram = self.latency.get((command, phase))
+        if histogram is None:
+            histogram = self.latency[(command, phase)] = LatencyHistogram()
+        return histogram
+
+    def render_prometheus(self, extra: list[tuple[str, str, str, list[tuple[dict, float]]]]) -> str:
+        """
+        以 Prometheus 文本格式输出全部指标。
+        extra 为插件其它组件提供的指标: (名称, 类型, 说明, [(标签, 值)])。
+        """
+        lines = []
+
+        def family(name, metric_type, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_prom_labels(labels)} {value}")
+
+        family("pet_command_calls_total", "counter", "Command invocations.",
+               [({"command": c}, n) for c, n in self.calls.items()])
+        family("pet_command_errors_total", "counter", "Command invocations that raised.",
+               [({"command": c}, n) for c, n in self.errors.items()])
+
+        lines.append("# HELP pet_command_duration_seconds Command latency by phase.")
+        lines.append("# TYPE pet_command_duration_seconds histogram")
+        for (command, phase), histogram in self.latency.items():
+            cumulative = 0
+            for idx, bucket_count in enumerate(histogram.bucket_counts):
+                cumulative += bucket_count
+                le = str(METRIC_LATENCY_BUCKETS[idx]) if idx < len(METRIC_LATENCY_BUCKETS) else "+Inf"
+                labels = _prom_labels({"command": command, "phase": phase, "le": le})
+                lines.append(f"pet_command_duration_seconds_bucket{labels} {cumulative}")
+            labels = _prom_labels({"command": command, "phase": phase})
+            lines.append(f"pet_command_duration_seconds_sum{labels} {histogram.total}")
+            lines.append(f"pet_command_duration_seconds_count{labels} {histogram.count}")
+
+        family("pet_group_calls_total", "counter", "Command invocations per group.",
+               [({"group": g}, n) for g, n in self.group_calls.items()])
+        family("pet_group_errors_total", "counter", "Failed command invocations per group.",
+               [({"group": g}, n) for g, n in self.group_errors.items()])
+        family("pet_group_duration_seconds_total", "counter", "Total command latency per group.",
+               [({"group": g}, n) for g, n in self.group_seconds.items()])
+        for name, metric_type, help_text, samples in extra:
+            family(name, metric_type, help_text, samples)
+        return "\n".join(lines) + "\n"
+
+
+class TokenBucket:
+    """令牌桶：按固定速率回复令牌，取不到令牌即拒绝。"""
+    __slots__ = ("capacity", "rate", "tokens", "updated_at", "notified_at")
+
+    def __init__(self, capacity: float, rate: float, now: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = now
+        self.notified_at = 0.0
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+
+class CommandRateLimiter:
+    """按群、按用户、按命令开销等级的准入控制。"""
+
+    def __init__(self, budgets: dict):
+        self.budgets = budgets
+        self._buckets: dict[tuple, TokenBucket] = {}
+        self._last_prune = time.monotonic()
+        self.admitted: dict[str, int] = {}
+        self.shed: dict[tuple[str, str], int] = {}
+
+    def _bucket(self, key: tuple, budget: dict, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(
+                float(budget['capacity']), float(budget['refill_per_second']), now)
+        else:
+            bucket.refill(now)
+        return bucket
+
+    def check(self, cost_class: str, group_id: str | None, user_id: str) -> tuple[str | None, bool]:
+        """
+        尝试为一次命令扣除令牌。
+        返回 (被拒绝的范围 "user"/"group"，是否需要发送提示)；允许执行时范围为 None。
+        """
+        budget = self.budgets.get(cost_class)
+        if not budget:
+            return None, False
+
+        now = time.monotonic()
+        if now - self._last_prune > RATE_LIMIT_BUCKET_IDLE_SECONDS:
+            self._prune(now)
+
+        buckets = [("user", self._bucket((cost_class, "user", group_id, user_id), budget['user'], now))]
+        if group_id:
+            buckets.append(("group", self._bucket((cost_class, "group", group_id), budget['group'], now)))
+
+        for scope, bucket in buckets:
+            if bucket.tokens < 1:
+                self.shed[(cost_class, scope)] = self.shed.get((cost_class, scope), 0) + 1
+                # 同一个桶在回复一枚令牌的时间内只提示一次，避免刷屏时放大消息量
+                notify = now - bucket.notified_at >= 1 / max(bucket.rate, 1e-6)
+                if notify:
+                    bucket.notified_at = now
+                return scope, notify
+
+        for _, bucket in buckets:
+            bucket.tokens -= 1
+        self.admitted[cost_class] = self.admitted.get(cost_class, 0) + 1
+        return None, False
+
+    def _prune(self, now: float):
+        """丢弃长时间未使用且已经回满的桶，限制内存占用。"""
+        self._last_prune = now
+        for key, bucket in list(self._buckets.items()):
+            if now - bucket.updated_at > RATE_LIMIT_BUCKET_IDLE_SECONDS:
+                del self._buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class EphemeralStore:
+    """
+    带 TTL 的临时状态存储，基于哈希时间轮实现：
+    写入/删除/过期均为 O(1)，后台按 tick 推进指针清扫到期的槽位，条目总数有上限。
+    用于丢弃确认、冷却时间戳、待确认的挑战等只需要短暂保存在内存里的状态。
+    """
+
+    def __init__(self, slots: int = EPHEMERAL_WHEEL_SLOTS, tick_seconds: float = EPHEMERAL_TICK_SECONDS,
+                 max_entries: int = EPHEMERAL_MAX_ENTRIES):
+        self.tick_seconds = tick_seconds
+        self.max_entries = max_entries
+        self._wheel: list[dict] = [{} for _ in range(slots)]  # 槽位 -> {key: None}
+        self._entries: dict = {}  # key -> (到期时间, 槽位, 值)
+        self._swept_tick = self._tick_of(time.monotonic())
+        self.expired = 0
+        self.evicted = 0
+
+    def _tick_of(self, moment: float) -> int:
+        return int(moment / self.tick_seconds)
+
+    def set(self, key, value, ttl: float):
+        self.delete(key)
+        if len(self._entries) >= self.max_entries:
+            self._evict_one()
+        expire_at = time.monotonic() + ttl
+        slot = self._tick_of(expire_at) % len(self._wheel)
+        self._wheel[slot][key] = None
+        self._entries[key] = (expire_at, slot, value)
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        if entry[0] <= time.monotonic():
+            self.delete(key)
+            self.expired += 1
+            return default
+        return entry[2]
+
+    def ttl(self, key) -> float | None:
+        """返回剩余存活秒数，不存在或已过期时返回 None。"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        remaining = entry[0] - time.monotonic()
+        if remaining <= 0:
+            self.delete(key)
+            self.expired += 1
+            return None
+        return remaining
+
+    def pop(self, key, default=None):
+        value = self.get(key, default)
+        self.delete(key)
+        return value
+
+    def delete(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._wheel[entry[1]].pop(key, None)
+
+    def sweep(self) -> int:
+        """推进时间轮指针，清理所有已经到期的条目，返回清理数量。"""
+        now = time.monotonic()
+        current_tick = self._tick_of(now)
+        ticks = range(self._swept_tick + 1, current_tick + 1)
+        if len(ticks) > len(self._wheel):
+            ticks = range(current_tick - len(self._wheel) + 1, current_tick + 1)
+        self._swept_tick = current_tick
+
+        removed = 0
+        for tick in ticks:
+            bucket = self._wheel[tick % len(self._wheel)]
+            for key in list(bucket):
+                # 同一槽位中可能混有下几圈才到期的条目
+                if self._entries[key][0] <= now:
+                    self.delete(key)
+                    removed += 1
+        self.expired += removed
+        return removed
+
+    def _evict_one(self):
+        """容量已满时淘汰最早到期的槽位中的一个条目。"""
+        slots = len(self._wheel)
+        start = self._swept_tick + 1
+        for offset in range(slots):
+            bucket = self._wheel[(start + offset) % slots]
+            if bucket:
+                self.delete(next(iter(bucket)))
+                self.evicted += 1
+                return
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "expired": self.expired, "evicted": self.evicted}
+
+
+class RankingSkipList:
+    """
+    可索引跳表：每层指针记录跨越的底层节点数 (width)，
+    因此插入、删除、求名次、按名次取元素都是 O(log n)。键越小排名越靠前。
+    """
+    __slots__ = ("head", "size")
+
+    class _Node:
+        __slots__ = ("key", "next", "width")
+
+        def __init__(self, key, level: int):
+            self.key = key
+            self.next = [None] * level
+            self.width = [1] * level
+
+    def __init__(self):
+        self.head = self._Node(None, RANKING_SKIPLIST_MAX_LEVEL)
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    @staticmethod
+    def _random_level() -> int:
+        level = 1
+        while level < RANKING_SKIPLIST_MAX_LEVEL and random.random() < RANKING_SKIPLIST_P:
+            level += 1
+        return level
+
+    def insert(self, key):
+        update = [None] * RANKING_SKIPLIST_MAX_LEVEL
+        update_pos = [0] * RANKING_SKIPLIST_MAX_LEVEL
+        node, pos = self.head, 0
+        for i in reversed(range(RANKING_SKIPLIST_MAX_LEVEL)):
+            while node.next[i] is not None and node.next[i].key < key:
+                pos += node.width[i]
+                node = node.next[i]
+            update[i], update_pos[i] = node, pos
+
+        level = self._random_level()
+        new_node = self._Node(key, level)
+        for i in range(RANKING_SKIPLIST_MAX_LEVEL):
+            if i < level:
+                new_node.next[i] = update[i].next[i]
+                new_node.width[i] = update[i].width[i] - (pos - update_pos[i])
+                update[i].next[i] = new_node
+                update[i].width[i] = pos + 1 - update_pos[i]
+            else:
+                update[i].width[i] += 1
+        self.size += 1
+
+    def remove(self, key) -> bool:
+        update = [None] * RANKING_SKIPLIST_MAX_LEVEL
+        node = self.head
+        for i in reversed(range(RANKING_SKIPLIST_MAX_LEVEL)):
+            while node.next[i] is not None and node.next[i].key < key:
+                node = node.next[i]
+            update[i] = node
+        target = node.next[0]
+        if target is None or target.key != key:
+            return False
+        for i in range(RANKING_SKIPLIST_MAX_LEVEL):
+            if update[i].next[i] is target:
+                update[i].width[i] += target.width[i] - 1
+                update[i].next[i] = target.next[i]
+            else:
+                update[i].width[i] -= 1
+        self.size -= 1
+        return True
+
+    def rank(self, key) -> int | None:
+        """返回键的名次 (从 1 开始)，不存在时返回 None。"""
+        node, pos = self.head, 0
+        for i in reversed(range(RANKING_SKIPLIST_MAX_LEVEL)):
+            while node.next[i] is not None and node.next[i].key <= key:
+                pos += node.width[i]
+                node = node.next[i]
+        return pos if node is not self.head and node.key == key else None
+
+    def from_rank(self, rank: int, count: int) -> list:
+        """从第 rank 名开始 (从 1 开始) 依次取出最多 count 个键。"""
+        if rank < 1 or rank > self.size:
+            return []
+        node, pos = self.head, 0
+        for i in reversed(range(RANKING_SKIPLIST_MAX_LEVEL)):
+            while node.next[i] is not None and pos + node.width[i] <= rank:
+                pos += node.width[i]
+                node = node.next[i]
+        keys = []
+        while node is not None and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class GlobalLeaderboard:
+    """
+    全服宠物排行：跳表维护 (-等级, -经验, 用户, 群) 的顺序，entries 记录每只宠物当前的键和名字。
+    touched 不为 None 时记录发生过增量更新的宠物，后台重建期间的变化据此补到新排行上。
+    """
+    __slots__ = ("ranks", "entries", "touched")
+
+    def __init__(self):
+        self.ranks = RankingSkipList()
+        self.entries: dict[tuple[int, int], tuple[tuple, str]] = {}
+        self.touched: set[tuple[int, int]] | None = None
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def update(self, user_id, group_id, pet_name: str, level: int, exp: int):
+        ident = (int(user_id), int(group_id))
+        if self.touched is not None:
+            self.touched.add(ident)
+        key = (-int(level), -int(exp), ident[0], ident[1])
+        current = self.entries.get(ident)
+        if current is not None:
+            if current[0] == key:
+                if current[1] != pet_name:
+                    self.entries[ident] = (key, pet_name)
+                return
+            self.ranks.remove(current[0])
+        self.ranks.insert(key)
+        self.entries[ident] = (key, pet_name)
+
+    def remove(self, user_id, group_id):
+        if self.touched is not None:
+            self.touched.add((int(user_id), int(group_id)))
+        current = self.entries.pop((int(user_id), int(group_id)), None)
+        if current is not None:
+            self.ranks.remove(current[0])
+
+    def rank_of(self, user_id, group_id) -> int | None:
+        current = self.entries.get((int(user_id), int(group_id)))
+        return self.ranks.rank(current[0]) if current else None
+
+    def top(self, count: int, start: int = 1) -> list[tuple[int, int, int, str, int, int]]:
+        """返回 [(名次, 用户, 群, 宠物名, 等级, 经验)]。"""
+        return [(start + offset, key[2], key[3], self.entries[(key[2], key[3])][1], -key[0], -key[1])
+                for offset, key in enumerate(self.ranks.from_rank(start, count))]
+
+
+class StripedLockManager:
+    """
+    按 (user_id, group_id) 分片的异步锁，保证同一只宠物的“读-改-写”不会被并发命令打断。
+    需要同时持有多把锁时 (如对决) 按分片序号升序加锁，避免死锁。
+    """
+
+    def __init__(self, stripes: int = PET_LOCK_STRIPES):
+        self._locks = [asyncio.Lock() for _ in range(stripes)]
+        self.acquisitions = 0
+        self.contended = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _stripe(self, key: tuple[str, str]) -> int:
+        return hash((str(key[0]), str(key[1]))) % len(self._locks)
+
+    @asynccontextmanager
+    async def hold(self, *keys: tuple[str, str]):
+        stripes = sorted({self._stripe(key) for key in keys})
+        start = time.perf_counter()
+        acquired = []
+        try:
+            for idx in stripes:
+                lock = self._locks[idx]
+                if lock.locked():
+                    self.contended += 1
+                await lock.acquire()
+                acquired.append(lock)
+
+            waited = time.perf_counter() - start
+            record_phase_time("lock", waited)
+            self.acquisitions += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            if waited >= PET_LOCK_SLOW_WAIT_SECONDS:
+                logger.warning(f"等待宠物锁耗时 {waited:.2f}s: {keys}")
+            yield
+        finally:
+            for lock in reversed(acquired):
+                lock.release()
+
+    def stats(self) -> dict:
+        return {
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+
+def pet_command(lock: str | None = "sender", cost: str = "write"):
+    """
+    宠物命令处理器的统一包装。
+    lock: "sender" 锁住发送者的宠物；"duel" 同时锁住发送者与被@对手的宠物；None 不加锁。
+    cost: 命令开销等级 (render / battle / write / read)，用于限流。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, event, *args, **kwargs):
+            group_id = event.get_group_id()
+
+            # --- 准入控制：在读取数据库之前先扣除令牌 ---
+            if self.rate_limiter is not None:
+                shed_scope, notify = self.rate_limiter.check(cost, group_id, event.get_sender_id())
+                if shed_scope:
+                    if notify:
+                        yield event.plain_result(RATE_LIMIT_REPLIES[shed_scope])
+                    return
+
+            # --- 插件刚加载时，等待后台初始化 (配置与建表) 完成 ---
+            if not await self._wait_ready():
+                yield event.plain_result(INIT_FAILED_REPLY)
+                return
+
+            keys = []
+            if lock and group_id:
+                keys.append((event.get_sender_id(), group_id))
+                if lock == "duel":
+                    target_id = self.get_at(event)
+                    if target_id:
+                        keys.append((target_id, group_id))
+
+            # --- 性能统计：只计算处理器实际运行的时间，不含等待消息发送的时间 ---
+            phase_token = _PHASE_TIMES.set({})
+            sql_context = {"command": func.__name__, "statements": 0, "commits": 0}
+            sql_token = _SQL_CONTEXT.set(sql_context)
+            busy_seconds, failed = 0.0, False
+            resumed_at = started_at = time.perf_counter()
+            attempt = 0
+            try:
+                while True:
+                    emitted = False
+                    try:
+                        if keys:
+                            # 加锁的命令先在锁内跑完并缓存回复，释放宠物锁后再发送，锁不会跨越网络发送
+                            async with self.pet_locks.hold(*keys):
+                                results = [result async for result in func(self, event, *args, **kwargs)]
+                            busy_seconds += time.perf_counter() - resumed_at
+                            resumed_at, emitted = None, True
+                            for result in results:
+                                yield result
+                        else:
+                            async for result in func(self, event, *args, **kwargs):
+                                busy_seconds += time.perf_counter() - resumed_at
+                                resumed_at, emitted = None, True
+                                yield result
+                                resumed_at = time.perf_counter()
+                        break
+                    except sqlite3.OperationalError as e:
+                        if not is_busy_error(e):
+                            raise
+                        # 出错的事务已随连接回滚；尚未发出回复、也没有提交过写入时，异步退避后从头重做整个命令
+                        delay = self.busy_policy.next_delay(e, attempt, started_at,
+                                                            retryable=not emitted and not sql_context['commits'])
+                        attempt += 1
+                        await asyncio.sleep(delay)
+                self.busy_policy.succeeded(attempt, started_at)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                if resumed_at is not None:
+                    busy_seconds += time.perf_counter() - resumed_at
+                self.metrics.observe_command(func.__name__, group_id, busy_seconds, _PHASE_TIMES.get() or {}, failed)
+                if self.sql_tracer is not None:
+                    self.sql_tracer.end_command(sql_context)
+                try:
+                    _PHASE_TIMES.reset(phase_token)
+                    _SQL_CONTEXT.reset(sql_token)
+                except ValueError:
+                    pass  # 生成器在其它上下文中被关闭
+        return wrapper
+    return decorator
+
+
+def shard_index(group_id, shard_count: int) -> int:
+    """按群号计算所在分片 (crc32 取模，跨进程、跨版本稳定；tools/reshard.py 使用同一算法)。"""
+    if shard_count <= 1:
+        return 0
+    return zlib.crc32(str(group_id).encode()) % shard_count
+
+
+def shard_db_paths(data_dir: Path, shard_count: int) -> list[Path]:
+    """各分片的数据库文件。未分片时沿用原来的 pets.db。"""
+    if shard_count <= 1:
+        return [data_dir / "pets.db"]
+    return [data_dir / f"pets_shard{i}.db" for i in range(shard_count)]
+
+
 @register(
     "简易群宠物游戏",
     "DITF16",
@@ -146,30 +1680,465 @@ STAT_MAP = {
 class PetPlugin(Star):
     def __init__(self, context: Context):
         super().__init__(context)
+        init_start = time.perf_counter()
         self.data_dir = StarTools.get_data_dir("astrbot_plugin_pet")
         self.data_dir.mkdir(parents=True, exist_ok=True)
         self.cache_dir = self.data_dir / "cache"
         self.cache_dir.mkdir(parents=True, exist_ok=True)
         self.assets_dir = Path(__file__).parent / "assets"
-        self.db_path = self.data_dir / "pets.db"
 
         # --- JSON 配置文件路径 ---
         self.events_path = self.data_dir / "walk_events.json"
         self.pets_path = self.data_dir / "pets.json"
         self.moves_path = self.data_dir / "moves.json"
+        self.shop_path = self.data_dir / "shop.json"
+        self.settings_path = self.data_dir / "settings.json"
+        self.settings = self._load_settings()
+
+        # --- 数据库分片 (shards == 1 时只有 pets.db) ---
+        self.shard_count = max(1, int(self.settings['storage']['shards']))
+        self.db_paths = shard_db_paths(self.data_dir, self.shard_count)
+        self.db_path = self.db_paths[0]
+        storage = self.settings['storage']
+        self.busy_policy = BusyRetryPolicy(storage['busy_retries'], storage['busy_backoff_ms'] / 1000)
+        # thread_local=False: 初始化在工作线程中获取，后台任务在事件循环线程中获取，同一进程内可重入
+        self._file_lock = (filelock.FileLock(self.data_dir / MAINTENANCE_LOCK_FILE, thread_local=False)
+                           if filelock is not None else None)
+        self.maintenance_stats = {"acquired": 0, "skipped": 0, "wait_seconds": 0.0}
+
+        self.config_snapshot_path = self.cache_dir / "config_snapshot.msgpack"
+
+        # --- 商店目录 (支持热重载，首次加载在后台初始化中完成) ---
+        self.shop_catalog = None
+        self._shop_mtime_ns = None
+        self._shop_checked_at = 0.0
+
+        self.ephemeral = EphemeralStore()
+        self.metrics = PluginMetrics()
+        self.sql_tracer = self._new_sql_tracer() if self.settings['sql_trace']['enabled'] else None
+        self._profiling = False
+        self._background_tasks = []
+        self._start_background_task(self._ephemeral_sweep_loop())
+        if self.settings['metrics']['export_enabled']:
+            self._start_background_task(self._metrics_export_loop())
+        self.archive_stats = {"archived": 0, "restored": 0}
+        self.alert_stats = {"pets": 0, "messages": 0, "failed": 0}
+        self.backup_stats = {"completed": 0, "failed": 0, "last_seconds": 0.0, "last_completed_at": 0}
+        self._backup_running = False
+        self.leaderboard: GlobalLeaderboard | None = None  # 首次对账完成前为 None
+        self.pet_locks = StripedLockManager()
+        rate_limit = self.settings['rate_limit']
+        self.rate_limiter = CommandRateLimiter(rate_limit['budgets']) if rate_limit['enabled'] else None
+
+        # --- 配置编译与建表放到后台完成，命令在就绪前会等待 self._ready ---
+        self._init_error: Exception | None = None
+        logger.info(f"宠物插件启动阶段 [基础设置] 耗时 {(time.perf_counter() - init_start) * 1000:.1f}ms")
+        self._ready = self._start_background_task(self._initialize())
+        if self._ready is None:
+            # 没有运行中的事件循环 (如离线脚本)，退回同步初始化
+            for name, step in self._init_phases():
+                self._run_init_phase(name, step)
+        logger.info("简易群宠物游戏插件(astrbot_plugin_pet)已加载。")
 
-        # --- 加载配置 ---
-        self.walk_events = self._load_config(self.events_path, DEFAULT_WALK_EVENTS)
-        self.pets_data = self._load_config(self.pets_path, DEFAULT_PETS)
-        self.moves_data = self._load_config(self.moves_path, DEFAULT_MOVES)
+    def _init_phases(self) -> list[tuple]:
+        return [("加载配置", self._load_game_config), ("商店目录", self._get_shop_catalog),
+                ("数据库", functools.partial(self.busy_policy.run_blocking, self._init_database))]
 
-        self.pending_discards = {}
-        self._init_database()
-        logger.info("简易群宠物游戏插件(astrbot_plugin_pet)已加载。")
+    def _run_init_phase(self, name: str, step):
+        start = time.perf_counter()
+        step()
+        logger.info(f"宠物插件启动阶段 [{name}] 耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    async def _initialize(self):
+        """后台初始化：在线程中加载配置、建表，完成后再启动依赖数据库的后台任务。"""
+        start = time.perf_counter()
+        try:
+            for name, step in self._init_phases():
+                await asyncio.to_thread(self._run_init_phase, name, step)
+        except Exception as e:
+            self._init_error = e
+            logger.error(f"宠物插件初始化失败: {e}")
+            return
+        if self.settings['archive']['enabled']:
+            self._start_background_task(self._archive_loop())
+        self._start_background_task(self._leaderboard_loop())
+        self._start_background_task(self._ledger_compaction_loop())
+        self._start_background_task(self._alert_loop())
+        if self.settings['backup']['enabled']:
+            self._start_background_task(self._backup_loop())
+        logger.info(f"宠物插件初始化完成，共耗时 {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    async def _wait_ready(self) -> bool:
+        """等待后台初始化完成，初始化失败时返回 False。"""
+        if self._ready is not None and not self._ready.done():
+            # shield: 单个命令被取消时不能连带取消初始化任务
+            await asyncio.shield(self._ready)
+        return self._init_error is None
+
+    def _load_game_config(self):
+        """加载宠物/技能/事件配置 (优先使用编译好的快照，源文件变化时重新编译)。"""
+        if not self._load_config_snapshot():
+            self.walk_events = self._load_config(self.events_path, DEFAULT_WALK_EVENTS)
+            self.pets_data = self._load_config(self.pets_path, DEFAULT_PETS)
+            self.moves_data = self._load_config(self.moves_path, DEFAULT_MOVES)
+            self._validate_config()
+            self._compile_config()
+            self._save_config_snapshot()
+
+    def _start_background_task(self, coro) -> asyncio.Task | None:
+        """在事件循环中启动后台任务，插件卸载时统一取消。"""
+        try:
+            task = asyncio.get_running_loop().create_task(coro)
+        except RuntimeError:
+            coro.close()
+            logger.warning("当前没有运行中的事件循环，后台任务未启动。")
+            return None
+        self._background_tasks.append(task)
+        return task
+
+    async def _ephemeral_sweep_loop(self):
+        """定期清扫临时状态存储中的过期条目。"""
+        while True:
+            await asyncio.sleep(self.ephemeral.tick_seconds)
+            self.ephemeral.sweep()
+
+    def _collect_gauges(self) -> list[tuple[str, str, str, list[tuple[dict, float]]]]:
+        """汇总锁、限流、临时存储等组件的指标。"""
+        lock_stats = self.pet_locks.stats()
+        ephemeral_stats = self.ephemeral.stats()
+        gauges = [
+            ("pet_lock_acquisitions_total", "counter", "Pet lock acquisitions.", [({}, lock_stats['acquisitions'])]),
+            ("pet_lock_contended_total", "counter", "Pet lock acquisitions that had to wait.", [({}, lock_stats['contended'])]),
+            ("pet_lock_wait_seconds_total", "counter", "Total time spent waiting for pet locks.", [({}, lock_stats['wait_seconds_total'])]),
+            ("pet_lock_wait_seconds_max", "gauge", "Longest pet lock wait.", [({}, lock_stats['wait_seconds_max'])]),
+            ("pet_ephemeral_entries", "gauge", "Entries in the ephemeral state store.", [({}, ephemeral_stats['size'])]),
+            ("pet_ephemeral_expired_total", "counter", "Expired ephemeral entries.", [({}, ephemeral_stats['expired'])]),
+            ("pet_ephemeral_evicted_total", "counter", "Ephemeral entries evicted at capacity.", [({}, ephemeral_stats['evicted'])]),
+        ]
+        if self.rate_limiter is not None:
+            gauges.append(("pet_rate_limit_admitted_total", "counter", "Commands admitted by the rate limiter.",
+                           [({"cost": c}, n) for c, n in self.rate_limiter.admitted.items()]))
+            gauges.append(("pet_rate_limit_shed_total", "counter", "Commands shed by the rate limiter.",
+                           [({"cost": c, "scope": scope}, n) for (c, scope), n in self.rate_limiter.shed.items()]))
+            gauges.append(("pet_rate_limit_buckets", "gauge", "Live token buckets.", [({}, len(self.rate_limiter))]))
+        gauges.append(("pet_archive_total", "counter", "Pets moved to or restored from the archive.",
+                       [({"action": action}, n) for action, n in self.archive_stats.items()]))
+        busy_stats = self.busy_policy.stats()
+        gauges.append(("pet_db_busy_transactions_total", "counter", "Transactions that hit a SQLite busy/locked error.",
+                       [({}, busy_stats['busy_transactions'])]))
+        gauges.append(("pet_db_busy_retries_total", "counter", "Retries after SQLite busy/locked errors.",
+                       [({}, busy_stats['retries'])]))
+        gauges.append(("pet_db_busy_failures_total", "counter", "Transactions that stayed locked after all retries.",
+                       [({}, busy_stats['failures'])]))
+        gauges.append(("pet_db_busy_wait_seconds_total", "counter", "Time spent waiting on locked databases.",
+                       [({}, busy_stats['wait_seconds'])]))
+        gauges.append(("pet_maintenance_lock_total", "counter", "Cross-process maintenance lock outcomes.",
+                       [({"outcome": "acquired"}, self.maintenance_stats['acquired']),
+                        ({"outcome": "skipped"}, self.maintenance_stats['skipped'])]))
+        gauges.append(("pet_maintenance_lock_wait_seconds_total", "counter", "Time spent acquiring the maintenance lock.",
+                       [({}, self.maintenance_stats['wait_seconds'])]))
+        gauges.append(("pet_alerts_total", "counter", "Hunger/mood alerts: pets alerted, messages sent, failed sends.",
+                       [({"kind": kind}, n) for kind, n in self.alert_stats.items()]))
+        gauges.append(("pet_backup_total", "counter", "Online backups by outcome.",
+                       [({"outcome": "completed"}, self.backup_stats['completed']),
+                        ({"outcome": "failed"}, self.backup_stats['failed'])]))
+        gauges.append(("pet_backup_last_duration_seconds", "gauge", "Duration of the last successful backup.",
+                       [({}, self.backup_stats['last_seconds'])]))
+        gauges.append(("pet_backup_last_success_timestamp", "gauge", "Unix time of the last successful backup.",
+                       [({}, self.backup_stats['last_completed_at'])]))
+        return gauges
+
+    def _export_metrics(self):
+        """将指标写入数据目录中的 Prometheus 文本文件 (先写临时文件再替换，保证读取方看到完整内容)。"""
+        export_path = self.data_dir / self.settings['metrics']['export_file']
+        tmp_path = export_path.with_suffix(".tmp")
+        tmp_path.write_text(self.metrics.render_prometheus(self._collect_gauges()), encoding='utf-8')
+        tmp_path.replace(export_path)
+
+    async def _metrics_export_loop(self):
+        """定期导出性能指标。"""
+        interval = max(1, self.settings['metrics']['export_interval_seconds'])
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self._export_metrics()
+            except Exception as e:
+                logger.error(f"导出性能指标失败: {e}")
+
+    def _load_settings(self) -> dict:
+        """加载 settings.json，并用默认值补全缺失的键。"""
+        def merge(defaults, overrides):
+            if not isinstance(defaults, dict) or not isinstance(overrides, dict):
+                return overrides
+            merged = deepcopy(defaults)
+            for key, value in overrides.items():
+                merged[key] = merge(defaults.get(key), value) if key in defaults else value
+            return merged
+        return merge(DEFAULT_SETTINGS, self._load_config(self.settings_path, DEFAULT_SETTINGS))
+
+    def _validate_config(self):
+        """校验三份JSON配置，剔除无法使用的条目并记录日志。"""
+        if not isinstance(self.moves_data, dict):
+            logger.error("moves.json 格式错误，应为对象，将使用默认技能数据。")
+            self.moves_data = DEFAULT_MOVES
+        valid_moves = {}
+        for move_name, move in self.moves_data.items():
+            if not isinstance(move, dict) or not isinstance(move.get('power', 0), (int, float)):
+                logger.error(f"技能「{move_name}」配置无效 (缺少数值型 power)，已忽略。")
+                continue
+            effect = move.get('effect')
+            if effect is not None and not isinstance(effect, dict):
+                logger.warning(f"技能「{move_name}」的附加效果格式错误 (应为对象)，已忽略该效果。")
+                move = {**move, "effect": None}
+            elif effect is not None and effect.get('type') not in STAT_MAP:
+                logger.warning(f"技能「{move_name}」的附加效果类型未知: {effect.get('type')}")
+            valid_moves[move_name] = move
+        self.moves_data = valid_moves
+
+        if not isinstance(self.pets_data, dict):
+            logger.error("pets.json 格式错误，应为对象，将使用默认宠物数据。")
+            self.pets_data = DEFAULT_PETS
+        valid_pets = {}
+        for type_name, info in self.pets_data.items():
+            try:
+                valid = (isinstance(info['attribute'], str)
+                         and int(info['base_stats']['attack']) >= 0
+                         and int(info['base_stats']['defense']) >= 0
+                         and '1' in info['evolutions'])
+            except (KeyError, TypeError, ValueError):
+                valid = False
+            if not valid:
+                logger.error(f"宠物「{type_name}」配置无效 (需包含 attribute、base_stats 与 1 阶进化信息)，已忽略。")
+                continue
+            for moves in info.get('learnset', {}).values():
+                for move_name in moves:
+                    if move_name not in self.moves_data:
+                        logger.warning(f"宠物「{type_name}」的技能学习表引用了不存在的技能「{move_name}」。")
+            valid_pets[type_name] = info
+        self.pets_data = valid_pets
+
+        events = self.walk_events
+        if isinstance(events, dict):
+            events = list(events.get('default', []))
+            for pool in self.walk_events.get('level_pools', []):
+                events.extend(pool.get('events', []) if isinstance(pool, dict) else [])
+        for event in events if isinstance(events, list) else []:
+            if isinstance(event, dict) and event.get('type', 'nothing') not in WALK_EVENT_TYPES:
+                logger.warning(f"散步事件类型未知，将按 nothing 处理: {event.get('type')}")
+
+    def _config_sources(self) -> dict[str, Path]:
+        return {"walk_events": self.events_path, "pets": self.pets_path, "moves": self.moves_path}
+
+    def _load_config_snapshot(self) -> bool:
+        """尝试从快照加载已编译的配置；快照缺失、过期或损坏时返回 False。"""
+        if ormsgpack is None or not self.config_snapshot_path.exists():
+            return False
+        sources = self._config_sources()
+        if not all(path.exists() for path in sources.values()):
+            return False
+        try:
+            snapshot = ormsgpack.unpackb(self.config_snapshot_path.read_bytes())
+            if snapshot.get('version') != CONFIG_SNAPSHOT_VERSION:
+                return False
+
+            touched = False
+            for key, path in sources.items():
+                record = snapshot['sources'].get(key)
+                if not record:
+                    return False
+                stat = path.stat()
+                if record['mtime_ns'] == stat.st_mtime_ns and record['size'] == stat.st_size:
+                    continue
+                # mtime 变化但内容未变 (例如被重新保存)，仍可沿用快照
+                if hashlib.sha256(path.read_bytes()).hexdigest() != record['sha256']:
+                    return False
+                touched = True
+
+            self.walk_events = snapshot['walk_events']
+            self.pets_data = snapshot['pets_data']
+            self.moves_data = snapshot['moves_data']
+            self.learnsets = {k: LearnsetIndex.from_state(v) for k, v in snapshot['learnsets'].items()}
+            self.walk_event_pools = WalkEventPools.from_state(snapshot['walk_event_pools'])
+            self.wild_pets = WildPetPool.from_state(snapshot['wild_pets'])
+        except Exception as e:
+            logger.warning(f"配置快照无效，将重新编译配置: {e}")
+            return False
+
+        if touched:
+            self._save_config_snapshot()
+        logger.info(f"已从配置快照加载: {self.config_snapshot_path}")
+        return True
+
+    def _save_config_snapshot(self):
+        """将编译后的配置写入 msgpack 快照，以源文件的 mtime 与哈希作为校验键。"""
+        if ormsgpack is None:
+            return
+        sources = {}
+        for key, path in self._config_sources().items():
+            if not path.exists():
+                return
+            stat = path.stat()
+            sources[key] = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "sha256": hashlib.sha256(path.read_bytes()).hexdigest(),
+            }
+        snapshot = {
+            "version": CONFIG_SNAPSHOT_VERSION,
+            "sources": sources,
+            "walk_events": self.walk_events,
+            "pets_data": self.pets_data,
+            "moves_data": self.moves_data,
+            "learnsets": {k: v.to_state() for k, v in self.learnsets.items()},
+            "walk_event_pools": self.walk_event_pools.to_state(),
+            "wild_pets": self.wild_pets.to_state(),
+        }
+        try:
+            tmp_path = self.config_snapshot_path.with_suffix(".tmp")
+            tmp_path.write_bytes(ormsgpack.packb(snapshot))
+            tmp_path.replace(self.config_snapshot_path)
+        except Exception as e:
+            logger.warning(f"写入配置快照失败: {e}")
+
+    def _compile_config(self):
+        """将原始配置预编译为运行时使用的索引结构。"""
+        self.walk_event_pools = WalkEventPools.from_config(self.walk_events)
+        self.learnsets = {
+            type_name: LearnsetIndex(info.get('learnset', {}))
+            for type_name, info in self.pets_data.items()
+        }
+        encounter_tables = self.walk_events.get('encounter_tables', []) if isinstance(self.walk_events, dict) else []
+        self.wild_pets = WildPetPool.build(self.pets_data, self.learnsets, encounter_tables)
+
+    def _get_shop_catalog(self) -> ShopCatalog:
+        """获取商店目录；shop.json 被修改后自动重新编译 (每隔几秒最多检查一次)。"""
+        now = time.monotonic()
+        if self.shop_catalog is not None and now - self._shop_checked_at < SHOP_RELOAD_CHECK_SECONDS:
+            return self.shop_catalog
+        self._shop_checked_at = now
+
+        try:
+            mtime_ns = self.shop_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime_ns = None
+        if self.shop_catalog is None or mtime_ns != self._shop_mtime_ns:
+            if self.shop_catalog is not None and mtime_ns is not None:
+                # 热重载: 文件有误时保留上一份可用的目录，不能让价格和商品悄悄回退成默认值
+                try:
+                    raw = json.loads(self.shop_path.read_text(encoding='utf-8'))
+                    if not isinstance(raw, dict):
+                        raise ValueError("顶层应为对象")
+                except (OSError, ValueError) as e:
+                    self._shop_mtime_ns = mtime_ns  # 文件再次修改后才重试，避免每次检查都报错
+                    logger.error(f"shop.json 重新加载失败，继续使用上一版商店目录 (版本 {self.shop_catalog.version}): {e}")
+                    return self.shop_catalog
+            else:
+                raw = self._load_config(self.shop_path, DEFAULT_SHOP_ITEMS)
+            if self.shop_path.exists():
+                mtime_ns = self.shop_path.stat().st_mtime_ns
+            version = self.shop_catalog.version + 1 if self.shop_catalog else 1
+            self.shop_catalog = ShopCatalog(raw, version)
+            self._shop_mtime_ns = mtime_ns
+            logger.info(f"商店目录已编译 (版本 {version}，共 {len(self.shop_catalog.items)} 件商品)。")
+        return self.shop_catalog
+
+    def _learnset(self, pet_type: str) -> LearnsetIndex:
+        """获取种族的技能学习表索引，未知种族返回空索引。"""
+        return self.learnsets.get(pet_type, EMPTY_LEARNSET)
+
+    def _connect(self, group_id: str | int | None = None) -> sqlite3.Connection:
+        """
+        打开 group_id 所在分片的数据库连接 (语句耗时会计入当前命令的 db 阶段，开启追踪时同时记录 SQL)。
+        未分片时 group_id 可省略；分片模式下必须指定。
+        """
+        if self.shard_count == 1:
+            return self._open_db(self.db_path)
+        if group_id is None:
+            raise ValueError("分片模式下访问数据库必须指定 group_id。")
+        return self._open_db(self.db_paths[shard_index(group_id, self.shard_count)])
+
+    def _open_db(self, path: Path) -> sqlite3.Connection:
+        conn = sqlite3.connect(path, timeout=self.settings['storage']['busy_timeout_ms'] / 1000,
+                               factory=InstrumentedConnection)
+        conn.tracer = self.sql_tracer
+        return conn
+
+    @contextmanager
+    def _maintenance_lock(self, name: str, timeout: float = 0):
+        """
+        跨进程互斥的维护操作 (建表迁移、归档、流水合并、批量维护、导入、备份)。
+        产出是否拿到锁；timeout 为 0 时不等待，其他进程正在维护就直接跳过本次。未安装 filelock 时总是拿到。
+        """
+        if self._file_lock is None:
+            yield True
+            return
+        start = time.perf_counter()
+        try:
+            self._file_lock.acquire(timeout=timeout)
+        except filelock.Timeout:
+            self.maintenance_stats['skipped'] += 1
+            logger.info(f"其他进程正在进行维护操作，跳过本次「{name}」。")
+            yield False
+            return
+        self.maintenance_stats['acquired'] += 1
+        self.maintenance_stats['wait_seconds'] += time.perf_counter() - start
+        try:
+            yield True
+        finally:
+            self._file_lock.release()
+
+    def _fan_out(self, sql: str, params: tuple = ()) -> list[tuple]:
+        """在每个分片上执行同一条只读查询，按分片顺序合并结果 (用于跨群的管理查询)。"""
+        rows = []
+        for path in self.db_paths:
+            with self._open_db(path) as conn:
+                rows.extend(conn.execute(sql, params).fetchall())
+        return rows
+
+    def _check_shard_layout(self):
+        """分片数与磁盘上的文件布局不一致时拒绝启动，避免数据被路由到错误的文件。"""
+        legacy_db = self.data_dir / "pets.db"
+        shard_files = sorted(self.data_dir.glob("pets_shard*.db"))
+        problem = None
+        if self.shard_count > 1 and legacy_db.exists():
+            problem = f"存在未分片的 pets.db，但配置了 {self.shard_count} 个分片"
+        elif self.shard_count == 1 and shard_files:
+            problem = f"存在分片文件 {shard_files[0].name} 等，但配置为不分片"
+        else:
+            for path in self.db_paths:
+                if not path.exists():
+                    continue
+                conn = sqlite3.connect(path)
+                try:
+                    row = conn.execute("SELECT value FROM shard_meta WHERE key = 'shard_count'").fetchone()
+                except sqlite3.OperationalError:
+                    row = None  # 旧版数据库还没有 shard_meta 表
+                finally:
+                    conn.close()
+                if row and int(row[0]) != self.shard_count:
+                    problem = f"{path.name} 属于 {row[0]} 分片布局，但配置了 {self.shard_count} 个分片"
+                    break
+        if problem:
+            message = f"数据库分片布局不一致：{problem}。请停机后运行 tools/reshard.py 迁移数据。"
+            logger.error(message)
+            raise RuntimeError(message)
+
+    def _new_sql_tracer(self) -> SqlTracer:
+        trace_settings = self.settings['sql_trace']
+        return SqlTracer(trace_settings['slow_query_ms'] / 1000, self.data_dir / trace_settings['slow_log_file'],
+                         trace_settings['slow_log_max_kb'] * 1024)
 
     def _init_database(self):
-        """初始化数据库，创建宠物表和物品表。"""
-        with sqlite3.connect(self.db_path) as conn:
+        """初始化数据库 (每个分片)，创建宠物表和物品表。与其他进程的迁移/维护操作互斥。"""
+        with self._maintenance_lock("建表迁移", timeout=MAINTENANCE_INIT_LOCK_TIMEOUT_SECONDS) as acquired:
+            if not acquired:
+                raise RuntimeError(f"等待其他进程的维护操作超过 {MAINTENANCE_INIT_LOCK_TIMEOUT_SECONDS} 秒，无法初始化数据库。")
+            self._check_shard_layout()
+            for index, path in enumerate(self.db_paths):
+                self._init_shard(path, index)
+
+    def _init_shard(self, path: Path, index: int):
+        with self._open_db(path) as conn:
             cursor = conn.cursor()
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS pets (
@@ -184,12 +2153,12 @@ class PetPlugin(Star):
                     attack INTEGER DEFAULT 10,
                     defense INTEGER DEFAULT 10,
                     evolution_stage INTEGER DEFAULT 1,
-                    last_fed_time TEXT,
-                    last_walk_time TEXT,
-                    last_duel_time TEXT,
+                    last_fed_at INTEGER,
+                    last_walk_at INTEGER,
+                    last_duel_at INTEGER,
                     money INTEGER DEFAULT 50,
-                    last_updated_time TEXT,
-                    last_signin_time TEXT,
+                    last_updated_at INTEGER,
+                    last_signin_at INTEGER,
                     PRIMARY KEY (user_id, group_id)
                 )
             """)
@@ -202,6 +2171,15 @@ class PetPlugin(Star):
             # --- 为 v1.5 添加新列 ---
             self._add_column(cursor, 'pets', 'held_item', 'TEXT')
             self._add_column(cursor, 'pets', 'status_condition', 'TEXT')
+            # --- 时间列改为整数时间戳 ---
+            self._migrate_epoch_columns(conn)
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_pets_last_active ON pets ({PET_LAST_ACTIVE_SQL})")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_pets_last_updated ON pets (last_updated_at)")
+            # --- 饥饿/心情提醒 ---
+            self._add_column(cursor, 'pets', 'satiety_empty_at', 'INTEGER')
+            self._add_column(cursor, 'pets', 'mood_empty_at', 'INTEGER')
+            self._add_column(cursor, 'pets', 'alert_sent', 'INTEGER DEFAULT 0')
+            self._init_alert_schema(conn)
 
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS inventory (
@@ -212,8 +2190,116 @@ class PetPlugin(Star):
                     PRIMARY KEY (user_id, group_id, item_name)
                 )
             """)
+
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS pets_archive (
+                    user_id INTEGER NOT NULL,
+                    group_id INTEGER NOT NULL,
+                    archived_at TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    PRIMARY KEY (user_id, group_id)
+                )
+            """)
+
+            # 金钱流水: 只追加，余额仍以 pets.money 为准；旧流水定期合并进 money_snapshots
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS money_ledger (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    group_id INTEGER NOT NULL,
+                    delta INTEGER NOT NULL,
+                    reason TEXT NOT NULL,
+                    created_at INTEGER NOT NULL
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_money_ledger_pet ON money_ledger (user_id, group_id, id)")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS money_snapshots (
+                    user_id INTEGER NOT NULL,
+                    group_id INTEGER NOT NULL,
+                    delta_total INTEGER NOT NULL,
+                    entries INTEGER NOT NULL,
+                    as_of INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, group_id)
+                )
+            """)
+
+            cursor.execute("CREATE TABLE IF NOT EXISTS shard_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            cursor.executemany("INSERT OR REPLACE INTO shard_meta (key, value) VALUES (?, ?)",
+                               [("shard_count", str(self.shard_count)), ("shard_index", str(index))])
             conn.commit()
 
+    def _migrate_epoch_columns(self, conn: sqlite3.Connection):
+        """
+        旧版数据库的时间列是 ISO 文本。补上对应的整数列后按 rowid 分批转换，每批单独提交；
+        中途中断时下次启动会从未转换的行继续。旧的文本列保留但不再读写，便于回退。
+        """
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(pets)")}
+        legacy = [column for column in EPOCH_TIME_COLUMNS if column in existing]
+        if not legacy:
+            return
+        cursor = conn.cursor()
+        for column in legacy:
+            if EPOCH_TIME_COLUMNS[column] not in existing:
+                self._add_column(cursor, 'pets', EPOCH_TIME_COLUMNS[column], 'INTEGER')
+        conn.commit()
+
+        pending = " OR ".join(f"({EPOCH_TIME_COLUMNS[column]} IS NULL AND {column} IS NOT NULL)" for column in legacy)
+        assignments = ", ".join(f"{EPOCH_TIME_COLUMNS[column]} = COALESCE({EPOCH_TIME_COLUMNS[column]}, ?)"
+                                for column in legacy)
+        converted = 0
+        for rows in iter_rowid_chunks(conn, "pets", ", ".join(legacy), pending, (), EPOCH_MIGRATION_BATCH):
+            conn.executemany(f"UPDATE pets SET {assignments} WHERE rowid = ?",
+                             [(*(iso_to_epoch(value) for value in row[1:]), row[0]) for row in rows])
+            conn.commit()
+            converted += len(rows)
+        if converted:
+            logger.info(f"已将 {converted} 只宠物的时间列转换为整数时间戳。")
+
+    def _init_alert_schema(self, conn: sqlite3.Connection):
+        """
+        饥饿提醒所需的触发器、部分索引与订阅表。饱食度/心情/结算时间变化时触发器重算预计归零时间；
+        只有饱食度或心情上升 (主人照顾) 才清除 alert_sent 开始新的一段饥饿期，单纯的衰减结算不会重新提醒。
+        已提醒过的宠物不在部分索引中，扫描不会再读到它们。
+        """
+        refresh = f"satiety_empty_at = {SATIETY_EMPTY_AT_SQL}, mood_empty_at = {MOOD_EMPTY_AT_SQL}"
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_pets_empty_at_insert AFTER INSERT ON pets
+            BEGIN UPDATE pets SET {refresh}, alert_sent = 0 WHERE rowid = NEW.rowid; END
+        """)
+        # 旧版本的更新触发器每次写入都会清除 alert_sent，换成新名字重建
+        conn.execute("DROP TRIGGER IF EXISTS trg_pets_empty_at_update")
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_pets_empty_at_refresh AFTER UPDATE OF satiety, mood, last_updated_at ON pets
+            BEGIN
+                UPDATE pets SET {refresh},
+                    alert_sent = CASE WHEN NEW.satiety > OLD.satiety OR NEW.mood > OLD.mood THEN 0 ELSE OLD.alert_sent END
+                WHERE rowid = NEW.rowid;
+            END
+        """)
+        # 补算旧数据 (分批提交)
+        while conn.execute(f"""
+                UPDATE pets SET satiety_empty_at = {SATIETY_EMPTY_AT_SQL.replace('NEW.', '')},
+                                mood_empty_at = {MOOD_EMPTY_AT_SQL.replace('NEW.', '')}
+                WHERE rowid IN (SELECT rowid FROM pets WHERE satiety_empty_at IS NULL AND last_updated_at IS NOT NULL
+                                LIMIT ?)""", (EPOCH_MIGRATION_BATCH,)).rowcount:
+            conn.commit()
+        # 以群号开头: 未开启提醒的群里的宠物永远不会被标记，扫描只按订阅的群逐个做范围查询，不会读到它们
+        conn.execute("DROP INDEX IF EXISTS idx_pets_satiety_empty")
+        conn.execute("DROP INDEX IF EXISTS idx_pets_mood_empty")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pets_group_satiety_empty ON pets (group_id, satiety_empty_at) "
+                     "WHERE alert_sent = 0")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_pets_group_mood_empty ON pets (group_id, mood_empty_at) "
+                     "WHERE alert_sent = 0")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS alert_groups (
+                group_id INTEGER PRIMARY KEY,
+                origin TEXT NOT NULL,
+                enabled_at INTEGER NOT NULL
+            )
+        """)
+        conn.commit()
+
     def _add_column(self, cursor, table_name, column_name, column_type):
         """辅助函数，用于向表中安全地添加列。"""
         try:
@@ -253,23 +2339,13 @@ class PetPlugin(Star):
                 logger.error(f"加载配置文件失败 {config_path}: {e}")
                 return default_data
 
-    def _select_walk_event(self) -> dict:
-        """根据权重随机选择一个散步事件。"""
-        if not self.walk_events:
+    def _select_walk_event(self, group_id: str | None = None, level: int | None = None) -> dict:
+        """根据权重随机选择一个散步事件（按群/等级选择预编译的事件池）。"""
+        event = self.walk_event_pools.pick(group_id, level)
+        if event is None:
             logger.warning("没有可用的散步事件，将返回一个 'nothing' 事件。")
-            return {"type": "nothing", "description": "「{pet_name}」散了一圈, 但什么也没发生。"}
-
-        total_weight = sum(event.get('weight', 0) for event in self.walk_events)
-        if total_weight == 0:
-            return random.choice(self.walk_events)
-
-        roll = random.uniform(0, total_weight)
-        current_weight = 0
-        for event in self.walk_events:
-            current_weight += event.get('weight', 0)
-            if roll < current_weight:
-                return event
-        return random.choice(self.walk_events) # 备用
+            return WALK_NOTHING_EVENT
+        return event
 
     def _parse_reward_value(self, value: int | list) -> int:
         """解析奖励值，支持整数或[min, max]范围。"""
@@ -284,35 +2360,36 @@ class PetPlugin(Star):
 
     def _get_pet(self, user_id: str, group_id: str) -> dict | None:
         """根据ID获取宠物信息，并自动处理离线期间的状态衰减。"""
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(group_id) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute("SELECT * FROM pets WHERE user_id = ? AND group_id = ?", (int(user_id), int(group_id)))
             row = cursor.fetchone()
             if not row:
-                return None
+                if not self._restore_archived_pet(conn, user_id, group_id):
+                    return None
+                cursor.execute("SELECT * FROM pets WHERE user_id = ? AND group_id = ?", (int(user_id), int(group_id)))
+                row = cursor.fetchone()
 
             pet_dict = dict(row)
-            now = datetime.now()
-            last_updated_str = pet_dict.get('last_updated_time')
+            now = int(time.time())
+            last_updated_at = pet_dict.get('last_updated_at')
 
-            if not last_updated_str:
-                last_updated_time = now
-                cursor.execute("UPDATE pets SET last_updated_time = ? WHERE user_id = ? AND group_id = ?",
-                               (now.isoformat(), int(user_id), int(group_id)))
-            else:
-                last_updated_time = datetime.fromisoformat(last_updated_str)
+            if last_updated_at is None:
+                last_updated_at = now
+                cursor.execute("UPDATE pets SET last_updated_at = ? WHERE user_id = ? AND group_id = ?",
+                               (now, int(user_id), int(group_id)))
 
-            hours_passed = (now - last_updated_time).total_seconds() / 3600
+            hours_passed = (now - last_updated_at) / 3600
             if hours_passed >= 1:
                 hours_to_decay = int(hours_passed)
-                satiety_decay = 3 * hours_to_decay
-                mood_decay = 2 * hours_to_decay
+                satiety_decay = SATIETY_DECAY_PER_HOUR * hours_to_decay
+                mood_decay = MOOD_DECAY_PER_HOUR * hours_to_decay
                 new_satiety = max(0, int(pet_dict['satiety']) - satiety_decay)
                 new_mood = max(0, int(pet_dict['mood']) - mood_decay)
                 cursor.execute(
-                    "UPDATE pets SET satiety = ?, mood = ?, last_updated_time = ? WHERE user_id = ? AND group_id = ?",
-                    (new_satiety, new_mood, now.isoformat(), int(user_id), int(group_id))
+                    "UPDATE pets SET satiety = ?, mood = ?, last_updated_at = ? WHERE user_id = ? AND group_id = ?",
+                    (new_satiety, new_mood, now, int(user_id), int(group_id))
                 )
                 logger.info(
                     f"宠物 {pet_dict['pet_name']} 离线{hours_to_decay}小时，饱食度降低{satiety_decay}, 心情降低{mood_decay}")
@@ -320,7 +2397,391 @@ class PetPlugin(Star):
                 pet_dict['mood'] = new_mood
 
             conn.commit()
-            return pet_dict
+        if self.leaderboard is not None:
+            # 经验/等级变化后总会经由这里重新读取宠物，顺带增量更新全服排行
+            self.leaderboard.update(user_id, group_id, pet_dict['pet_name'], pet_dict['level'], pet_dict['exp'])
+        return pet_dict
+
+    # --- 冷数据归档 ---
+    async def _archive_loop(self):
+        """定期归档长期不活跃的宠物。"""
+        interval = max(60, self.settings['archive']['interval_seconds'])
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                with self._maintenance_lock("归档") as acquired:
+                    if acquired:
+                        await self._archive_inactive_pets()
+            except Exception as e:
+                logger.error(f"归档不活跃宠物失败: {e}")
+
+    async def _archive_inactive_pets(self) -> int:
+        """
+        把超过 inactive_days 没有活动的宠物连同背包移入 pets_archive。
+        每批只处理 batch_size 只宠物，持有它们的宠物锁并单独提交，不会长时间占用写锁。
+        """
+        archive_settings = self.settings['archive']
+        cutoff = int(time.time()) - archive_settings['inactive_days'] * 86400
+        batch_size = max(1, archive_settings['batch_size'])
+        archived = 0
+        for path in self.db_paths:
+            with self._open_db(path) as conn:
+                candidates = conn.execute(
+                    f"SELECT user_id, group_id FROM pets WHERE {PET_INACTIVE_SINCE_SQL}", (cutoff,)).fetchall()
+            for start in range(0, len(candidates), batch_size):
+                batch = candidates[start:start + batch_size]
+                async with self.pet_locks.hold(*((str(user_id), str(group_id)) for user_id, group_id in batch)):
+                    with self._open_db(path) as conn:
+                        archived += self._archive_batch(conn, batch, cutoff)
+                await asyncio.sleep(ARCHIVE_BATCH_PAUSE_SECONDS)
+        if archived:
+            self.archive_stats['archived'] += archived
+            logger.info(f"已归档 {archived} 只超过 {archive_settings['inactive_days']} 天未活动的宠物。")
+        return archived
+
+    def _archive_batch(self, conn: sqlite3.Connection, batch: list[tuple[int, int]], cutoff: int) -> int:
+        conn.row_factory = sqlite3.Row
+        archived_at = datetime.now().isoformat()
+        count = 0
+        for user_id, group_id in batch:
+            # 再次确认仍不活跃 (扫描之后主人可能刚用过命令或丢弃了宠物)
+            pet = conn.execute(f"SELECT * FROM pets WHERE user_id = ? AND group_id = ? AND {PET_INACTIVE_SINCE_SQL}",
+                               (user_id, group_id, cutoff)).fetchone()
+            if not pet:
+                continue
+            inventory = conn.execute("SELECT item_name, quantity FROM inventory WHERE user_id = ? AND group_id = ?",
+                                     (user_id, group_id)).fetchall()
+            payload = json.dumps({"pet": dict(pet), "inventory": [list(item) for item in inventory]}, ensure_ascii=False)
+            conn.execute("INSERT OR REPLACE INTO pets_archive (user_id, group_id, archived_at, payload) VALUES (?, ?, ?, ?)",
+                         (user_id, group_id, archived_at, payload))
+            conn.execute("DELETE FROM inventory WHERE user_id = ? AND group_id = ?", (user_id, group_id))
+            conn.execute("DELETE FROM pets WHERE user_id = ? AND group_id = ?", (user_id, group_id))
+            if self.leaderboard is not None:
+                self.leaderboard.remove(user_id, group_id)
+            count += 1
+        conn.commit()
+        return count
+
+    def _restore_archived_pet(self, conn: sqlite3.Connection, user_id: str, group_id: str) -> bool:
+        """宠物已被归档时，把它连同背包搬回热表 (由调用方提交)。"""
+        row = conn.execute("SELECT payload FROM pets_archive WHERE user_id = ? AND group_id = ?",
+                           (int(user_id), int(group_id))).fetchone()
+        if not row:
+            return False
+        payload = json.loads(row[0])
+        pet = upgrade_legacy_times(payload['pet'])  # 迁移前归档的宠物仍是 ISO 时间
+        conn.execute(f"INSERT INTO pets ({', '.join(pet)}) VALUES ({', '.join('?' for _ in pet)})", tuple(pet.values()))
+        conn.executemany("INSERT OR REPLACE INTO inventory (user_id, group_id, item_name, quantity) VALUES (?, ?, ?, ?)",
+                         [(int(user_id), int(group_id), name, quantity) for name, quantity in payload['inventory']])
+        conn.execute("DELETE FROM pets_archive WHERE user_id = ? AND group_id = ?", (int(user_id), int(group_id)))
+        self.archive_stats['restored'] += 1
+        logger.info(f"宠物 {pet['pet_name']} (用户 {user_id}, 群 {group_id}) 已从归档中恢复。")
+        return True
+
+    # --- 饥饿/心情提醒 ---
+    async def _alert_loop(self):
+        """定期扫描已开启提醒的群，提醒主人照顾快要饿坏或不开心的宠物。"""
+        interval = max(60, self.settings['alerts']['interval_seconds'])
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self._send_pet_alerts()
+            except Exception as e:
+                logger.error(f"发送宠物提醒失败: {e}")
+
+    def _find_alert_candidates(self, path: Path, now: int) -> dict[int, list[tuple]]:
+        """
+        (工作线程中执行) 对每个开启提醒的群，在 (群号, 预计归零时间) 部分索引上做范围查询，
+        返回 {群号: 尚未提醒过的宠物}。
+        """
+        alerts = self.settings['alerts']
+        satiety_bound = now + alerts['satiety_threshold'] * (3600 // SATIETY_DECAY_PER_HOUR)
+        mood_bound = now + alerts['mood_threshold'] * (3600 // MOOD_DECAY_PER_HOUR)
+        columns = "user_id, group_id, pet_name, satiety_empty_at, mood_empty_at"
+        by_group = {}
+        with self._open_db(path) as conn:
+            for group_id, origin in conn.execute("SELECT group_id, origin FROM alert_groups").fetchall():
+                rows = conn.execute(f"""
+                    SELECT {columns} FROM pets WHERE group_id = ? AND alert_sent = 0 AND satiety_empty_at < ?
+                    UNION
+                    SELECT {columns} FROM pets WHERE group_id = ? AND alert_sent = 0 AND mood_empty_at < ?
+                    ORDER BY 4
+                """, (group_id, satiety_bound, group_id, mood_bound)).fetchall()
+                if rows:
+                    by_group[group_id] = [row + (origin,) for row in rows]
+        return by_group
+
+    async def _send_pet_alerts(self) -> int:
+        """每个群合并成一条提醒消息发送，发送成功后才标记 alert_sent，失败的下一轮重试。"""
+        max_mentions = max(1, self.settings['alerts']['max_mentions'])
+        alerted = messages = 0
+        for path in self.db_paths:
+            now = int(time.time())
+            by_group = await asyncio.to_thread(self._find_alert_candidates, path, now)
+            for group_id, rows in by_group.items():
+                chain = [Plain("🔔 宠物提醒：下面这些宠物需要主人照顾啦！\n")]
+                for user_id, _, pet_name, satiety_empty_at, mood_empty_at, _ in rows[:max_mentions]:
+                    satiety = max(0, (satiety_empty_at - now) // (3600 // SATIETY_DECAY_PER_HOUR))
+                    mood = max(0, (mood_empty_at - now) // (3600 // MOOD_DECAY_PER_HOUR))
+                    chain += [At(qq=str(user_id)), Plain(f" 「{pet_name}」饱食度约 {satiety}，心情约 {mood}\n")]
+                if len(rows) > max_mentions:
+                    chain.append(Plain(f"……还有 {len(rows) - max_mentions} 只宠物也在等待主人。\n"))
+                chain.append(Plain("发送 /使用 [物品名] 喂喂它们吧。"))
+                try:
+                    sent = await self.context.send_message(rows[0][5], MessageChain(chain=chain))
+                except Exception as e:
+                    logger.warning(f"向群 {group_id} 发送宠物提醒失败: {e}")
+                    sent = False
+                if sent is False:
+                    self.alert_stats['failed'] += 1
+                    continue
+
+                # 扫描之后主人可能刚照顾过宠物 (触发器已重算)，只标记预计归零时间未变化的行
+                with self._open_db(path) as conn:
+                    conn.executemany(
+                        "UPDATE pets SET alert_sent = 1 WHERE user_id = ? AND group_id = ? "
+                        "AND satiety_empty_at = ? AND mood_empty_at = ?",
+                        [(row[0], row[1], row[3], row[4]) for row in rows])
+                    conn.commit()
+                alerted += len(rows)
+                messages += 1
+                await asyncio.sleep(ALERT_SEND_PAUSE_SECONDS)
+        self.alert_stats['pets'] += alerted
+        self.alert_stats['messages'] += messages
+        if alerted:
+            logger.info(f"已向 {messages} 个群发送宠物提醒，涉及 {alerted} 只宠物。")
+        return alerted
+
+    # --- 金钱流水 ---
+    @staticmethod
+    def _record_money(conn: sqlite3.Connection, entries: list[tuple[str, str, int, str]]):
+        """
+        在调用方的事务中追加金钱流水 [(用户, 群, 变化量, 原因)]，与余额变化一同提交。
+        变化量为 0 的条目会被忽略。
+        """
+        now = int(time.time())
+        rows = [(int(user_id), int(group_id), delta, reason, now) for user_id, group_id, delta, reason in entries if delta]
+        if rows:
+            conn.executemany(
+                "INSERT INTO money_ledger (user_id, group_id, delta, reason, created_at) VALUES (?, ?, ?, ?, ?)", rows)
+
+    @staticmethod
+    def _delete_money_history(conn: sqlite3.Connection, pets: list[tuple[int, int]]):
+        """宠物被删除或整体替换时，在调用方的事务中一并清除它的流水与快照 [(用户, 群)]。"""
+        keys = [(int(user_id), int(group_id)) for user_id, group_id in pets]
+        conn.executemany("DELETE FROM money_ledger WHERE user_id = ? AND group_id = ?", keys)
+        conn.executemany("DELETE FROM money_snapshots WHERE user_id = ? AND group_id = ?", keys)
+
+    async def _ledger_compaction_loop(self):
+        """定期把过期流水合并进每只宠物的快照，保持流水表精简。"""
+        while True:
+            await asyncio.sleep(LEDGER_COMPACT_INTERVAL_SECONDS)
+            try:
+                with self._maintenance_lock("合并流水") as acquired:
+                    if acquired:
+                        await self._compact_ledger()
+            except Exception as e:
+                logger.error(f"合并金钱流水失败: {e}")
+
+    async def _compact_ledger(self) -> int:
+        """按 id 分批合并早于保留期的流水，每批一个短事务。"""
+        cutoff = int(time.time()) - LEDGER_RETENTION_DAYS * 86400
+        compacted = 0
+        for path in self.db_paths:
+            while True:
+                with self._open_db(path) as conn:
+                    bound = conn.execute(
+                        "SELECT MAX(id) FROM (SELECT id FROM money_ledger WHERE created_at < ? ORDER BY id LIMIT ?)",
+                        (cutoff, LEDGER_COMPACT_BATCH)).fetchone()[0]
+                    if bound is None:
+                        break
+                    conn.execute("""
+                        INSERT INTO money_snapshots (user_id, group_id, delta_total, entries, as_of)
+                        SELECT user_id, group_id, SUM(delta), COUNT(*), MAX(created_at) FROM money_ledger
+                        WHERE id <= ? AND created_at < ? GROUP BY user_id, group_id
+                        ON CONFLICT(user_id, group_id) DO UPDATE SET
+                            delta_total = delta_total + excluded.delta_total,
+                            entries = entries + excluded.entries,
+                            as_of = MAX(as_of, excluded.as_of)
+                    """, (bound, cutoff))
+                    compacted += conn.execute("DELETE FROM money_ledger WHERE id <= ? AND created_at < ?",
+                                              (bound, cutoff)).rowcount
+                    conn.commit()
+                await asyncio.sleep(ARCHIVE_BATCH_PAUSE_SECONDS)
+        if compacted:
+            logger.info(f"已将 {compacted} 条超过 {LEDGER_RETENTION_DAYS} 天的金钱流水合并进快照。")
+        return compacted
+
+    # --- 在线备份 ---
+    async def _backup_loop(self):
+        """按 interval_hours 定期备份；下次备份时间从最近一份备份算起，重启插件不会立刻重复备份。"""
+        interval = self.settings['backup']['interval_hours'] * 3600
+        while True:
+            backups = self._list_backups()
+            elapsed = time.time() - backups[-1].stat().st_mtime if backups else interval
+            await asyncio.sleep(max(BACKUP_RETRY_DELAY_SECONDS, interval - elapsed))
+            try:
+                with self._maintenance_lock("在线备份") as acquired:
+                    # 多个进程共用数据目录时，拿到锁后再确认一次其他进程是否刚备份过
+                    backups = self._list_backups()
+                    if acquired and (not backups or time.time() - backups[-1].stat().st_mtime >= interval):
+                        await self._run_backup()
+            except Exception as e:
+                logger.error(f"定时备份失败: {e}")
+
+    def _list_backups(self) -> list[Path]:
+        """已完成的备份目录，按时间从旧到新排序 (目录名带时间戳，按名称排序即可)。"""
+        backup_root = self.data_dir / BACKUP_DIR_NAME
+        if not backup_root.is_dir():
+            return []
+        return sorted(path for path in backup_root.iterdir()
+                      if path.is_dir() and path.name.startswith("backup_")
+                      and not path.name.endswith(BACKUP_PARTIAL_SUFFIX))
+
+    def _prune_backups(self) -> list[str]:
+        """只保留最近 keep 份备份，顺带清理进程中途退出留下的未完成目录，返回删除的目录名。"""
+        keep = max(1, int(self.settings['backup']['keep']))
+        removed = self._list_backups()[:-keep]
+        backup_root = self.data_dir / BACKUP_DIR_NAME
+        now = time.time()
+        removed += [path for path in backup_root.glob(f"backup_*{BACKUP_PARTIAL_SUFFIX}")
+                    if now - path.stat().st_mtime > BACKUP_STALE_PARTIAL_SECONDS]
+        for path in removed:
+            shutil.rmtree(path, ignore_errors=True)
+        return [path.name for path in removed]
+
+    def _backup_database(self, source: Path, target: Path) -> int:
+        """(工作线程中执行) 用在线备份 API 分步复制一个数据库文件并校验副本，返回复制的页数。"""
+        backup = self.settings['backup']
+        pause = backup['step_pause_ms'] / 1000
+        progress = {"pages": 0, "remaining": None, "restarts": 0}
+
+        class _BackupRestartLimit(Exception):
+            """分步备份被并发写入打断的次数超过上限 (在进度回调中抛出以中止本次分步复制)。"""
+
+        def on_progress(status, remaining, total):
+            # 源库在备份过程中被其他连接修改时 SQLite 会从头重新复制 (剩余页数回升)，保证副本是某一时刻的一致快照
+            if progress['remaining'] is not None and remaining > progress['remaining']:
+                progress['restarts'] += 1
+                if progress['restarts'] > BACKUP_MAX_RESTARTS:
+                    raise _BackupRestartLimit()
+            progress.update(pages=total, remaining=remaining)
+            # 每步结束后源库的读锁已释放，在这里暂停让其他连接读写 (sleep 参数只在遇到锁冲突时生效)
+            if remaining and pause > 0:
+                time.sleep(pause)
+
+        src = sqlite3.connect(source, timeout=self.settings['storage']['busy_timeout_ms'] / 1000)
+        dst = sqlite3.connect(target)
+        try:
+            try:
+                src.backup(dst, pages=max(1, int(backup['pages_per_step'])), progress=on_progress, sleep=pause)
+            except _BackupRestartLimit:
+                # 写入太频繁，分步复制一直被打断：改为一步复制完 (只在复制期间短暂阻塞写入)
+                logger.info(f"{source.name} 分步备份被写入打断 {BACKUP_MAX_RESTARTS} 次，改为一次性复制。")
+                src.backup(dst, sleep=pause)
+            result = dst.execute("PRAGMA integrity_check").fetchone()[0]
+        finally:
+            dst.close()
+            src.close()
+        if result != "ok":
+            raise RuntimeError(f"{source.name} 的备份副本未通过完整性校验: {result}")
+        return progress['pages']
+
+    async def _run_backup(self) -> dict:
+        """
+        把所有分片备份到 backups/ 下新的时间戳目录。先写入 .partial 目录，全部分片复制并校验通过后才改名，
+        因此 backups/ 中不带后缀的目录都是完整可用的备份。调用方负责持有维护锁。
+        """
+        if self._backup_running:
+            raise RuntimeError("已有备份正在进行，请稍后再试。")
+        backup_root = self.data_dir / BACKUP_DIR_NAME
+        name = f"backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        final_dir = backup_root / name
+        partial_dir = backup_root / f"{name}{BACKUP_PARTIAL_SUFFIX}"
+        if final_dir.exists() or partial_dir.exists():
+            raise RuntimeError("刚刚已经创建过备份，请稍后再试。")
+
+        self._backup_running = True
+        start = time.perf_counter()
+        try:
+            partial_dir.mkdir(parents=True)
+            pages = 0
+            for path in self.db_paths:
+                if path.exists():
+                    pages += await asyncio.to_thread(self._backup_database, path, partial_dir / path.name)
+            partial_dir.rename(final_dir)
+        except Exception:
+            shutil.rmtree(partial_dir, ignore_errors=True)
+            self.backup_stats['failed'] += 1
+            raise
+        finally:
+            self._backup_running = False
+
+        seconds = time.perf_counter() - start
+        files = list(final_dir.iterdir())
+        pruned = self._prune_backups()
+        self.backup_stats.update(completed=self.backup_stats['completed'] + 1, last_seconds=seconds,
+                                 last_completed_at=int(time.time()))
+        logger.info(f"在线备份完成: {name} ({len(files)} 个文件, {pages} 页)，耗时 {seconds:.2f}秒，清理旧备份 {len(pruned)} 份。")
+        return {"name": name, "files": len(files), "pages": pages, "seconds": seconds,
+                "bytes": sum(path.stat().st_size for path in files), "pruned": pruned}
+
+    # --- 全服排行 ---
+    async def _leaderboard_loop(self):
+        """启动时构建全服排行，之后定期与数据库对账，纠正增量更新遗漏的变化 (导入、批量维护等)。"""
+        while True:
+            try:
+                await self._rebuild_leaderboard()
+            except Exception as e:
+                logger.error(f"重建全服排行失败: {e}")
+            finally:
+                if self.leaderboard is not None:
+                    self.leaderboard.touched = None  # 重建失败时旧排行继续使用，停止记录
+            await asyncio.sleep(LEADERBOARD_RECONCILE_SECONDS)
+
+    def _build_leaderboard(self, baseline: dict | None) -> tuple[GlobalLeaderboard, int]:
+        """
+        (工作线程中执行) 按 rowid 分块扫描所有分片的宠物，构建一份新的全服排行，并与 baseline (旧排行条目的副本)
+        比较得出偏差数。块与块之间不持有读锁，不会挡住写入。
+        """
+        leaderboard = GlobalLeaderboard()
+        for path in self.db_paths:
+            with self._open_db(path) as conn:
+                for rows in iter_rowid_chunks(conn, "pets", "user_id, group_id, pet_name, level, exp", "1", ()):
+                    for _, user_id, group_id, pet_name, level, exp in rows:
+                        leaderboard.update(user_id, group_id, pet_name, level, exp)
+        drift = 0
+        if baseline is not None:
+            drift = sum(1 for ident, entry in leaderboard.entries.items() if baseline.get(ident) != entry)
+            drift += sum(1 for ident in baseline if ident not in leaderboard.entries)
+        return leaderboard, drift
+
+    async def _rebuild_leaderboard(self):
+        """在工作线程中扫描、构建与对账，回到事件循环后再替换；构建期间命令做的增量更新会补到新排行上。"""
+        start = time.perf_counter()
+        current = self.leaderboard
+        baseline = None
+        if current is not None:
+            current.touched = set()
+            baseline = dict(current.entries)
+        leaderboard, drift = await asyncio.to_thread(self._build_leaderboard, baseline)
+        if current is not None:
+            # 扫描开始后才发生的增量更新比扫描结果更新，以旧排行中的状态为准
+            for ident in current.touched:
+                entry = current.entries.get(ident)
+                if entry is None:
+                    leaderboard.remove(*ident)
+                else:
+                    key, pet_name = entry
+                    leaderboard.update(ident[0], ident[1], pet_name, -key[0], -key[1])
+        self.leaderboard = leaderboard
+        if drift:
+            logger.info(f"全服排行对账: 修正了 {drift} 条记录。")
+        logger.debug(f"全服排行已重建: {len(leaderboard)} 只宠物，用时 {time.perf_counter() - start:.2f}s")
+        # 旧排行有几十万个跳表节点，在工作线程中释放最后一个引用，避免析构阻塞事件循环
+        stale = [current]
+        del current, baseline
+        await asyncio.to_thread(stale.clear)
 
     def _exp_for_next_level(self, level: int) -> int:
         """计算升到下一级所需的总经验。"""
@@ -332,9 +2793,8 @@ class PetPlugin(Star):
         pet = self._get_pet(user_id, group_id)
         if not pet: return []
 
-        pet_type_config = self.pets_data.get(pet['pet_type'])
-        if not pet_type_config: return []
-        learnset = pet_type_config.get('learnset', {})
+        if pet['pet_type'] not in self.pets_data: return []
+        learnset = self._learnset(pet['pet_type'])
 
         while True:
             pet = self._get_pet(user_id, group_id) # 重新获取最新数据
@@ -347,7 +2807,7 @@ class PetPlugin(Star):
                 new_attack = pet['attack'] + random.randint(1, 2)
                 new_defense = pet['defense'] + random.randint(1, 2)
 
-                with sqlite3.connect(self.db_path) as conn:
+                with self._connect(group_id) as conn:
                     conn.execute(
                         "UPDATE pets SET level = ?, exp = ?, attack = ?, defense = ? WHERE user_id = ? AND group_id = ?",
                         (new_level, remaining_exp, new_attack, new_defense, int(user_id), int(group_id))
@@ -358,7 +2818,7 @@ class PetPlugin(Star):
                 level_up_messages.append(f"🎉 恭喜！你的宠物「{pet['pet_name']}」升级到了 Lv.{new_level}！")
 
                 # 检查技能学习
-                moves_learned = learnset.get(str(new_level))
+                moves_learned = learnset.new_at(new_level)
                 if moves_learned:
                     for move in moves_learned:
                         level_up_messages.append(f"💡 你的宠物「{pet['pet_name']}」似乎可以学习新技能「{move}」了！")
@@ -368,9 +2828,12 @@ class PetPlugin(Star):
                 break
         return level_up_messages
 
+    @timed_phase("render")
     def _generate_pet_status_image(self, pet_data: dict, sender_name: str) -> Path | str:
         """根据宠物数据生成一张状态图（已更新为显示状态和持有物）。"""
         try:
+            from PIL import Image, ImageDraw, ImageFont  # 只有绘制状态图时才需要，延迟导入以加快插件加载
+
             W, H = 800, 600
             bg_path = self.assets_dir / "background.png"
             font_path = self.assets_dir / "font.ttf"
@@ -462,9 +2925,14 @@ class PetPlugin(Star):
         return 1.0 # 普通
 
     # --- 战斗核心 (v1.5 重构) ---
-    def _run_battle(self, pet1_orig: dict, pet2_orig: dict) -> tuple[list[str], str]:
-        """执行两个宠物之间的对战（v1.5 重构，支持状态和持有物）。"""
+    @timed_phase("battle")
+    def _run_battle(self, pet1_orig: dict, pet2_orig: dict) -> tuple[list[str], str, list[str]]:
+        """
+        执行两个宠物之间的对战（v1.5 重构，支持状态和持有物）。
+        返回 (完整战报, 胜利者名字, 关键时刻)；关键时刻只记录会心一击、状态变化和击倒。
+        """
         log = []
+        highlights = []
 
         # 深拷贝，防止战斗中的状态修改影响到原始数据
         pet1 = deepcopy(pet1_orig)
@@ -498,6 +2966,7 @@ class PetPlugin(Star):
                 if random.random() < 0.5: # 50% 几率醒来
                     attacker['status_condition'] = None
                     turn_log.append(f"「{attacker['pet_name']}」醒过来了！")
+                    highlights.append(f"第{turn}回合「{attacker['pet_name']}」醒过来了")
                 else:
                     turn_log.append(f"「{attacker['pet_name']}」正在熟睡...")
                     return defender_hp, new_defender_status, turn_log
@@ -554,7 +3023,9 @@ class PetPlugin(Star):
 
                 defender_hp -= final_dmg
 
-                if is_crit: turn_log.append("💥 会心一击！")
+                if is_crit:
+                    turn_log.append("💥 会心一击！")
+                    highlights.append(f"第{turn}回合「{attacker['pet_name']}」的「{chosen_move_name}」会心一击，造成 {final_dmg} 点伤害")
                 if attr_multiplier > 1.2:
                     turn_log.append("效果拔群！")
                 elif attr_multiplier < 1.0:
@@ -577,6 +3048,7 @@ class PetPlugin(Star):
                         defender['status_condition'] = new_defender_status # 更新字典中的状态
                         status_name = STAT_MAP.get(new_defender_status, "异常")
                         turn_log.append(f"「{defender['pet_name']}」陷入了「{status_name}」状态！")
+                        highlights.append(f"第{turn}回合「{defender['pet_name']}」陷入了「{status_name}」状态")
                     else:
                         turn_log.append(f"「{defender['pet_name']}」免疫该状态！")
 
@@ -619,10 +3091,12 @@ class PetPlugin(Star):
             if p1_hp <= 0: break
 
         winner_name = p1_name if p1_hp > 0 else p2_name
+        loser_name = p2_name if winner_name == p1_name else p1_name
+        highlights.append(f"第{turn}回合「{loser_name}」倒下了 (「{winner_name}」剩余HP: {max(p1_hp, p2_hp)})")
         log.append(f"\n战斗结束！胜利者是「{winner_name}」！")
 
         # --- 战斗后结算状态 ---
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(pet1_orig['group_id']) as conn:
             # 睡眠状态在战斗结束后自动解除
             p1_final_status = None if pet1.get('status_condition') == 'SLEEP' else pet1.get('status_condition')
             p2_final_status = None if pet2.get('status_condition') == 'SLEEP' else pet2.get('status_condition')
@@ -633,11 +3107,43 @@ class PetPlugin(Star):
                          (p2_final_status, int(pet2_orig['user_id']), int(pet2_orig['group_id'])))
             conn.commit()
 
-        return log, winner_name
+        return log, winner_name, highlights
+
+    def _battle_summary(self, battle_log: list[str], highlights: list[str], winner_name: str,
+                        viewers: list[tuple[str, str]]) -> list[str]:
+        """
+        按 battle_output 设置生成战斗部分的回复行。完整战报会以 TTL 存入临时存储，
+        供 viewers 中的每个 (用户, 群) 在一段时间内用 /战斗详情 查看。
+        """
+        output = self.settings['battle_output']
+        for user_id, group_id in viewers:
+            self.ephemeral.set(("battle_detail", user_id, group_id), battle_log, output['detail_ttl_seconds'])
+        if output['mode'] == "full":
+            return list(battle_log)
+
+        turns = sum(1 for line in battle_log if line.startswith("\n--- 第"))
+        lines = [battle_log[0], f"激战 {turns} 回合，关键时刻："]
+        shown = highlights if len(highlights) <= BATTLE_HIGHLIGHT_LIMIT else (
+            highlights[:BATTLE_HIGHLIGHT_LIMIT - 1] + [f"……另有 {len(highlights) - BATTLE_HIGHLIGHT_LIMIT} 个关键时刻",
+                                                      highlights[-1]])
+        lines.extend(f"· {line}" for line in shown)
+        lines.append(f"胜利者是「{winner_name}」！(发送 /战斗详情 查看完整战报)")
+        return lines
+
+    def _cap_message(self, text: str) -> str:
+        """把单条回复截断到 max_message_chars 以内，避免平台拒收过长的消息。"""
+        max_chars = self.settings['battle_output']['max_message_chars']
+        if len(text) <= max_chars:
+            return text
+        suffix = "\n……(内容过长已截断，发送 /战斗详情 查看完整战报)"
+        if len(suffix) >= max_chars:
+            suffix = "…"  # 上限比提示语还短时只保留省略号，保证不超过上限
+        return text[:max(0, max_chars - len(suffix))] + suffix
     # --- 战斗核心结束 ---
 
 
     @filter.command("领养宠物")
+    @pet_command()
     async def adopt_pet(self, event: AstrMessageEvent, pet_name: str | None = None):
         """领养一只随机的初始宠物（已更新为使用技能系统）。"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
@@ -659,26 +3165,28 @@ class PetPlugin(Star):
 
         pet_info = self.pets_data[type_name]
         stats = pet_info['base_stats']
-        now_iso = datetime.now().isoformat()
+        now = int(time.time())
 
         # --- 分配初始技能 ---
-        learnset = pet_info.get('learnset', {})
-        default_moves = learnset.get('1', ["撞击"]) # 默认1级技能
+        default_moves = list(self._learnset(type_name).new_at(1)) or ["撞击"] # 默认1级技能
         moves = (default_moves + [None] * 4)[:4] # 填充技能栏
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(group_id) as conn:
             conn.execute(
-                """INSERT INTO pets (user_id, group_id, pet_name, pet_type, attack, defense, last_updated_time, move1, move2, move3, move4)
+                """INSERT INTO pets (user_id, group_id, pet_name, pet_type, attack, defense, last_updated_at, move1, move2, move3, move4)
                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (int(user_id), int(group_id), pet_name, type_name, stats['attack'], stats['defense'], now_iso,
+                (int(user_id), int(group_id), pet_name, type_name, stats['attack'], stats['defense'], now,
                  moves[0], moves[1], moves[2], moves[3])
             )
             conn.commit()
+        if self.leaderboard is not None:
+            self.leaderboard.update(user_id, group_id, pet_name, 1, 0)
         logger.info(f"新宠物领养: 群 {group_id} 用户 {user_id} 领养了 {type_name} - {pet_name}")
         yield event.plain_result(
             f"恭喜你，{event.get_sender_name()}！命运让你邂逅了「{pet_name}」({type_name})！\n发送 /我的宠物 查看它的状态吧。")
 
     @filter.command("我的宠物")
+    @pet_command(cost="render")
     async def my_pet_status(self, event: AstrMessageEvent):
         """查看宠物状态"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
@@ -694,6 +3202,7 @@ class PetPlugin(Star):
             yield event.plain_result(result)
 
     @filter.command("宠物改名")
+    @pet_command()
     async def rename_pet(self, event: AstrMessageEvent, new_name: str | None = None):
         """为你的宠物改一个新名字。"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
@@ -709,34 +3218,57 @@ class PetPlugin(Star):
             yield event.plain_result("你还没有宠物，不能改名哦。")
             return
         old_name = pet['pet_name']
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(group_id) as conn:
             conn.execute("UPDATE pets SET pet_name = ? WHERE user_id = ? AND group_id = ?",
                          (new_name, int(user_id), int(group_id)))
             conn.commit()
+        if self.leaderboard is not None:
+            self.leaderboard.update(user_id, group_id, new_name, pet['level'], pet['exp'])
+        # 同步内存中散步冷却记录里的宠物名
+        walk_cooldown = self.ephemeral.ttl(("walk_cooldown", user_id, group_id))
+        if walk_cooldown:
+            self.ephemeral.set(("walk_cooldown", user_id, group_id), new_name, walk_cooldown)
         logger.info(f"宠物改名: 群 {group_id} 用户 {user_id} 将 {old_name} 改名为 {new_name}")
         yield event.plain_result(f"改名成功！你的宠物「{old_name}」现在叫做「{new_name}」了。")
 
     @filter.command("散步")
+    @pet_command(cost="battle")
     async def walk_pet(self, event: AstrMessageEvent):
         """带宠物散步，触发随机奇遇或PVE战斗"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
         if not group_id: return
 
+        # 冷却中的请求直接从内存拒绝，无需读取数据库
+        cooldown_key = ("walk_cooldown", user_id, group_id)
+        cooling_pet_name = self.ephemeral.get(cooldown_key)
+        if cooling_pet_name:
+            yield event.plain_result(f"刚散步回来，让「{cooling_pet_name}」休息一下吧。")
+            return
+
         pet = self._get_pet(user_id, group_id)
         if not pet:
             yield event.plain_result("你还没有宠物，不能去散步哦。")
             return
 
-        now = datetime.now()
-        last_walk_str = pet.get('last_walk_time')
-        if last_walk_str and now - datetime.fromisoformat(last_walk_str) < timedelta(minutes=5):
-            yield event.plain_result(f"刚散步回来，让「{pet['pet_name']}」休息一下吧。")
-            return
+        now = int(time.time())
+        last_walk_at = pet.get('last_walk_at')
+        if last_walk_at is not None:
+            elapsed = now - last_walk_at
+            if elapsed < WALK_COOLDOWN_SECONDS:
+                self.ephemeral.set(cooldown_key, pet['pet_name'], WALK_COOLDOWN_SECONDS - elapsed)
+                yield event.plain_result(f"刚散步回来，让「{pet['pet_name']}」休息一下吧。")
+                return
 
         final_reply = []
         exp_gain, money_gain, mood_gain, satiety_gain = 0, 0, 0, 0
 
-        event_data = self._select_walk_event()
+        event_data = self._select_walk_event(group_id, pet['level'])
+        if event_data.get('type') == 'pve':
+            npc_level = max(1, pet['level'] + random.randint(-1, 1))
+            npc_pet = self.wild_pets.spawn(npc_level)  # 从预编译的模板池生成，技能已按等级段准备好
+            if npc_pet is None:
+                logger.warning("没有可用的野生宠物，本次散步改为 'nothing' 事件。")
+                event_data = WALK_NOTHING_EVENT
         event_type = event_data.get('type', 'nothing')
         description = event_data.get('description', '...').format(pet_name=pet['pet_name'])
         final_reply.append(description)
@@ -760,33 +3292,8 @@ class PetPlugin(Star):
                 final_reply.append(f"意外之喜！你在路边捡到了 ${money_gain}！")
 
         elif event_type == 'pve':
-            npc_level = max(1, pet['level'] + random.randint(-1, 1))
-            npc_type_name = random.choice(list(self.pets_data.keys()))
-            npc_pet_info = self.pets_data[npc_type_name]
-            npc_stats = npc_pet_info['base_stats']
-
-            # 为NPC分配技能
-            npc_learnset = npc_pet_info.get('learnset', {})
-            npc_available_moves = []
-            for lvl_str, moves in npc_learnset.items():
-                if int(lvl_str) <= npc_level:
-                    npc_available_moves.extend(moves)
-
-            if not npc_available_moves: npc_available_moves = ["撞击"]
-            chosen_moves = (random.sample(npc_available_moves, min(len(npc_available_moves), 4)) + [None] * 4)[:4]
-
-            npc_pet = {
-                "user_id": "0", "group_id": "0", # 假ID
-                "pet_name": f"野生的{npc_type_name}", "pet_type": npc_type_name,
-                "level": npc_level, "attack": npc_stats['attack'] + npc_level,
-                "defense": npc_stats['defense'] + npc_level, "satiety": 100, "mood": 100,
-                "move1": chosen_moves[0], "move2": chosen_moves[1],
-                "move3": chosen_moves[2], "move4": chosen_moves[3],
-                "status_condition": None, "held_item": None # 野生宠物默认无状态
-            }
-
-            battle_log, winner_name = self._run_battle(pet, npc_pet)
-            final_reply.extend(battle_log)
+            battle_log, winner_name, highlights = self._run_battle(pet, npc_pet)
+            final_reply.extend(self._battle_summary(battle_log, highlights, winner_name, [(user_id, group_id)]))
 
             if winner_name == pet['pet_name']:
                 exp_gain = npc_level * 5 + random.randint(1, 5)
@@ -812,19 +3319,23 @@ class PetPlugin(Star):
 
         # --- 统一更新数据库 ---
         try:
-            with sqlite3.connect(self.db_path) as conn:
+            with self._connect(group_id) as conn:
                 conn.execute(
                     """UPDATE pets SET 
                        exp = exp + ?, 
                        money = money + ?, 
                        mood = MIN(100, mood + ?), 
                        satiety = MIN(100, satiety + ?), 
-                       last_walk_time = ? 
+                       last_walk_at = ? 
                        WHERE user_id = ? AND group_id = ?""",
-                    (exp_gain, money_gain, mood_gain, satiety_gain, now.isoformat(), int(user_id), int(group_id))
+                    (exp_gain, money_gain, mood_gain, satiety_gain, now, int(user_id), int(group_id))
                 )
+                self._record_money(conn, [(user_id, group_id, money_gain, WALK_MONEY_REASONS.get(event_type, "散步"))])
                 conn.commit()
+            self.ephemeral.set(cooldown_key, pet['pet_name'], WALK_COOLDOWN_SECONDS)
         except Exception as e:
+            if is_busy_error(e):
+                raise  # 交给 pet_command 回滚后整体重试
             logger.error(f"散步事件更新数据库时出错: {e}")
             final_reply.append("（系统错误：保存奖励失败，请联系管理员）")
 
@@ -832,9 +3343,10 @@ class PetPlugin(Star):
         if exp_gain > 0:
             final_reply.extend(self._check_level_up(user_id, group_id))
 
-        yield event.plain_result("\n".join(final_reply))
+        yield event.plain_result(self._cap_message("\n".join(final_reply)))
 
     @filter.command("对决")
+    @pet_command(lock="duel", cost="battle")
     async def duel_pet(self, event: AiocqhttpMessageEvent):
         """与其他群友的宠物进行对决"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
@@ -845,6 +3357,14 @@ class PetPlugin(Star):
             yield event.plain_result("请@一位你想对决的群友。用法: /对决 @某人")
             return
 
+        # 冷却中的请求直接从内存拒绝，无需读取数据库
+        cooldown_key = ("duel_cooldown", user_id, group_id)
+        remaining_seconds = self.ephemeral.ttl(cooldown_key)
+        if remaining_seconds:
+            remaining = timedelta(seconds=int(remaining_seconds))
+            yield event.plain_result(f"你的对决技能正在冷却中，还需等待 {remaining}。")
+            return
+
         challenger_pet = self._get_pet(user_id, group_id)
         if not challenger_pet:
             yield event.plain_result("你还没有宠物，无法发起对决。")
@@ -859,16 +3379,15 @@ class PetPlugin(Star):
             yield event.plain_result("对方还没有宠物呢。")
             return
 
-        now = datetime.now()
-        last_duel_challenger_str = challenger_pet.get('last_duel_time')
-        if last_duel_challenger_str:
-            last_duel_challenger = datetime.fromisoformat(last_duel_challenger_str)
-            if now - last_duel_challenger < timedelta(minutes=30):
-                remaining = timedelta(minutes=30) - (now - last_duel_challenger)
-                yield event.plain_result(f"你的对决技能正在冷却中，还需等待 {str(remaining).split('.')[0]}。")
-                return
+        now = int(time.time())
+        last_duel_at = challenger_pet.get('last_duel_at')
+        if last_duel_at is not None and now - last_duel_at < DUEL_COOLDOWN_SECONDS:
+            remaining = DUEL_COOLDOWN_SECONDS - (now - last_duel_at)
+            self.ephemeral.set(cooldown_key, True, remaining)
+            yield event.plain_result(f"你的对决技能正在冷却中，还需等待 {timedelta(seconds=remaining)}。")
+            return
 
-        battle_log, winner_name = self._run_battle(challenger_pet, target_pet)
+        battle_log, winner_name, highlights = self._run_battle(challenger_pet, target_pet)
 
         money_gain = 20
         if winner_name == challenger_pet['pet_name']:
@@ -880,30 +3399,67 @@ class PetPlugin(Star):
             winner_exp = 10 + challenger_pet['level'] * 2
             loser_exp = 5 + target_pet['level']
 
-        final_reply = list(battle_log)
+        final_reply = self._battle_summary(battle_log, highlights, winner_name,
+                                           [(user_id, group_id), (target_id, group_id)])
         final_reply.append(
             f"\n对决结算：胜利者获得了 {winner_exp} 点经验值和 ${money_gain}，参与者获得了 {loser_exp} 点经验值。")
 
-        with sqlite3.connect(self.db_path) as conn:
-            now_iso = now.isoformat()
-            conn.execute("UPDATE pets SET last_duel_time = ? WHERE user_id = ? AND group_id = ?",
-                         (now_iso, int(user_id), int(group_id)))
-            conn.execute("UPDATE pets SET last_duel_time = ? WHERE user_id = ? AND group_id = ?",
-                         (now_iso, int(target_id), int(group_id)))
+        with self._connect(group_id) as conn:
+            conn.execute("UPDATE pets SET last_duel_at = ? WHERE user_id = ? AND group_id = ?",
+                         (now, int(user_id), int(group_id)))
+            conn.execute("UPDATE pets SET last_duel_at = ? WHERE user_id = ? AND group_id = ?",
+                         (now, int(target_id), int(group_id)))
             conn.execute("UPDATE pets SET money = money + ? WHERE user_id = ? AND group_id = ?",
                          (money_gain, int(winner_id), int(group_id)))
+            self._record_money(conn, [(winner_id, group_id, money_gain, "对决胜利")])
             conn.execute("UPDATE pets SET exp = exp + ? WHERE user_id = ? AND group_id = ?",
                          (winner_exp, int(winner_id), int(group_id)))
             conn.execute("UPDATE pets SET exp = exp + ? WHERE user_id = ? AND group_id = ?",
                          (loser_exp, int(loser_id), int(group_id)))
             conn.commit()
+        self.ephemeral.set(cooldown_key, True, DUEL_COOLDOWN_SECONDS)
+        self.ephemeral.set(("duel_cooldown", target_id, group_id), True, DUEL_COOLDOWN_SECONDS)
 
         final_reply.extend(self._check_level_up(winner_id, group_id))
         final_reply.extend(self._check_level_up(loser_id, group_id))
 
-        yield event.plain_result("\n".join(final_reply))
+        yield event.plain_result(self._cap_message("\n".join(final_reply)))
+
+    @filter.command("战斗详情")
+    @pet_command(lock=None, cost="read")
+    async def battle_detail(self, event: AstrMessageEvent, page_arg: str | None = None):
+        """查看最近一场战斗的完整战报。aiocqhttp 上以合并转发发送，其他平台分页发送。"""
+        user_id, group_id = event.get_sender_id(), event.get_group_id()
+        if not group_id: return
+
+        battle_log = self.ephemeral.get(("battle_detail", user_id, group_id))
+        if not battle_log:
+            yield event.plain_result("没有找到你最近的战斗记录 (战报只保留一段时间)。")
+            return
+        lines = [line.strip("\n") for line in battle_log]
+        max_chars = self.settings['battle_output']['max_message_chars']
+
+        if event.get_platform_name() == "aiocqhttp" and not page_arg:
+            pages = paginate_lines(lines, max_chars)
+            nodes = [Node(uin=event.get_self_id(), name=BATTLE_DETAIL_NODE_NAME, content=[Plain(page)]) for page in pages]
+            yield event.chain_result([Nodes(nodes)])
+            return
+
+        try:
+            page = int(page_arg) if page_arg else 1
+        except ValueError:
+            yield event.plain_result("页码必须是一个数字。")
+            return
+        pages = paginate_with_footer(
+            lines, max_chars,
+            lambda number, total: f"\n(第 {number}/{total} 页，发送 /战斗详情 {number + 1} 查看下一页)" if number < total else "")
+        if not 1 <= page <= len(pages):
+            yield event.plain_result(f"页码超出范围，战报共 {len(pages)} 页。")
+            return
+        yield event.plain_result(pages[page - 1])
 
     @filter.command("宠物进化")
+    @pet_command()
     async def evolve_pet(self, event: AstrMessageEvent):
         """让达到条件的宠物进化。"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
@@ -937,7 +3493,7 @@ class PetPlugin(Star):
         new_attack = pet['attack'] + random.randint(8, 15)
         new_defense = pet['defense'] + random.randint(8, 15)
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(group_id) as conn:
             conn.execute(
                 "UPDATE pets SET evolution_stage = ?, attack = ?, defense = ? WHERE user_id = ? AND group_id = ?",
                 (next_evo_stage, new_attack, new_defense, int(user_id), int(group_id)))
@@ -949,6 +3505,7 @@ class PetPlugin(Star):
 
     # --- 技能管理命令 ---
     @filter.command("宠物技能")
+    @pet_command(cost="read")
     async def pet_moves(self, event: AstrMessageEvent):
         """查看宠物的技能学习情况。"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
@@ -963,8 +3520,6 @@ class PetPlugin(Star):
             yield event.plain_result("错误：找不到宠物配置。")
             return
 
-        learnset = pet_config.get('learnset', {})
-
         reply = f"--- 「{pet['pet_name']}」的技能 ---\n"
         reply += "【当前技能】\n"
         current_moves = [pet.get('move1'), pet.get('move2'), pet.get('move3'), pet.get('move4')]
@@ -978,23 +3533,18 @@ class PetPlugin(Star):
                 reply += f"[{i+1}] -- 空 --\n"
 
         reply += "\n【可学技能】(按等级)\n"
-        available_moves = []
-        for lvl_str, moves in learnset.items():
-            if int(lvl_str) <= pet['level']:
-                available_moves.extend(moves)
+        available_moves = self._learnset(pet['pet_type']).available(pet['level'])
 
         if not available_moves:
             reply += "暂无可学习的技能。\n"
         else:
-            # 去重并保持顺序
-            seen = set()
-            unique_moves = [m for m in available_moves if not (m in seen or seen.add(m))]
-            reply += "、".join(unique_moves)
+            reply += "、".join(available_moves)
             reply += "\n\n使用 `/学习技能 [栏位] [技能名]` 来替换技能。"
 
         yield event.plain_result(reply)
 
     @filter.command("学习技能")
+    @pet_command()
     async def learn_move(self, event: AstrMessageEvent, slot_arg: str | None = None, move_name: str | None = None):
         """让宠物在指定栏位学习一个新技能。"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
@@ -1027,20 +3577,16 @@ class PetPlugin(Star):
             return
 
         # 检查是否在可学列表里
-        learnset = pet_config.get('learnset', {})
-        can_learn = False
-        for lvl_str, moves in learnset.items():
-            if int(lvl_str) <= pet['level'] and move_name in moves:
-                can_learn = True
-                break
+        can_learn = self._learnset(pet['pet_type']).can_learn(pet['level'], move_name)
 
         # 检查是否通过TM（技能光盘）学习
         is_tm = False
         if not can_learn:
             item_name = f"技能光盘-{move_name}"
-            if item_name in SHOP_ITEMS and SHOP_ITEMS[item_name]['type'] == 'tm':
+            tm_info = self._get_shop_catalog().items.get(item_name)
+            if tm_info and tm_info['type'] == 'tm':
                 # 检查背包
-                with sqlite3.connect(self.db_path) as conn:
+                with self._connect(group_id) as conn:
                     cursor = conn.cursor()
                     cursor.execute(
                         "SELECT quantity FROM inventory WHERE user_id = ? AND group_id = ? AND item_name = ?",
@@ -1070,7 +3616,7 @@ class PetPlugin(Star):
         move_col = f"move{slot}"
         old_move = pet.get(move_col) or "空栏位"
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(group_id) as conn:
             conn.execute(
                 f"UPDATE pets SET {move_col} = ? WHERE user_id = ? AND group_id = ?",
                 (move_name, int(user_id), int(group_id))
@@ -1098,6 +3644,7 @@ class PetPlugin(Star):
     # --- [NEW] 新增管理员修复功能 ---
     @filter.permission_type(filter.PermissionType.ADMIN)
     @filter.command("修复宠物技能")
+    @pet_command(lock=None)
     async def admin_fix_skills(self, event: AiocqhttpMessageEvent):
         """(管理员) 检查并修复本群所有宠物的重复技能。"""
         group_id = event.get_group_id()
@@ -1105,66 +3652,413 @@ class PetPlugin(Star):
             yield event.plain_result("该功能仅限群聊使用。")
             return
 
-        reset_pets_info = [] # 存储被重置的宠物信息
-
         try:
-            with sqlite3.connect(self.db_path) as conn:
-                conn.row_factory = sqlite3.Row
-                cursor = conn.cursor()
-                cursor.execute("SELECT * FROM pets WHERE group_id = ?", (int(group_id),))
-                all_pets = cursor.fetchall()
-
-                if not all_pets:
-                    yield event.plain_result("本群还没有领养任何宠物。")
+            with self._maintenance_lock("批量维护 技能") as acquired:
+                if not acquired:
+                    yield event.plain_result("其他进程正在进行维护操作，请稍后再试。")
                     return
+                async for state in self._run_bulk_operation("技能", group_id, dry_run=False):
+                    pass
 
-                for pet in all_pets:
-                    moves = [pet['move1'], pet['move2'], pet['move3'], pet['move4']]
-                    filled_moves = [m for m in moves if m] # 过滤掉 None
-
-                    # 检查是否有重复技能
-                    if len(filled_moves) > len(set(filled_moves)):
-                        # 发现重复，执行重置
-                        pet_config = self.pets_data.get(pet['pet_type'])
-                        if not pet_config:
-                            logger.error(f"修复技能失败：群{group_id} 宠物{pet['pet_name']} 找不到 {pet['pet_type']} 的配置")
-                            continue
-
-                        learnset = pet_config.get('learnset', {})
-                        default_moves = learnset.get('1', ["撞击"])
-                        new_moves = (default_moves + [None] * 4)[:4]
-
-                        conn.execute(
-                            """UPDATE pets SET move1 = ?, move2 = ?, move3 = ?, move4 = ?
-                               WHERE user_id = ? AND group_id = ?""",
-                            (new_moves[0], new_moves[1], new_moves[2], new_moves[3], pet['user_id'], int(group_id))
-                        )
-                        reset_pets_info.append({'name': pet['pet_name'], 'user_id': pet['user_id']})
-
-            if not reset_pets_info:
+            if not state['matched']:
                 yield event.plain_result("✅ 检查完毕。本群所有宠物技能均无异常。")
             else:
-                names = [p['name'] for p in reset_pets_info]
-                user_ids = [p['user_id'] for p in reset_pets_info]
-                logger.info(f"管理员 {event.get_sender_id()} 修复了群 {group_id} 的宠物技能，被重置的用户: {user_ids}")
-                yield event.plain_result(f"🛠️ 技能修复完毕！以下宠物的技能（因重复）已被重置为1级默认：\n{', '.join(names)}")
+                names = ', '.join(state['samples'])
+                if state['matched'] > len(state['samples']):
+                    names += f" 等{state['matched']}只"
+                logger.info(f"管理员 {event.get_sender_id()} 修复了群 {group_id} 的宠物技能，共 {state['matched']} 只")
+                yield event.plain_result(f"🛠️ 技能修复完毕！以下宠物的技能（因重复）已被重置为1级默认：\n{names}")
 
         except Exception as e:
             logger.error(f"执行 /修复宠物技能 时发生错误: {e}")
             yield event.plain_result(f"执行修复时发生内部错误，请检查日志: {e}")
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("宠物批量")
+    @pet_command(lock=None)
+    async def admin_bulk(self, event: AstrMessageEvent, op_name: str | None = None,
+                         scope_arg: str | None = None, mode_arg: str | None = None):
+        """(管理员) 批量维护操作。默认只试运行统计影响范围，加「执行」才会修改数据。"""
+        usage = "用法: /宠物批量 [操作] [本群|全服] [试运行|执行]\n可用操作:\n" + "\n".join(
+            f"{name} - {description}" for name, (description, _) in BULK_OPERATIONS.items())
+        if op_name not in BULK_OPERATIONS or scope_arg not in (None, "本群", "全服") or mode_arg not in (None, "试运行", "执行"):
+            yield event.plain_result(usage)
+            return
 
+        all_groups = scope_arg == "全服"
+        group_id = None if all_groups else event.get_group_id()
+        if not all_groups and not group_id:
+            yield event.plain_result("私聊中请指定「全服」范围。")
+            return
+        dry_run = mode_arg != "执行"
+        scope_label = "全服" if all_groups else "本群"
 
-    @filter.command("宠物商店")
-    async def shop(self, event: AstrMessageEvent):
-        """显示宠物商店中可购买的物品列表。"""
-        reply = "欢迎光临宠物商店！\n--------------------\n"
-        for name, item in SHOP_ITEMS.items():
-            reply += f"【{name}】 ${item['price']}\n效果: {item['description']}\n"
-        reply += "--------------------\n使用 `/购买 [物品名] [数量]` 来购买。"
+        with self._maintenance_lock(f"批量维护 {op_name}") if not dry_run else nullcontext(True) as acquired:
+            if not acquired:
+                yield event.plain_result("其他进程正在进行维护操作，请稍后再试。")
+                return
+            try:
+                last_report = time.perf_counter()
+                async for state in self._run_bulk_operation(op_name, group_id, dry_run):
+                    if not state['done'] and time.perf_counter() - last_report >= BULK_PROGRESS_SECONDS:
+                        last_report = time.perf_counter()
+                        yield event.plain_result(f"⏳ {op_name}: 已命中 {state['matched']} 条 "
+                                                 f"(分片 {state['shard']}/{state['shards']})，用时 {state['seconds']:.0f}秒")
+            except Exception as e:
+                logger.error(f"执行 /宠物批量 {op_name} 时发生错误: {e}")
+                yield event.plain_result(f"批量操作中途出错 (已完成的部分已提交)，请检查日志: {e}")
+                return
+
+        if dry_run:
+            reply = f"🔍 试运行 {op_name} ({scope_label}): 将影响 {state['matched']} 条记录，扫描用时 {state['seconds']:.2f}秒"
+        else:
+            reply = f"🛠️ {op_name} ({scope_label}) 执行完毕: 处理了 {state['matched']} 条记录，用时 {state['seconds']:.2f}秒"
+            logger.info(f"管理员 {event.get_sender_id()} 执行批量操作 {op_name} ({scope_label})，处理 {state['matched']} 条")
+        if state['samples']:
+            reply += f"\n示例: {'、'.join(state['samples'])}"
+        if dry_run and state['matched']:
+            reply += f"\n确认无误后发送 /宠物批量 {op_name} {scope_label} 执行"
         yield event.plain_result(reply)
 
+    async def _run_bulk_operation(self, name: str, group_id: str | None, dry_run: bool):
+        """
+        在一个群 (group_id 为 None 时为所有分片的全部群) 上执行批量操作。
+        每处理完一块 yield 一次累计统计，最后一次 yield 的 done 为 True。
+        """
+        _, operation = BULK_OPERATIONS[name]
+        if group_id is None:
+            paths, scope = self.db_paths, None
+        else:
+            paths, scope = [self.db_paths[shard_index(group_id, self.shard_count)]], int(group_id)
+        state = {"matched": 0, "samples": [], "shard": 0, "shards": len(paths), "seconds": 0.0, "done": False}
+        start = time.perf_counter()
+        for index, path in enumerate(paths, 1):
+            state['shard'] = index
+            with self._open_db(path) as conn:
+                for matched, samples in operation(self, conn, scope, dry_run):
+                    state['matched'] += matched
+                    state['samples'].extend(samples[:BULK_SAMPLE_LIMIT - len(state['samples'])])
+                    state['seconds'] = time.perf_counter() - start
+                    yield state
+                    await asyncio.sleep(0)
+        state['seconds'] = time.perf_counter() - start
+        state['done'] = True
+        yield state
+
+    # --- 批量维护操作 (按操作名注册) ---
+    @bulk_operation("技能", "把含重复技能的宠物重置为1级默认技能")
+    def _bulk_fix_skills(self, conn: sqlite3.Connection, group_id: int | None, dry_run: bool):
+        where, params = (f"({DUPLICATE_MOVES_SQL}) AND group_id = ?", (group_id,)) if group_id is not None \
+            else (DUPLICATE_MOVES_SQL, ())
+        for rows in iter_rowid_chunks(conn, "pets", "pet_name, pet_type", where, params):
+            updates, names = [], []
+            for rowid, pet_name, pet_type in rows:
+                if pet_type not in self.pets_data:
+                    logger.error(f"修复技能失败：宠物{pet_name} 找不到 {pet_type} 的配置")
+                    continue
+                default_moves = list(self._learnset(pet_type).new_at(1)) or ["撞击"]
+                updates.append((*(default_moves + [None] * 4)[:4], rowid))
+                names.append(pet_name)
+            if not dry_run and updates:
+                # 条件中再次检查重复，跳过扫描之后已被主人自行修改过的宠物
+                conn.executemany(f"UPDATE pets SET move1 = ?, move2 = ?, move3 = ?, move4 = ? "
+                                 f"WHERE rowid = ? AND ({DUPLICATE_MOVES_SQL})", updates)
+                conn.commit()
+            yield len(updates), names
+
+    @bulk_operation("未知物种", "删除物种已不在 pets.json 中的宠物 (含归档的) 及其背包")
+    def _bulk_remove_unknown_species(self, conn: sqlite3.Connection, group_id: int | None, dry_run: bool):
+        known_types = json.dumps(list(self.pets_data), ensure_ascii=False)
+        scope, params = ("", (known_types,)) if group_id is None else (" AND group_id = ?", (known_types, group_id))
+        for rows in iter_rowid_chunks(conn, "pets", "user_id, group_id, pet_name, pet_type",
+                                      "pet_type NOT IN (SELECT value FROM json_each(?))" + scope, params):
+            if not dry_run:
+                conn.executemany("DELETE FROM pets WHERE rowid = ?", [(row[0],) for row in rows])
+                conn.executemany("DELETE FROM inventory WHERE user_id = ? AND group_id = ?",
+                                 [(row[1], row[2]) for row in rows])
+                self._delete_money_history(conn, [(row[1], row[2]) for row in rows])
+                conn.commit()
+                if self.leaderboard is not None:
+                    for row in rows:
+                        self.leaderboard.remove(row[1], row[2])
+                logger.info(f"已删除未知物种宠物: {[(row[1], row[2], row[4]) for row in rows]}")
+            yield len(rows), [f"{row[3]}({row[4]})" for row in rows]
+        # 归档中的宠物也要删掉，否则主人下次使用命令时会被 _restore_archived_pet 恢复 (背包在归档内容里)
+        archived_type = "json_extract(payload, '$.pet.pet_type')"
+        for rows in iter_rowid_chunks(conn, "pets_archive",
+                                      f"user_id, group_id, json_extract(payload, '$.pet.pet_name'), {archived_type}",
+                                      f"{archived_type} NOT IN (SELECT value FROM json_each(?))" + scope, params):
+            if not dry_run:
+                conn.executemany("DELETE FROM pets_archive WHERE rowid = ?", [(row[0],) for row in rows])
+                self._delete_money_history(conn, [(row[1], row[2]) for row in rows])
+                conn.commit()
+                logger.info(f"已删除归档中的未知物种宠物: {[(row[1], row[2], row[4]) for row in rows]}")
+            yield len(rows), [f"{row[3]}({row[4]})" for row in rows]
+
+    @bulk_operation("孤儿物品", "清理没有对应宠物 (含归档) 或数量不大于0的背包记录")
+    def _bulk_remove_orphan_items(self, conn: sqlite3.Connection, group_id: int | None, dry_run: bool):
+        where = ("quantity <= 0 OR (NOT EXISTS (SELECT 1 FROM pets p WHERE p.user_id = inventory.user_id AND p.group_id = inventory.group_id) "
+                 "AND NOT EXISTS (SELECT 1 FROM pets_archive a WHERE a.user_id = inventory.user_id AND a.group_id = inventory.group_id))")
+        params = ()
+        if group_id is not None:
+            where, params = f"({where}) AND group_id = ?", (group_id,)
+        for rows in iter_rowid_chunks(conn, "inventory", "user_id, item_name, quantity", where, params):
+            if not dry_run:
+                conn.executemany("DELETE FROM inventory WHERE rowid = ?", [(row[0],) for row in rows])
+                conn.commit()
+            yield len(rows), [f"{row[1]}:{row[2]}x{row[3]}" for row in rows]
+
+    # --- 群数据导出/导入 ---
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("宠物导出")
+    @pet_command(lock=None, cost="read")
+    async def admin_export_group(self, event: AstrMessageEvent, fmt: str | None = None):
+        """(管理员) 把本群的宠物与背包 (含已归档的) 逐行导出为 JSONL 或 CSV。"""
+        group_id = event.get_group_id()
+        if not group_id:
+            yield event.plain_result("该功能仅限群聊使用。")
+            return
+        fmt = (fmt or "jsonl").lower()
+        if fmt not in ("jsonl", "csv"):
+            yield event.plain_result("用法: /宠物导出 [jsonl|csv]")
+            return
+
+        export_dir = self.data_dir / EXPORT_DIR_NAME
+        export_dir.mkdir(parents=True, exist_ok=True)
+        base_name = f"group_{group_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        if fmt == "jsonl":
+            paths = [export_dir / f"{base_name}.jsonl"]
+        else:
+            paths = [export_dir / f"{base_name}_pets.csv", export_dir / f"{base_name}_inventory.csv"]
+        start = time.perf_counter()
+        try:
+            counts = await asyncio.to_thread(self._export_group, group_id, paths)
+        except Exception as e:
+            logger.error(f"导出群 {group_id} 数据失败: {e}")
+            yield event.plain_result(f"导出失败，请检查日志: {e}")
+            return
+
+        seconds = time.perf_counter() - start
+        total = counts['pets'] + counts['inventory']
+        size_kb = sum(path.stat().st_size for path in paths) / 1024
+        logger.info(f"管理员 {event.get_sender_id()} 导出了群 {group_id} 的数据: {[path.name for path in paths]}")
+        yield event.plain_result(
+            f"📦 导出完成: 宠物 {counts['pets']} 只，背包记录 {counts['inventory']} 条\n"
+            f"用时 {seconds:.2f}秒 ({total / max(seconds, 1e-6):.0f} 行/秒)，共 {size_kb:.1f}KB\n"
+            f"文件: {', '.join(f'{EXPORT_DIR_NAME}/{path.name}' for path in paths)}")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("宠物导入")
+    @pet_command(lock=None)
+    async def admin_import_group(self, event: AstrMessageEvent, file_name: str | None = None, policy_arg: str | None = None):
+        """(管理员) 把导出文件中的宠物与背包导入到本群。冲突策略: 跳过 (默认) / 覆盖 / 合并。"""
+        group_id = event.get_group_id()
+        if not group_id:
+            yield event.plain_result("该功能仅限群聊使用。")
+            return
+        policy = IMPORT_POLICIES.get(policy_arg or "跳过")
+        if not file_name or not policy:
+            yield event.plain_result(
+                f"用法: /宠物导入 [文件名] [跳过|覆盖|合并]\n文件需放在数据目录的 {EXPORT_DIR_NAME}/ 下。\n"
+                "跳过: 保留已有宠物；覆盖: 用导入数据替换已有宠物和背包；合并: 保留已有宠物，背包数量相加。")
+            return
+
+        try:
+            sources = self._resolve_import_files(Path(file_name).name)
+        except FileNotFoundError as e:
+            yield event.plain_result(str(e))
+            return
+
+        with self._maintenance_lock("导入") as acquired:
+            if not acquired:
+                yield event.plain_result("其他进程正在进行维护操作，请稍后再试。")
+                return
+            counts = {"pets": 0, "pets_skipped": 0, "inventory": 0}
+            start = time.perf_counter()
+            try:
+                skipped_users: set[int] = set()
+                pet_columns = None
+                chunk = []
+                records = self._iter_import_records(sources)
+                while True:
+                    chunk.clear()
+                    for record in records:
+                        chunk.append(record)
+                        if len(chunk) >= IMPORT_CHUNK_ROWS:
+                            break
+                    if not chunk:
+                        break
+                    keys = {(str(row['user_id']), group_id) for _, row in chunk}
+                    async with self.pet_locks.hold(*keys):
+                        with self._connect(group_id) as conn:
+                            if pet_columns is None:
+                                pet_columns = {info[1] for info in conn.execute("PRAGMA table_info(pets)")}
+                            self._import_chunk(conn, chunk, int(group_id), policy, pet_columns, skipped_users, counts)
+                    await asyncio.sleep(0)
+            except (ValueError, KeyError, json.JSONDecodeError, csv.Error) as e:
+                logger.error(f"导入 {file_name} 到群 {group_id} 失败: {e}")
+                yield event.plain_result(
+                    f"导入中止: 文件格式有误 ({e})。\n已导入的部分 (宠物 {counts['pets']} 只，背包 {counts['inventory']} 条) 已提交。")
+                return
+
+        seconds = time.perf_counter() - start
+        total = counts['pets'] + counts['pets_skipped'] + counts['inventory']
+        logger.info(f"管理员 {event.get_sender_id()} 向群 {group_id} 导入了 {file_name} ({policy_arg or '跳过'}): {counts}")
+        yield event.plain_result(
+            f"📥 导入完成 ({policy_arg or '跳过'}): 宠物 {counts['pets']} 只，跳过 {counts['pets_skipped']} 只，"
+            f"背包记录 {counts['inventory']} 条\n用时 {seconds:.2f}秒 ({total / max(seconds, 1e-6):.0f} 行/秒)")
+
+    def _export_group(self, group_id: str, paths: list[Path]) -> dict:
+        """(工作线程中执行) 用独立连接逐行读出本群数据并写入导出文件，大群导出期间不会卡住其他命令。"""
+        with self._connect(group_id) as conn:
+            rows = self._iter_group_rows(conn, int(group_id))
+            if len(paths) == 1:
+                return self._write_export_jsonl(paths[0], rows, group_id)
+            pet_columns = [info[1] for info in conn.execute("PRAGMA table_info(pets)")]
+            return self._write_export_csv(paths[0], paths[1], pet_columns, rows)
+
+    def _iter_group_rows(self, conn: sqlite3.Connection, group_id: int):
+        """逐行产出 (表名, 行字典)：先是热表中的宠物与背包，再是归档中的宠物及其背包。"""
+        conn.row_factory = sqlite3.Row
+        for row in conn.execute("SELECT * FROM pets WHERE group_id = ?", (group_id,)):
+            yield "pets", dict(row)
+        for row in conn.execute("SELECT * FROM inventory WHERE group_id = ?", (group_id,)):
+            yield "inventory", dict(row)
+        for row in conn.execute("SELECT payload FROM pets_archive WHERE group_id = ?", (group_id,)):
+            payload = json.loads(row['payload'])
+            pet = payload['pet']
+            yield "pets", pet
+            for item_name, quantity in payload['inventory']:
+                yield "inventory", {"user_id": pet['user_id'], "group_id": group_id,
+                                    "item_name": item_name, "quantity": quantity}
+
+    def _write_export_jsonl(self, path: Path, rows, group_id: str) -> dict:
+        counts = {"pets": 0, "inventory": 0}
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"format": EXPORT_FORMAT, "version": EXPORT_FORMAT_VERSION, "group_id": group_id,
+                                "exported_at": datetime.now().isoformat()}, ensure_ascii=False) + "\n")
+            for table, row in rows:
+                f.write(json.dumps({"table": table, "row": row}, ensure_ascii=False) + "\n")
+                counts[table] += 1
+        return counts
+
+    def _write_export_csv(self, pets_path: Path, inventory_path: Path, pet_columns: list[str], rows) -> dict:
+        counts = {"pets": 0, "inventory": 0}
+        with open(pets_path, 'w', encoding='utf-8', newline='') as pets_file, \
+                open(inventory_path, 'w', encoding='utf-8', newline='') as inventory_file:
+            writers = {
+                "pets": csv.DictWriter(pets_file, fieldnames=pet_columns, extrasaction='ignore'),
+                "inventory": csv.DictWriter(inventory_file, fieldnames=INVENTORY_COLUMNS, extrasaction='ignore'),
+            }
+            for writer in writers.values():
+                writer.writeheader()
+            for table, row in rows:
+                writers[table].writerow(row)
+                counts[table] += 1
+        return counts
+
+    def _resolve_import_files(self, file_name: str) -> list[Path]:
+        """JSONL 为单个文件；CSV 由 *_pets.csv 与 *_inventory.csv 两个文件组成，给出任意一个或公共前缀均可。"""
+        export_dir = self.data_dir / EXPORT_DIR_NAME
+        if file_name.endswith(".jsonl"):
+            candidates = [export_dir / file_name]
+        else:
+            base = re.sub(r"(_pets|_inventory)?(\.csv)?$", "", file_name)
+            candidates = [export_dir / f"{base}_pets.csv", export_dir / f"{base}_inventory.csv"]
+        missing = [path.name for path in candidates if not path.exists()]
+        if missing:
+            raise FileNotFoundError(f"在 {EXPORT_DIR_NAME}/ 中找不到文件: {', '.join(missing)}")
+        return candidates
+
+    def _iter_import_records(self, sources: list[Path]):
+        """逐行读取导入文件，产出 (表名, 行字典)。"""
+        if sources[0].suffix == ".jsonl":
+            with open(sources[0], 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline() or "{}")
+                if header.get('format') != EXPORT_FORMAT or header.get('version') != EXPORT_FORMAT_VERSION:
+                    raise ValueError("不是本插件导出的文件或版本不兼容")
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        yield record['table'], record['row']
+            return
+        for table, path in zip(("pets", "inventory"), sources):
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                for row in csv.DictReader(f):
+                    # CSV 中的空字符串还原为 NULL；数字列依靠 SQLite 的类型亲和性自动转换
+                    yield table, {key: (value if value != "" else None) for key, value in row.items()}
+
+    def _import_chunk(self, conn: sqlite3.Connection, chunk: list[tuple[str, dict]], group_id: int, policy: str,
+                      pet_columns: set[str], skipped_users: set[int], counts: dict):
+        """在一个事务中导入一块记录。宠物一律改写到目标群。"""
+        for table, row in chunk:
+            user_id = int(row['user_id'])
+            if table == "pets":
+                pet = {key: value for key, value in upgrade_legacy_times(dict(row)).items() if key in pet_columns}
+                pet['user_id'], pet['group_id'] = user_id, group_id
+                if not pet.get('pet_name') or not pet.get('pet_type'):
+                    raise ValueError(f"用户 {user_id} 的宠物缺少 pet_name/pet_type")
+                exists = conn.execute("SELECT 1 FROM pets WHERE user_id = ? AND group_id = ?",
+                                      (user_id, group_id)).fetchone()
+                if policy != "overwrite":
+                    # 已归档的宠物同样算已有宠物: 先恢复到热表，合并模式下背包才能在它的原有物品上累加
+                    if exists or self._restore_archived_pet(conn, str(user_id), str(group_id)):
+                        skipped_users.add(user_id)
+                        counts['pets_skipped'] += 1
+                        continue
+                else:
+                    conn.execute("DELETE FROM inventory WHERE user_id = ? AND group_id = ?", (user_id, group_id))
+                    conn.execute("DELETE FROM pets_archive WHERE user_id = ? AND group_id = ?", (user_id, group_id))
+                    self._delete_money_history(conn, [(user_id, group_id)])  # 导入的宠物带着自己的余额，旧账单作废
+                skipped_users.discard(user_id)
+                conn.execute(f"INSERT OR REPLACE INTO pets ({', '.join(pet)}) VALUES ({', '.join('?' for _ in pet)})",
+                             tuple(pet.values()))
+                counts['pets'] += 1
+            elif table == "inventory":
+                values = (user_id, group_id, row['item_name'], int(row['quantity']))
+                if policy == "merge":
+                    conn.execute("""
+                        INSERT INTO inventory (user_id, group_id, item_name, quantity) VALUES (?, ?, ?, ?)
+                        ON CONFLICT(user_id, group_id, item_name) DO UPDATE SET quantity = quantity + excluded.quantity
+                    """, values)
+                elif user_id in skipped_users:
+                    continue
+                else:
+                    conn.execute("INSERT OR REPLACE INTO inventory (user_id, group_id, item_name, quantity) VALUES (?, ?, ?, ?)",
+                                 values)
+                counts['inventory'] += 1
+            else:
+                raise ValueError(f"未知的数据表: {table}")
+        conn.commit()
+
+    @filter.command("宠物商店")
+    @pet_command(lock=None, cost="read")
+    async def shop(self, event: AstrMessageEvent, category: str | None = None, page_arg: str | None = None):
+        """显示宠物商店中可购买的物品列表，支持按分类筛选和翻页。"""
+        catalog = self._get_shop_catalog()
+
+        # 允许直接 `/宠物商店 2` 翻页
+        if category is not None and category.isdigit() and page_arg is None:
+            category, page_arg = None, category
+
+        pages = catalog.pages.get(category)
+        if pages is None:
+            yield event.plain_result(f"商店里没有「{category}」这个分类。\n可选分类: {'、'.join(catalog.categories)}")
+            return
+
+        try:
+            page = int(page_arg) if page_arg is not None else 1
+        except ValueError:
+            yield event.plain_result(f"页码「{page_arg}」必须是一个数字。\n用法: /宠物商店 [分类] [页码]")
+            return
+        if not 1 <= page <= len(pages):
+            yield event.plain_result(f"页码超出范围，共有 {len(pages)} 页。")
+            return
+
+        yield event.plain_result(pages[page - 1])
+
     @filter.command("宠物背包")
+    @pet_command(cost="read")
     async def backpack(self, event: AstrMessageEvent):
         """显示你的宠物背包中的物品。"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
@@ -1172,7 +4066,7 @@ class PetPlugin(Star):
             yield event.plain_result("你还没有宠物，自然也没有背包啦。")
             return
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(group_id) as conn:
             cursor = conn.cursor()
             cursor.execute("SELECT item_name, quantity FROM inventory WHERE user_id = ? AND group_id = ?",
                            (int(user_id), int(group_id)))
@@ -1188,6 +4082,7 @@ class PetPlugin(Star):
         yield event.plain_result(reply)
 
     @filter.command("购买")
+    @pet_command()
     async def buy_item(self, event: AstrMessageEvent, item_name: str | None = None, quantity_arg: str | None = "1"):
         """从商店购买物品。"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
@@ -1209,7 +4104,8 @@ class PetPlugin(Star):
             yield event.plain_result("购买数量必须大于0。")
             return
 
-        if item_name not in SHOP_ITEMS:
+        item_info = self._get_shop_catalog().items.get(item_name)
+        if not item_info:
             yield event.plain_result(f"商店里没有「{item_name}」这种东西。")
             return
 
@@ -1218,19 +4114,19 @@ class PetPlugin(Star):
             yield event.plain_result("你还没有宠物，无法购买物品。")
             return
 
-        item_info = SHOP_ITEMS[item_name]
         total_cost = item_info['price'] * quantity
 
         if pet.get('money', 0) < total_cost:
             yield event.plain_result(f"你的钱不够哦！购买 {quantity} 个「{item_name}」需要 ${total_cost}，你只有 ${pet.get('money', 0)}。")
             return
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(group_id) as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "UPDATE pets SET money = money - ? WHERE user_id = ? AND group_id = ?",
                 (total_cost, int(user_id), int(group_id))
             )
+            self._record_money(conn, [(user_id, group_id, -total_cost, f"购买 {item_name}x{quantity}")])
 
             cursor.execute("""
                     INSERT INTO inventory (user_id, group_id, item_name, quantity) 
@@ -1244,101 +4140,135 @@ class PetPlugin(Star):
 
     # --- v1.5 /投喂 -> /使用 ---
     @filter.command("使用")
-    async def use_item(self, event: AstrMessageEvent, item_name: str | None = None):
-        """从背包中使用物品（食物、药品等）。"""
+    @pet_command()
+    async def use_item(self, event: AstrMessageEvent, item_name: str | None = None, quantity_arg: str | None = None):
+        """从背包中使用物品（食物、药品等），支持一次使用多个、多种物品。"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
         if not group_id: return
 
+        # 多物品写法的参数个数不固定，直接从原始消息中解析
+        tokens = (event.message_str or "").strip().lstrip("/").split()
+        if tokens and tokens[0] == "使用":
+            tokens = tokens[1:]
+        if not tokens:
+            tokens = [arg for arg in (item_name, quantity_arg) if arg is not None]
+
         # --- 新增：参数检查与友好提示 ---
-        if item_name is None:
-            yield event.plain_result("指令格式不正确哦。\n用法: /使用 [物品名]\n例如: /使用 美味罐头")
+        if not tokens:
+            yield event.plain_result("指令格式不正确哦。\n用法: /使用 [物品名] [数量]\n"
+                                     "例如: /使用 美味罐头 2\n也可以一次使用多种: /使用 普通口粮x3 心情饼干x2")
             return
         # --- 结束新增 ---
 
+        catalog = self._get_shop_catalog()
+        try:
+            batch = parse_item_batch(tokens, catalog.items)
+        except ValueError as e:
+            yield event.plain_result(str(e))
+            return
+
         pet = self._get_pet(user_id, group_id)
         if not pet:
             yield event.plain_result("你还没有宠物，不能使用物品哦。")
             return
 
-        if item_name not in SHOP_ITEMS:
-            yield event.plain_result(f"「{item_name}」不是一个可用的物品。")
+        unknown = [name for name in batch if name not in catalog.items]
+        if unknown:
+            yield event.plain_result(f"「{'、'.join(unknown)}」不是可用的物品。")
             return
 
-        item_info = SHOP_ITEMS[item_name]
-        item_type = item_info.get('type')
-
-        # --- 检查背包是否有此物品 ---
-        with sqlite3.connect(self.db_path) as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                "SELECT quantity FROM inventory WHERE user_id = ? AND group_id = ? AND item_name = ?",
-                (int(user_id), int(group_id), item_name)
-            )
-            item_row = cursor.fetchone()
-
-            if not item_row or item_row[0] <= 0:
-                yield event.plain_result(f"你的背包里没有「{item_name}」。")
+        with self._connect(group_id) as conn:
+            # --- 一次查询所有物品的库存，数量不足则整批拒绝 ---
+            names = list(batch)
+            owned = dict(conn.execute(
+                f"SELECT item_name, quantity FROM inventory WHERE user_id = ? AND group_id = ? "
+                f"AND item_name IN ({', '.join('?' for _ in names)})",
+                (int(user_id), int(group_id), *names)).fetchall())
+            shortages = [f"「{name}」(需要{quantity}，拥有{owned.get(name, 0)})"
+                         for name, quantity in batch.items() if owned.get(name, 0) < quantity]
+            if shortages:
+                if len(batch) == 1 and not owned.get(names[0]):
+                    yield event.plain_result(f"你的背包里没有「{names[0]}」。")
+                else:
+                    yield event.plain_result(f"背包中的物品不够: {'、'.join(shortages)}")
                 return
 
-            # --- 消耗物品 ---
-            cursor.execute(
-                "UPDATE inventory SET quantity = quantity - 1 WHERE user_id = ? AND group_id = ? AND item_name = ?",
-                (int(user_id), int(group_id), item_name)
-            )
-            cursor.execute(
+            # --- 在内存中依次结算每一份物品的效果；任何一份没有效果都整批拒绝，不写入任何数据 ---
+            pet_state = dict(pet)
+            messages = []
+            for name, quantity in batch.items():
+                item_info = catalog.items[name]
+                handler = ITEM_EFFECT_HANDLERS[item_info['type']]
+                for used in range(quantity):
+                    consumed, reply_msg = handler(self, pet_state, name, item_info)
+                    if not consumed:
+                        if used:
+                            reply_msg += f" (「{name}」最多只需要使用 {used} 个)"
+                        yield event.plain_result(reply_msg)
+                        return
+                    if used == 0:
+                        messages.append(reply_msg)
+
+            # 上限只在最后统一截断一次
+            pet_state['satiety'] = min(100, pet_state['satiety'])
+            pet_state['mood'] = min(100, pet_state['mood'])
+            conn.executemany(
+                "UPDATE inventory SET quantity = quantity - ? WHERE user_id = ? AND group_id = ? AND item_name = ?",
+                [(quantity, int(user_id), int(group_id), name) for name, quantity in batch.items()])
+            conn.executemany(
                 "DELETE FROM inventory WHERE user_id = ? AND group_id = ? AND item_name = ? AND quantity <= 0",
-                (int(user_id), int(group_id), item_name))
-
-            reply_msg = ""
-
-            # --- 根据物品类型处理效果 ---
-            if item_type == 'food':
-                satiety_gain = item_info.get('satiety', 0)
-                mood_gain = item_info.get('mood', 0)
-                cursor.execute(
-                    "UPDATE pets SET satiety = MIN(100, satiety + ?), mood = MIN(100, mood + ?) WHERE user_id = ? AND group_id = ?",
-                    (satiety_gain, mood_gain, int(user_id), int(group_id))
-                )
-                s_name = STAT_MAP.get('satiety')
-                m_name = STAT_MAP.get('mood')
-                reply_msg = f"你给「{pet['pet_name']}」投喂了「{item_name}」，它的{s_name}增加了 {satiety_gain}，{m_name}增加了 {mood_gain}！"
-
-            elif item_type == 'status_heal':
-                status_cured = item_info.get('cures')
-                current_status = pet.get('status_condition')
-                if current_status == status_cured:
-                    cursor.execute(
-                        "UPDATE pets SET status_condition = NULL WHERE user_id = ? AND group_id = ?",
-                        (int(user_id), int(group_id))
-                    )
-                    status_name = STAT_MAP.get(status_cured, "异常")
-                    reply_msg = f"你对「{pet['pet_name']}」使用了「{item_name}」，它的「{status_name}」状态被治愈了！"
-                else:
-                    reply_msg = f"「{item_name}」对你的宠物没有效果。"
-                    # 把物品还回去
-                    cursor.execute("UPDATE inventory SET quantity = quantity + 1 WHERE user_id = ? AND group_id = ? AND item_name = ?",
-                                   (int(user_id), int(group_id), item_name))
-
-            elif item_type == 'held_item':
-                reply_msg = f"「{item_name}」是持有物，请使用 `/装备 {item_name}` 来给宠物携带。"
-                # 把物品还回去
-                cursor.execute("UPDATE inventory SET quantity = quantity + 1 WHERE user_id = ? AND group_id = ? AND item_name = ?",
-                                (int(user_id), int(group_id), item_name))
-
-            elif item_type == 'tm':
-                reply_msg = f"「{item_name}」是技能光盘，请使用 `/学习技能 [栏位] {item_info.get('move_name')}` 来学习。"
-                # 把物品还回去
-                cursor.execute("UPDATE inventory SET quantity = quantity + 1 WHERE user_id = ? AND group_id = ? AND item_name = ?",
-                                (int(user_id), int(group_id), item_name))
-
-            else:
-                reply_msg = f"你使用了「{item_name}」，但似乎什么也没发生..."
-
+                [(int(user_id), int(group_id), name) for name in batch])
+            conn.execute(
+                "UPDATE pets SET satiety = ?, mood = ?, status_condition = ? WHERE user_id = ? AND group_id = ?",
+                (pet_state['satiety'], pet_state['mood'], pet_state.get('status_condition'), int(user_id), int(group_id)))
             conn.commit()
-            yield event.plain_result(reply_msg)
+
+        if len(batch) == 1 and sum(batch.values()) == 1:
+            yield event.plain_result(messages[0])
+            return
+        reply = f"你给「{pet['pet_name']}」使用了: {'、'.join(f'{name}x{quantity}' for name, quantity in batch.items())}\n"
+        for stat in ('satiety', 'mood'):
+            if pet_state[stat] != pet[stat]:
+                reply += f"{STAT_MAP[stat]}: {pet[stat]} → {pet_state[stat]}\n"
+        if pet.get('status_condition') and not pet_state.get('status_condition'):
+            reply += f"「{STAT_MAP.get(pet['status_condition'], '异常')}」状态被治愈了！"
+        yield event.plain_result(reply.rstrip())
+
+    # --- 物品效果处理器 (按物品类型注册) ---
+    @item_effect("food")
+    def _use_food(self, pet_state: dict, item_name: str, item_info: dict) -> tuple[bool, str]:
+        satiety_gain = item_info.get('satiety', 0)
+        mood_gain = item_info.get('mood', 0)
+        # 能提升的属性都已满时，再吃也没有效果 (不提升任何属性的食物不受此限制)
+        boosted = [stat for stat, gain in (('satiety', satiety_gain), ('mood', mood_gain)) if gain > 0]
+        if boosted and all(pet_state[stat] >= 100 for stat in boosted):
+            return False, f"「{pet_state['pet_name']}」已经吃不下「{item_name}」啦。"
+        pet_state['satiety'] += satiety_gain
+        pet_state['mood'] += mood_gain
+        s_name = STAT_MAP.get('satiety')
+        m_name = STAT_MAP.get('mood')
+        return True, f"你给「{pet_state['pet_name']}」投喂了「{item_name}」，它的{s_name}增加了 {satiety_gain}，{m_name}增加了 {mood_gain}！"
+
+    @item_effect("status_heal")
+    def _use_status_heal(self, pet_state: dict, item_name: str, item_info: dict) -> tuple[bool, str]:
+        status_cured = item_info.get('cures')
+        if pet_state.get('status_condition') != status_cured:
+            return False, f"「{item_name}」对你的宠物没有效果。"
+        pet_state['status_condition'] = None
+        status_name = STAT_MAP.get(status_cured, "异常")
+        return True, f"你对「{pet_state['pet_name']}」使用了「{item_name}」，它的「{status_name}」状态被治愈了！"
+
+    @item_effect("held_item")
+    def _use_held_item(self, pet_state: dict, item_name: str, item_info: dict) -> tuple[bool, str]:
+        return False, f"「{item_name}」是持有物，请使用 `/装备 {item_name}` 来给宠物携带。"
+
+    @item_effect("tm")
+    def _use_tm(self, pet_state: dict, item_name: str, item_info: dict) -> tuple[bool, str]:
+        return False, f"「{item_name}」是技能光盘，请使用 `/学习技能 [栏位] {item_info.get('move_name')}` 来学习。"
 
     # --- v1.5 新增：装备命令 ---
     @filter.command("装备")
+    @pet_command()
     async def equip_item(self, event: AstrMessageEvent, item_name: str | None = None):
         """从背包中装备一个持有物。"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
@@ -1355,12 +4285,13 @@ class PetPlugin(Star):
             yield event.plain_result("你还没有宠物。")
             return
 
-        if item_name not in SHOP_ITEMS or SHOP_ITEMS[item_name].get('type') != 'held_item':
+        item_info = self._get_shop_catalog().items.get(item_name)
+        if not item_info or item_info.get('type') != 'held_item':
             yield event.plain_result(f"「{item_name}」不是一个可以装备的持有物。")
             return
 
         # 检查背包
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(group_id) as conn:
             cursor = conn.cursor()
             cursor.execute(
                 "SELECT quantity FROM inventory WHERE user_id = ? AND group_id = ? AND item_name = ?",
@@ -1403,6 +4334,7 @@ class PetPlugin(Star):
         yield event.plain_result(reply)
 
     @filter.command("宠物签到")
+    @pet_command()
     async def daily_signin(self, event: AstrMessageEvent):
         """每日签到领取奖励。"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
@@ -1413,29 +4345,86 @@ class PetPlugin(Star):
             yield event.plain_result("你还没有宠物，无法签到。")
             return
 
-        now = datetime.now()
-        last_signin_str = pet.get('last_signin_time')
-        if last_signin_str:
-            last_signin_time = datetime.fromisoformat(last_signin_str)
-            if last_signin_time.date() == now.date():
-                yield event.plain_result("今天已经签过到了，明天再来吧！")
-                return
+        now = int(time.time())
+        last_signin_at = pet.get('last_signin_at')
+        if last_signin_at is not None and datetime.fromtimestamp(last_signin_at).date() == datetime.fromtimestamp(now).date():
+            yield event.plain_result("今天已经签过到了，明天再来吧！")
+            return
 
         money_gain = random.randint(15, 50)
-        with sqlite3.connect(self.db_path) as conn:
-            conn.execute("UPDATE pets SET money = money + ?, last_signin_time = ? WHERE user_id = ? AND group_id = ?",
-                         (money_gain, now.isoformat(), int(user_id), int(group_id)))
+        with self._connect(group_id) as conn:
+            conn.execute("UPDATE pets SET money = money + ?, last_signin_at = ? WHERE user_id = ? AND group_id = ?",
+                         (money_gain, now, int(user_id), int(group_id)))
+            self._record_money(conn, [(user_id, group_id, money_gain, "每日签到")])
             conn.commit()
 
         yield event.plain_result(f"签到成功！你获得了 ${money_gain}！")
 
+    @filter.command("账单")
+    @pet_command(cost="read")
+    async def money_statement(self, event: AstrMessageEvent, page_arg: str | None = None):
+        """按时间倒序分页查看金钱流水。"""
+        user_id, group_id = event.get_sender_id(), event.get_group_id()
+        if not group_id: return
+
+        try:
+            page = int(page_arg) if page_arg else 1
+        except ValueError:
+            yield event.plain_result("页码必须是一个数字。")
+            return
+        pet = self._get_pet(user_id, group_id)
+        if not pet:
+            yield event.plain_result("你还没有宠物，也就没有账单啦。")
+            return
+
+        if not 1 <= page <= LEDGER_MAX_PAGES:
+            yield event.plain_result(f"页码需在 1~{LEDGER_MAX_PAGES} 之间。")
+            return
+
+        # 上一页看过时从它最后一条流水的 id 往前取 (走 (user_id, group_id, id) 索引)，否则退回 OFFSET
+        cursor_key = ("ledger_cursor", user_id, group_id)
+        cursors = (self.ephemeral.get(cursor_key) or {}) if page > 1 else {}
+        params = [int(user_id), int(group_id)]
+        sql = "SELECT id, delta, reason, created_at FROM money_ledger WHERE user_id = ? AND group_id = ?"
+        if page - 1 in cursors:
+            sql += " AND id < ? ORDER BY id DESC LIMIT ?"
+            params += [cursors[page - 1], LEDGER_PAGE_SIZE + 1]
+        else:
+            sql += " ORDER BY id DESC LIMIT ? OFFSET ?"
+            params += [LEDGER_PAGE_SIZE + 1, (page - 1) * LEDGER_PAGE_SIZE]
+        with self._connect(group_id) as conn:
+            rows = conn.execute(sql, params).fetchall()
+            has_more = len(rows) > LEDGER_PAGE_SIZE
+            entries = rows[:LEDGER_PAGE_SIZE]
+            if page > 1 and not entries:
+                yield event.plain_result("页码超出范围，没有更早的流水了。")
+                return
+            snapshot = None if has_more else conn.execute(
+                "SELECT delta_total, entries, as_of FROM money_snapshots WHERE user_id = ? AND group_id = ?",
+                (int(user_id), int(group_id))).fetchone()
+        if entries:
+            self.ephemeral.set(cursor_key, {**cursors, page: entries[-1][0]}, LEDGER_CURSOR_TTL_SECONDS)
+
+        reply = f"💰 {pet['pet_name']}的账单 (余额 ${pet['money']}) 第 {page} 页\n--------------------\n"
+        for _, delta, reason, created_at in entries:
+            reply += f"{datetime.fromtimestamp(created_at).strftime('%m-%d %H:%M')}  {delta:+d}  {reason}\n"
+        if not entries:
+            reply += "暂无流水记录。\n"
+        if snapshot:
+            reply += (f"更早的 {snapshot[1]} 条记录已合并: 合计 {snapshot[0]:+d} "
+                      f"(截至 {datetime.fromtimestamp(snapshot[2]).strftime('%Y-%m-%d')})\n")
+        if has_more and page < LEDGER_MAX_PAGES:
+            reply += f"发送 /账单 {page + 1} 查看更早的记录"
+        yield event.plain_result(reply.rstrip())
+
     @filter.command("宠物排行")
+    @pet_command(lock=None, cost="read")
     async def pet_ranking(self, event: AstrMessageEvent):
         """查看本群的宠物排行榜。"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
         if not group_id: return
 
-        with sqlite3.connect(self.db_path) as conn:
+        with self._connect(group_id) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
             cursor.execute(
@@ -1454,7 +4443,34 @@ class PetPlugin(Star):
 
         yield event.plain_result(reply)
 
+    @filter.command("全服排行")
+    @pet_command(lock=None, cost="read")
+    async def global_ranking(self, event: AstrMessageEvent):
+        """查看所有群的宠物排行榜，以及自己宠物的全服名次。"""
+        leaderboard = self.leaderboard
+        if leaderboard is None:
+            yield event.plain_result("全服排行榜正在生成中，请稍后再试。")
+            return
+        if not len(leaderboard):
+            yield event.plain_result("还没有任何宠物上榜，快去领养一只吧！")
+            return
+
+        reply = "🌏 全服宠物排行榜 🌏\n--------------------\n"
+        medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+        for rank, _, group_id, pet_name, level, exp in leaderboard.top(LEADERBOARD_TOP_N):
+            reply += f"{medals.get(rank, f'{rank}.')} 「{pet_name}」 - Lv.{level} (EXP: {exp}) [群…{str(group_id)[-4:]}]\n"
+
+        user_id, group_id = event.get_sender_id(), event.get_group_id()
+        my_rank = leaderboard.rank_of(user_id, group_id) if group_id else None
+        reply += "--------------------\n"
+        if my_rank:
+            reply += f"你的宠物位列全服第 {my_rank} 名 (共 {len(leaderboard)} 只)。"
+        else:
+            reply += f"全服共 {len(leaderboard)} 只宠物上榜。"
+        yield event.plain_result(reply)
+
     @filter.command("丢弃宠物")
+    @pet_command()
     async def discard_pet_request(self, event: AstrMessageEvent):
         """发起丢弃宠物的请求。"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
@@ -1464,29 +4480,214 @@ class PetPlugin(Star):
             yield event.plain_result("你都没有宠物，丢弃什么呢？")
             return
 
-        self.pending_discards[(user_id, group_id)] = datetime.now() + timedelta(seconds=30)
-        yield event.plain_result(f"⚠️警告！你确定要丢弃你的宠物吗？此操作不可逆！\n请在30秒内发送 `/确认丢弃` 来完成操作。")
+        self.ephemeral.set(("pending_discard", user_id, group_id), True, DISCARD_CONFIRM_SECONDS)
+        yield event.plain_result(f"⚠️警告！你确定要丢弃你的宠物吗？此操作不可逆！\n请在{DISCARD_CONFIRM_SECONDS}秒内发送 `/确认丢弃` 来完成操作。")
 
     @filter.command("确认丢弃")
+    @pet_command()
     async def confirm_discard_pet(self, event: AstrMessageEvent):
         """确认丢弃宠物。"""
         user_id, group_id = event.get_sender_id(), event.get_group_id()
         if not group_id: return
 
-        request_key = (user_id, group_id)
-        if request_key in self.pending_discards and datetime.now() < self.pending_discards[request_key]:
-            del self.pending_discards[request_key]
-
-            with sqlite3.connect(self.db_path) as conn:
+        # 提交成功后才清除待确认标记，数据库忙导致整体重试时仍能确认
+        if self.ephemeral.get(("pending_discard", user_id, group_id)):
+            with self._connect(group_id) as conn:
                 conn.execute("DELETE FROM pets WHERE user_id = ? AND group_id = ?", (int(user_id), int(group_id)))
                 conn.execute("DELETE FROM inventory WHERE user_id = ? AND group_id = ?", (int(user_id), int(group_id)))
+                self._delete_money_history(conn, [(user_id, group_id)])
                 conn.commit()
 
+            self.ephemeral.delete(("pending_discard", user_id, group_id))
+            self.ephemeral.delete(("walk_cooldown", user_id, group_id))
+            self.ephemeral.delete(("duel_cooldown", user_id, group_id))
+            if self.leaderboard is not None:
+                self.leaderboard.remove(user_id, group_id)
             yield event.plain_result("你的宠物已经离开了。江湖再见，或许会有新的邂逅。")
         else:
             yield event.plain_result("没有待确认的丢弃请求，或请求已超时。")
 
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("宠物提醒")
+    @pet_command(lock=None)
+    async def admin_toggle_alerts(self, event: AstrMessageEvent, action: str | None = None):
+        """(管理员) 开启或关闭本群的饥饿/心情提醒。"""
+        group_id = event.get_group_id()
+        if not group_id: return
+
+        with self._connect(group_id) as conn:
+            if action == "开启":
+                conn.execute("INSERT OR REPLACE INTO alert_groups (group_id, origin, enabled_at) VALUES (?, ?, ?)",
+                             (int(group_id), event.unified_msg_origin, int(time.time())))
+                conn.commit()
+                alerts = self.settings['alerts']
+                yield event.plain_result(
+                    f"已开启本群的宠物提醒：预计饱食度低于 {alerts['satiety_threshold']} 或心情低于 "
+                    f"{alerts['mood_threshold']} 的宠物会被提醒一次 (主人照顾后重新计算)。")
+            elif action == "关闭":
+                conn.execute("DELETE FROM alert_groups WHERE group_id = ?", (int(group_id),))
+                conn.commit()
+                yield event.plain_result("已关闭本群的宠物提醒。")
+            else:
+                enabled = conn.execute("SELECT 1 FROM alert_groups WHERE group_id = ?", (int(group_id),)).fetchone()
+                yield event.plain_result(f"本群宠物提醒当前{'已开启' if enabled else '未开启'}。用法: /宠物提醒 [开启|关闭]")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("宠物备份")
+    @pet_command(lock=None, cost="read")
+    async def admin_backup(self, event: AstrMessageEvent):
+        """(管理员) 立即在线备份数据库，报告耗时与校验结果。备份期间其他命令照常执行。"""
+        try:
+            with self._maintenance_lock("在线备份") as acquired:
+                result = await self._run_backup() if acquired else None
+        except Exception as e:
+            logger.error(f"在线备份失败: {e}")
+            yield event.plain_result(f"备份失败，请检查日志: {e}")
+            return
+        if result is None:
+            yield event.plain_result("其他进程正在进行维护操作，请稍后再试。")
+            return
+
+        pruned = f"，已清理 {len(result['pruned'])} 份旧备份" if result['pruned'] else ""
+        yield event.plain_result(
+            f"💾 备份完成: {BACKUP_DIR_NAME}/{result['name']}\n"
+            f"{result['files']} 个数据库文件，{result['pages']} 页，共 {result['bytes'] / 1024:.1f}KB\n"
+            f"用时 {result['seconds']:.2f}秒，副本完整性校验通过\n"
+            f"保留最近 {max(1, int(self.settings['backup']['keep']))} 份备份{pruned}")
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("宠物性能")
+    @pet_command(lock=None, cost="read")
+    async def admin_perf_report(self, event: AstrMessageEvent):
+        """(管理员) 查看各命令的调用量、错误数与分阶段耗时。"""
+        metrics = self.metrics
+        if not metrics.calls:
+            yield event.plain_result("暂无性能数据。")
+            return
+
+        reply = "📊 宠物插件性能统计\n--------------------\n"
+        for command, calls in sorted(metrics.calls.items(), key=lambda kv: -kv[1]):
+            total = metrics.latency[(command, "total")]
+            reply += (f"{command}: {calls}次 错误{metrics.errors.get(command, 0)} "
+                      f"平均{total.total / total.count * 1000:.1f}ms P95≤{total.quantile(0.95) * 1000:.0f}ms")
+            phases = []
+            for phase, label in (("db", "DB"), ("render", "绘图"), ("battle", "战斗"), ("lock", "等锁")):
+                histogram = metrics.latency.get((command, phase))
+                if histogram and histogram.count:
+                    phases.append(f"{label}{histogram.total / calls * 1000:.1f}ms")
+            if phases:
+                reply += f" ({' '.join(phases)})"
+            reply += "\n"
+
+        reply += "--------------------\n【最活跃的群】\n"
+        for group, calls in sorted(metrics.group_calls.items(), key=lambda kv: -kv[1])[:5]:
+            reply += f"{group}: {calls}次 累计{metrics.group_seconds[group]:.2f}s 错误{metrics.group_errors.get(group, 0)}\n"
+
+        lock_stats = self.pet_locks.stats()
+        reply += "--------------------\n"
+        reply += (f"宠物锁: {lock_stats['acquisitions']}次 争用{lock_stats['contended']}次 "
+                  f"最长等待{lock_stats['wait_seconds_max'] * 1000:.0f}ms\n")
+        if self.rate_limiter is not None:
+            reply += f"限流拒绝: {sum(self.rate_limiter.shed.values())}次\n"
+        reply += f"临时状态: {len(self.ephemeral)}条\n"
+        pet_counts = [row[0] for row in self._fan_out("SELECT COUNT(*) FROM pets")]
+        reply += f"宠物总数: {sum(pet_counts)}"
+        if self.shard_count > 1:
+            reply += f" (各分片 {'/'.join(map(str, pet_counts))})"
+        archived = sum(row[0] for row in self._fan_out("SELECT COUNT(*) FROM pets_archive"))
+        reply += f"，已归档 {archived}\n"
+        reply += f"指标文件: {self.settings['metrics']['export_file']} (每{self.settings['metrics']['export_interval_seconds']}秒更新)"
+        yield event.plain_result(reply)
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("宠物SQL统计")
+    @pet_command(lock=None, cost="read")
+    async def admin_sql_report(self, event: AstrMessageEvent, arg: str | None = None):
+        """(管理员) 开启/关闭 SQL 追踪，或查看各命令的语句统计。"""
+        if arg == "开启":
+            if self.sql_tracer is None:
+                self.sql_tracer = self._new_sql_tracer()
+            yield event.plain_result(
+                f"✅ SQL 追踪已开启，超过 {self.settings['sql_trace']['slow_query_ms']}ms 的语句会记录到 "
+                f"{self.settings['sql_trace']['slow_log_file']}。")
+            return
+        if arg == "关闭":
+            self.sql_tracer = None
+            yield event.plain_result("SQL 追踪已关闭，统计数据已清空。")
+            return
+        if self.sql_tracer is None:
+            yield event.plain_result("SQL 追踪未开启。使用 `/宠物SQL统计 开启` 开启追踪。")
+            return
+        if arg == "重置":
+            self.sql_tracer = self._new_sql_tracer()
+            yield event.plain_result("SQL 追踪统计已重置。")
+            return
+        yield event.plain_result(self.sql_tracer.summary(arg))
+
+    @filter.permission_type(filter.PermissionType.ADMIN)
+    @filter.command("宠物剖析")
+    @pet_command(lock=None, cost="read")
+    async def admin_profile(self, event: AstrMessageEvent, seconds_arg: str | None = None):
+        """(管理员) 在限定时间窗口内剖析插件，列出最耗 CPU 的函数。"""
+        try:
+            seconds = int(seconds_arg) if seconds_arg else PROFILE_DEFAULT_SECONDS
+        except ValueError:
+            yield event.plain_result("秒数必须是一个整数。")
+            return
+        if not 1 <= seconds <= PROFILE_MAX_SECONDS:
+            yield event.plain_result(f"剖析时长需在 1~{PROFILE_MAX_SECONDS} 秒之间。")
+            return
+        if self._profiling:
+            yield event.plain_result("已有一次剖析正在进行，请等待它结束。")
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 同一线程上已有其他剖析器在运行
+            yield event.plain_result("当前进程中已有其他剖析器在运行，无法开始剖析。")
+            return
+        self._profiling = True
+        try:
+            yield event.plain_result(f"🔍 开始剖析，持续 {seconds} 秒，期间照常使用插件即可。")
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.disable()
+            self._profiling = False
+
+        profile_path = self._save_profile(profiler)
+        yield event.plain_result(self._profile_summary(profiler, seconds, profile_path))
+
+    def _save_profile(self, profiler: cProfile.Profile) -> Path:
+        """把剖析结果写成 pstats 文件，只保留最近的若干份。"""
+        profile_dir = self.data_dir / "profiles"
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        path = profile_dir / f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pstats"
+        profiler.dump_stats(str(path))
+        for old in sorted(profile_dir.glob("profile_*.pstats"))[:-PROFILE_KEEP_FILES]:
+            old.unlink(missing_ok=True)
+        return path
+
+    def _profile_summary(self, profiler: cProfile.Profile, seconds: int, profile_path: Path) -> str:
+        """按累计耗时列出本插件 (main.py) 中最热的函数。"""
+        stats = pstats.Stats(profiler).stats
+        own = [(key, entry) for key, entry in stats.items() if key[0] == __file__]
+        if not own:
+            return f"剖析结束 ({seconds}秒)，期间插件没有执行任何代码。\n结果文件: {profile_path.name}"
+
+        own_cpu = sum(entry[2] for _, entry in own)
+        reply = (f"🔍 剖析结果 ({seconds}秒)\n"
+                 f"插件代码自身耗时 {own_cpu * 1000:.0f}ms (占窗口 {own_cpu / seconds:.1%})\n"
+                 "--------------------\n")
+        hottest = sorted(own, key=lambda kv: kv[1][3], reverse=True)[:PROFILE_TOP_N]
+        for (_, line, func), (_, calls, tottime, cumtime, _) in hottest:
+            reply += f"{func}:{line}  {calls}次 累计{cumtime * 1000:.1f}ms 自身{tottime * 1000:.1f}ms\n"
+        reply += f"--------------------\n完整结果: profiles/{profile_path.name} (可用 pstats/snakeviz 查看)"
+        return reply
+
     @filter.command("宠物菜单")
+    @pet_command(lock=None, cost="read")
     async def pet_menu(self, event: AstrMessageEvent):
         """显示所有可用的宠物插件命令。"""
         menu_text = """--- 🐾 宠物插件帮助菜单 v1.5 🐾 ---
@@ -1503,20 +4704,31 @@ class PetPlugin(Star):
 
 【日常互动】
 /宠物签到 - 每天领取金钱奖励。
+/账单 [页码] - 查看金钱收支记录。
 /散步 - 带宠物散步，触发奇遇或战斗。
-/使用 [物品名] - 使用食物或药品。 (原/投喂)
+/使用 [物品名] [数量] - 使用食物或药品，可一次使用多种，如 /使用 普通口粮x3 心情饼干x2。
 
 【商店与物品】
-/宠物商店 - 查看可购买的商品。
+/宠物商店 [分类] [页码] - 查看可购买的商品。
 /购买 [物品] [数量] - 从商店购买物品。
 /宠物背包 - 查看你拥有的物品。
 
 【社交与竞技】
 /对决 @某人 - 与群友的宠物进行1v1对决。
+/战斗详情 [页码] - 查看最近一场战斗的完整战报。
 /宠物排行 - 查看本群最强的宠物们。
+/全服排行 - 查看所有群最强的宠物和你的全服名次。
 
 【其他命令】
 /修复宠物技能 - (管理员) 修复本群所有宠物的重复技能。
+/宠物提醒 [开启|关闭] - (管理员) 开启后，宠物快饿坏或不开心时会在群里提醒主人。
+/宠物性能 - (管理员) 查看各命令的调用量与耗时。
+/宠物SQL统计 [开启|关闭|重置|命令名] - (管理员) SQL 追踪与慢查询统计。
+/宠物剖析 [秒数] - (管理员) 剖析插件CPU热点。
+/宠物批量 [操作] [本群|全服] [执行] - (管理员) 批量维护数据。
+/宠物导出 [jsonl|csv] - (管理员) 导出本群宠物数据。
+/宠物导入 [文件名] [跳过|覆盖|合并] - (管理员) 导入宠物数据到本群。
+/宠物备份 - (管理员) 立即在线备份数据库并校验。
 /丢弃宠物 - (危险) 与你的宠物告别，慎用！
 """
         yield event.plain_result(menu_text)
@@ -1529,4 +4741,6 @@ class PetPlugin(Star):
 
     async def terminate(self):
         """插件卸载/停用时调用。"""
+        for task in self._background_tasks:
+            task.cancel()
         logger.info("简易群宠物游戏插件(astrbot_plugin_pet)已卸载。")
\ No newline at end of file
@@ -0,0 +1,88 @@
+"""
+野生宠物遭遇生成基准测试。
+
+对比两种生成 PvE 野生宠物的方式:
+  * legacy: 旧版 walk_pet 的做法，每次遭遇都随机种族、查询可学技能、拼装新字典；
+  * pool:   WildPetPool.spawn，从按 (种族, 等级段) 预编译的模板复制并随机少量数值。
+默认使用 main.py 内置的宠物配置，也可以用 --pets/--walk-events 指定服务器上的配置文件。
+
+用法:
+    python tools/bench_encounters.py
+    python tools/bench_encounters.py --iterations 200000 --pets data/.../pets.json --walk-events data/.../walk_events.json
+"""
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import load_test  # noqa: E402  (复用 AstrBot 桩模块与插件加载逻辑)
+
+
+def legacy_spawn(pets_data: dict, learnsets: dict, level: int) -> dict:
+    """旧版 walk_pet 中构造野生宠物的逻辑 (仅用于对比)。"""
+    npc_type_name = random.choice(list(pets_data.keys()))
+    npc_stats = pets_data[npc_type_name]['base_stats']
+    npc_available_moves = list(learnsets[npc_type_name].available(level))
+    if not npc_available_moves: npc_available_moves = ["撞击"]
+    chosen_moves = (random.sample(npc_available_moves, min(len(npc_available_moves), 4)) + [None] * 4)[:4]
+    return {
+        "user_id": "0", "group_id": "0",
+        "pet_name": f"野生的{npc_type_name}", "pet_type": npc_type_name,
+        "level": level, "attack": npc_stats['attack'] + level,
+        "defense": npc_stats['defense'] + level, "satiety": 100, "mood": 100,
+        "move1": chosen_moves[0], "move2": chosen_moves[1],
+        "move3": chosen_moves[2], "move4": chosen_moves[3],
+        "status_condition": None, "held_item": None
+    }
+
+
+def bench(func, levels: list[int]) -> float:
+    start = time.perf_counter()
+    for level in levels:
+        func(level)
+    return time.perf_counter() - start
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="野生宠物遭遇生成基准测试")
+    parser.add_argument("--iterations", type=int, default=100000, help="每种方式生成的野生宠物数量")
+    parser.add_argument("--max-level", type=int, default=60, help="随机等级上限")
+    parser.add_argument("--pets", type=Path, help="pets.json 路径 (默认使用内置配置)")
+    parser.add_argument("--walk-events", type=Path, help="walk_events.json 路径，用于读取 encounter_tables")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="pet_bench_") as tmp:
+        load_test.install_astrbot_stubs(Path(tmp))
+        main_module = load_test.load_plugin_module()
+
+    pets_data = json.loads(args.pets.read_text(encoding="utf-8")) if args.pets else main_module.DEFAULT_PETS
+    walk_events = json.loads(args.walk_events.read_text(encoding="utf-8")) if args.walk_events else {}
+    learnsets = {name: main_module.LearnsetIndex(info.get('learnset', {})) for name, info in pets_data.items()}
+
+    build_start = time.perf_counter()
+    encounter_tables = walk_events.get('encounter_tables', []) if isinstance(walk_events, dict) else []
+    pool = main_module.WildPetPool.build(pets_data, learnsets, encounter_tables)
+    build_ms = (time.perf_counter() - build_start) * 1000
+    templates = sum(len(starts) for starts, _ in pool.bands.values())
+
+    rng = random.Random(args.seed)
+    levels = [rng.randint(1, args.max_level) for _ in range(args.iterations)]
+    random.seed(args.seed)
+    legacy = bench(lambda level: legacy_spawn(pets_data, learnsets, level), levels)
+    random.seed(args.seed)
+    pooled = bench(pool.spawn, levels)
+
+    print(f"种族 {len(pets_data)} 个，模板 {templates} 份，遭遇表 {len(pool.tables)} 张，编译耗时 {build_ms:.2f}ms")
+    for name, seconds in (("legacy", legacy), ("pool", pooled)):
+        print(f"{name:<8} {seconds * 1e9 / args.iterations:>8.0f} ns/次  ({args.iterations / seconds:,.0f} 次/秒)")
+    print(f"加速比 {legacy / pooled:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
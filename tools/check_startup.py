@@ -0,0 +1,107 @@
+"""
+宠物插件启动耗时检查。
+
+在全新的解释器中 (AstrBot 相关模块使用 load_test.py 中的桩) 分别测量:
+  * 导入 main.py 的耗时，以及导入后是否意外加载了 PIL / numpy 等重模块；
+  * 构造 PetPlugin (插件注册前的同步部分) 的耗时；
+  * 后台初始化 (配置编译、建表) 完成的耗时。
+每项取多次运行的中位数，超过门禁时以非零状态码退出，可用于发版前检查启动性能是否退化。
+
+用法:
+    python tools/check_startup.py
+    python tools/check_startup.py --runs 7 --max-import-ms 150 --max-construct-ms 30 --json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+TOOLS_DIR = Path(__file__).resolve().parent
+HEAVY_MODULES = ("PIL", "numpy")
+
+# 在子进程中执行：安装桩模块 -> 计时导入 -> 计时构造与初始化，结果以 JSON 打印到标准输出
+PROBE = r"""
+import asyncio, json, logging, sys, time
+from pathlib import Path
+sys.path.insert(0, {tools_dir!r})
+import load_test
+
+logging.basicConfig(level=logging.CRITICAL)
+data_root = Path({data_root!r})
+load_test.install_astrbot_stubs(data_root)
+
+start = time.perf_counter()
+main = load_test.load_plugin_module()
+import_ms = (time.perf_counter() - start) * 1000
+heavy = [name for name in {heavy!r} if name in sys.modules]
+
+async def build():
+    start = time.perf_counter()
+    plugin = main.PetPlugin(load_test._Context())
+    construct_ms = (time.perf_counter() - start) * 1000
+    ok = await plugin._wait_ready()
+    ready_ms = (time.perf_counter() - start) * 1000
+    await plugin.terminate()
+    return construct_ms, ready_ms, ok
+
+construct_ms, ready_ms, ok = asyncio.run(build())
+print(json.dumps({{"import_ms": import_ms, "construct_ms": construct_ms, "ready_ms": ready_ms,
+                  "ready_ok": ok, "heavy_modules": heavy}}))
+"""
+
+
+def probe_once(data_root: Path) -> dict:
+    code = PROBE.format(tools_dir=str(TOOLS_DIR), data_root=str(data_root), heavy=HEAVY_MODULES)
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise SystemExit(f"探测进程失败:\n{proc.stderr}")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="宠物插件启动耗时检查")
+    parser.add_argument("--runs", type=int, default=5, help="运行次数，取中位数")
+    parser.add_argument("--max-import-ms", type=float, default=None, help="导入 main.py 的耗时上限")
+    parser.add_argument("--max-construct-ms", type=float, default=None, help="构造 PetPlugin 的耗时上限")
+    parser.add_argument("--max-ready-ms", type=float, default=None, help="后台初始化完成的耗时上限")
+    parser.add_argument("--json", action="store_true", help="输出 JSON")
+    args = parser.parse_args(argv)
+
+    samples = []
+    with tempfile.TemporaryDirectory(prefix="pet_startup_") as tmp:
+        for i in range(max(1, args.runs)):
+            # 第一次运行是全新数据目录 (需要编译配置、建表)，之后命中配置快照与已有数据库
+            samples.append(probe_once(Path(tmp)))
+
+    result = {key: statistics.median(sample[key] for sample in samples)
+              for key in ("import_ms", "construct_ms", "ready_ms")}
+    result["cold_ready_ms"] = samples[0]["ready_ms"]
+    result["heavy_modules"] = sorted({name for sample in samples for name in sample["heavy_modules"]})
+    result["ready_ok"] = all(sample["ready_ok"] for sample in samples)
+
+    failures = []
+    if result["heavy_modules"]:
+        failures.append(f"导入 main.py 时加载了重模块: {', '.join(result['heavy_modules'])}")
+    if not result["ready_ok"]:
+        failures.append("插件初始化失败")
+    for key, limit in (("import_ms", args.max_import_ms), ("construct_ms", args.max_construct_ms),
+                       ("ready_ms", args.max_ready_ms)):
+        if limit is not None and result[key] > limit:
+            failures.append(f"{key} = {result[key]:.1f}ms 超过上限 {limit:.1f}ms")
+
+    if args.json:
+        print(json.dumps({**result, "failures": failures}, ensure_ascii=False, indent=2))
+    else:
+        print(f"导入 main.py: {result['import_ms']:.1f}ms (中位数, {len(samples)} 次)")
+        print(f"构造 PetPlugin: {result['construct_ms']:.1f}ms")
+        print(f"初始化就绪: {result['ready_ms']:.1f}ms (首次冷启动 {result['cold_ready_ms']:.1f}ms)")
+        for failure in failures:
+            print(f"✗ {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,488 @@
+"""
+宠物插件离线压测工具。
+
+在临时数据目录中构建 PetPlugin (AstrBot 相关模块用最小桩替代)，
+模拟大量用户在大量群里按指定比例发送命令，输出吞吐量、延迟分位数、
+数据库体积增长与事件循环延迟。可作为发版前的性能门禁。
+
+用法示例:
+    python tools/load_test.py --users 5000 --groups 300 --concurrency 64 --duration 30
+    python tools/load_test.py --mix "walk=40,duel=20,status=5" --no-cooldowns --max-p99-ms 200
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import logging
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+# --- AstrBot 桩模块 ---
+
+class _Filter:
+    class PermissionType:
+        ADMIN = "admin"
+
+    @staticmethod
+    def command(name, *args, **kwargs):
+        def decorator(func):
+            func._pet_command = name
+            return func
+        return decorator
+
+    @staticmethod
+    def permission_type(permission, *args, **kwargs):
+        return lambda func: func
+
+
+class _Star:
+    def __init__(self, context):
+        self.context = context
+
+
+class _Context:
+    """最小化的 Context 桩：主动消息只计数，不真正发送。"""
+    def __init__(self):
+        self.sent_messages = 0
+
+    async def send_message(self, session, message_chain):
+        self.sent_messages += 1
+        return True
+
+
+class _At:
+    def __init__(self, qq, name=""):
+        self.qq = qq
+        self.name = name
+
+
+class _Plain:
+    def __init__(self, text):
+        self.text = text
+
+
+class _Node:
+    def __init__(self, content=None, uin="0", name=""):
+        self.content = content
+        self.uin = uin
+        self.name = name
+
+
+class _Nodes:
+    def __init__(self, nodes):
+        self.nodes = nodes
+
+
+class _MessageChain:
+    def __init__(self, chain=None):
+        self.chain = chain or []
+
+
+class SimEvent:
+    """模拟的群消息事件，同时充当 AstrMessageEvent 与 AiocqhttpMessageEvent。"""
+    SELF_ID = "10000"
+
+    def __init__(self, user_id: str, group_id: str, message_str: str = "", at_ids: tuple = ()):
+        self.user_id = user_id
+        self.group_id = group_id
+        self.message_str = message_str
+        self.message_obj = None
+        self.unified_msg_origin = f"aiocqhttp:GroupMessage:{group_id}"
+        self._segments = [_At(qq) for qq in at_ids]
+
+    def get_sender_id(self):
+        return self.user_id
+
+    def get_sender_name(self):
+        return f"玩家{self.user_id}"
+
+    def get_group_id(self):
+        return self.group_id
+
+    def get_self_id(self):
+        return self.SELF_ID
+
+    def get_platform_name(self):
+        return "aiocqhttp"
+
+    def get_messages(self):
+        return self._segments
+
+    def plain_result(self, text):
+        return ("plain", text)
+
+    def image_result(self, path):
+        return ("image", path)
+
+    def chain_result(self, chain):
+        return ("chain", chain)
+
+
+def install_astrbot_stubs(data_root: Path):
+    """向 sys.modules 注入 main.py 需要的 AstrBot 模块。"""
+    class _StarTools:
+        @staticmethod
+        def get_data_dir(name):
+            return data_root
+
+    def module(name, **attrs):
+        mod = sys.modules.get(name) or types.ModuleType(name)
+        for key, value in attrs.items():
+            setattr(mod, key, value)
+        sys.modules[name] = mod
+        return mod
+
+    logger = logging.getLogger("astrbot_plugin_pet")
+    module("astrbot")
+    module("astrbot.api", logger=logger)
+    module("astrbot.api.event", filter=_Filter(), AstrMessageEvent=SimEvent, MessageChain=_MessageChain)
+    module("astrbot.api.star", Context=_Context, Star=_Star, register=lambda *a, **k: (lambda cls: cls),
+           StarTools=_StarTools)
+    module("astrbot.api.message_components", At=_At, Plain=_Plain, Node=_Node, Nodes=_Nodes)
+    module("astrbot.core")
+    module("astrbot.core.message")
+    module("astrbot.core.message.components", At=_At, Plain=_Plain, Node=_Node, Nodes=_Nodes)
+    module("astrbot.core.platform")
+    module("astrbot.core.platform.sources")
+    module("astrbot.core.platform.sources.aiocqhttp")
+    module("astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event", AiocqhttpMessageEvent=SimEvent)
+    module("astrbot.core.star", StarTools=_StarTools)
+
+
+def load_plugin_module():
+    spec = importlib.util.spec_from_file_location("astrbot_plugin_pet_main", REPO_ROOT / "main.py")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+# --- 命令组合 ---
+
+class Population:
+    """模拟用户与群的分布：每个用户固定属于一个群。"""
+
+    def __init__(self, users: int, groups: int, seed: int):
+        self.rng = random.Random(seed)
+        self.groups = [str(700000000 + i) for i in range(groups)]
+        self.members: dict[str, list[str]] = {g: [] for g in self.groups}
+        self.users: list[tuple[str, str]] = []
+        for i in range(users):
+            user_id, group_id = str(100000 + i), self.groups[i % groups]
+            self.members[group_id].append(user_id)
+            self.users.append((user_id, group_id))
+
+    def pick(self) -> tuple[str, str]:
+        return self.rng.choice(self.users)
+
+    def opponent(self, user_id: str, group_id: str) -> str | None:
+        members = self.members[group_id]
+        if len(members) < 2:
+            return None
+        while True:
+            target = self.rng.choice(members)
+            if target != user_id:
+                return target
+
+
+def _build_commands(plugin_cls, plugin, population: Population):
+    """命令名 -> 生成 (处理器, 事件, 参数) 的函数。"""
+    rng = population.rng
+    items = list(plugin.shop_catalog.items)
+    usable = [name for name, item in plugin.shop_catalog.items.items() if item['type'] in ("food", "status_heal")]
+    categories = plugin.shop_catalog.categories
+
+    def simple(handler):
+        return lambda uid, gid: (handler, SimEvent(uid, gid), ())
+
+    def duel(uid, gid):
+        target = population.opponent(uid, gid)
+        return plugin_cls.duel_pet, SimEvent(uid, gid, at_ids=(target,) if target else ()), ()
+
+    def buy(uid, gid):
+        name = rng.choice(items)
+        return plugin_cls.buy_item, SimEvent(uid, gid, f"购买 {name} 1"), (name, "1")
+
+    def use(uid, gid):
+        name = rng.choice(usable or items)
+        return plugin_cls.use_item, SimEvent(uid, gid, f"使用 {name}"), (name,)
+
+    def shop(uid, gid):
+        category = rng.choice(categories) if categories and rng.random() < 0.5 else None
+        return plugin_cls.shop, SimEvent(uid, gid), (category, None) if category else ()
+
+    def rename(uid, gid):
+        return plugin_cls.rename_pet, SimEvent(uid, gid), (f"小{rng.randrange(10000)}",)
+
+    return {
+        "status": simple(plugin_cls.my_pet_status),
+        "walk": simple(plugin_cls.walk_pet),
+        "duel": duel,
+        "signin": simple(plugin_cls.daily_signin),
+        "shop": shop,
+        "backpack": simple(plugin_cls.backpack),
+        "buy": buy,
+        "use": use,
+        "moves": simple(plugin_cls.pet_moves),
+        "ranking": simple(plugin_cls.pet_ranking),
+        "rename": rename,
+        "evolve": simple(plugin_cls.evolve_pet),
+    }
+
+
+DEFAULT_MIX = "walk=25,duel=15,status=8,signin=6,shop=6,backpack=6,buy=10,use=10,moves=5,ranking=5,rename=2,evolve=2"
+
+
+def parse_mix(text: str, known: set[str]) -> tuple[list[str], list[float]]:
+    names, weights = [], []
+    for part in text.split(","):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in known:
+            raise SystemExit(f"未知命令「{name}」，可选: {', '.join(sorted(known))}")
+        names.append(name)
+        weights.append(float(weight or 1))
+    if not names or sum(weights) <= 0:
+        raise SystemExit("命令组合为空。")
+    return names, weights
+
+
+# --- 统计 ---
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def db_size(data_root: Path) -> int:
+    return sum(p.stat().st_size for p in data_root.glob("pets*.db*") if p.is_file())
+
+
+async def run_handler(handler, plugin, event, args) -> int:
+    replies = 0
+    async for _ in handler(plugin, event, *args):
+        replies += 1
+    return replies
+
+
+async def monitor_loop_lag(samples: list[float], interval: float, stop: asyncio.Event):
+    """周期性休眠，记录实际唤醒时间比预期晚了多少。"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+async def seed_population(plugin_cls, plugin, population: Population, concurrency: int):
+    """压测前为所有模拟用户领养宠物 (不计入统计)。"""
+    queue = list(population.users)
+
+    async def worker():
+        while queue:
+            user_id, group_id = queue.pop()
+            await run_handler(plugin_cls.adopt_pet, plugin, SimEvent(user_id, group_id), ())
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+async def run_load(args) -> dict:
+    data_root = Path(tempfile.mkdtemp(prefix="pet_load_"))
+    try:
+        install_astrbot_stubs(data_root)
+        main = load_plugin_module()
+        if args.no_cooldowns:
+            main.WALK_COOLDOWN_SECONDS = 0
+            main.DUEL_COOLDOWN_SECONDS = 0
+
+        settings = {
+            "rate_limit": {"enabled": args.rate_limit},
+            "metrics": {"export_enabled": False},
+            "sql_trace": {"enabled": False},
+            "storage": {"shards": args.shards},
+        }
+        (data_root / "settings.json").write_text(json.dumps(settings), encoding="utf-8")
+
+        init_start = time.perf_counter()
+        plugin = main.PetPlugin(_Context())
+        if not await plugin._wait_ready():
+            raise SystemExit("插件初始化失败，请查看日志。")
+        init_seconds = time.perf_counter() - init_start
+
+        population = Population(args.users, args.groups, args.seed)
+        commands = _build_commands(main.PetPlugin, plugin, population)
+        names, weights = parse_mix(args.mix, set(commands))
+
+        size_empty = db_size(data_root)
+        seed_seconds = 0.0
+        if not args.no_seed:
+            seed_start = time.perf_counter()
+            await seed_population(main.PetPlugin, plugin, population, args.concurrency)
+            seed_seconds = time.perf_counter() - seed_start
+        size_before = db_size(data_root)
+
+        latencies: dict[str, list[float]] = {name: [] for name in names}
+        errors: dict[str, int] = {name: 0 for name in names}
+        first_error: dict[str, str] = {}
+        lag_samples: list[float] = []
+        stop = asyncio.Event()
+        rng = population.rng
+        think = args.think_ms / 1000
+        deadline = time.perf_counter() + args.duration
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                name = rng.choices(names, weights)[0]
+                handler, event, call_args = commands[name](*population.pick())
+                start = time.perf_counter()
+                try:
+                    await run_handler(handler, plugin, event, call_args)
+                except Exception as e:
+                    errors[name] += 1
+                    first_error.setdefault(name, repr(e))
+                latencies[name].append(time.perf_counter() - start)
+                if think:
+                    await asyncio.sleep(rng.uniform(0, 2 * think))
+                else:
+                    await asyncio.sleep(0)
+
+        monitor = asyncio.create_task(monitor_loop_lag(lag_samples, args.lag_interval_ms / 1000, stop))
+        run_start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - run_start
+        stop.set()
+        await monitor
+        await plugin.terminate()
+        size_after = db_size(data_root)
+
+        all_latencies = sorted(v for values in latencies.values() for v in values)
+        total = len(all_latencies)
+        per_command = {}
+        for name in names:
+            values = sorted(latencies[name])
+            per_command[name] = {
+                "count": len(values),
+                "errors": errors[name],
+                "p50_ms": percentile(values, 0.50) * 1000,
+                "p95_ms": percentile(values, 0.95) * 1000,
+                "p99_ms": percentile(values, 0.99) * 1000,
+                "max_ms": (values[-1] if values else 0.0) * 1000,
+            }
+        lag_samples.sort()
+        return {
+            "users": args.users,
+            "groups": args.groups,
+            "concurrency": args.concurrency,
+            "duration_s": elapsed,
+            "init_s": init_seconds,
+            "seed_s": seed_seconds,
+            "requests": total,
+            "errors": sum(errors.values()),
+            "first_errors": first_error,
+            "throughput_rps": total / elapsed if elapsed else 0.0,
+            "latency_ms": {
+                "p50": percentile(all_latencies, 0.50) * 1000,
+                "p95": percentile(all_latencies, 0.95) * 1000,
+                "p99": percentile(all_latencies, 0.99) * 1000,
+                "max": (all_latencies[-1] if all_latencies else 0.0) * 1000,
+            },
+            "commands": per_command,
+            "db_bytes": {"empty": size_empty, "after_seed": size_before, "after_run": size_after,
+                         "growth": size_after - size_before},
+            "loop_lag_ms": {
+                "p50": percentile(lag_samples, 0.50) * 1000,
+                "p99": percentile(lag_samples, 0.99) * 1000,
+                "max": (lag_samples[-1] if lag_samples else 0.0) * 1000,
+            },
+        }
+    finally:
+        if not args.keep_data:
+            shutil.rmtree(data_root, ignore_errors=True)
+        else:
+            print(f"数据目录已保留: {data_root}")
+
+
+def print_report(result: dict):
+    lat, lag, size = result['latency_ms'], result['loop_lag_ms'], result['db_bytes']
+    print(f"用户 {result['users']} / 群 {result['groups']} / 并发 {result['concurrency']}")
+    print(f"插件初始化 {result['init_s']:.2f}s，预领养 {result['seed_s']:.2f}s")
+    print(f"请求 {result['requests']} 次，耗时 {result['duration_s']:.1f}s，"
+          f"吞吐 {result['throughput_rps']:.1f} 次/秒，异常 {result['errors']} 次")
+    print(f"延迟 p50 {lat['p50']:.2f}ms | p95 {lat['p95']:.2f}ms | p99 {lat['p99']:.2f}ms | max {lat['max']:.2f}ms")
+    print(f"事件循环延迟 p50 {lag['p50']:.2f}ms | p99 {lag['p99']:.2f}ms | max {lag['max']:.2f}ms")
+    print(f"数据库 {size['after_seed'] / 1024:.0f}KB -> {size['after_run'] / 1024:.0f}KB "
+          f"(增长 {size['growth'] / 1024:.0f}KB)")
+    print(f"{'命令':<10}{'次数':>8}{'异常':>6}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name, stats in sorted(result['commands'].items(), key=lambda kv: -kv[1]['count']):
+        print(f"{name:<10}{stats['count']:>8}{stats['errors']:>6}{stats['p50_ms']:>9.2f}"
+              f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}{stats['max_ms']:>9.2f}")
+    for name, error in result['first_errors'].items():
+        print(f"[{name}] 首个异常: {error}")
+
+
+def check_gates(result: dict, args) -> list[str]:
+    failures = []
+    if args.max_p99_ms is not None and result['latency_ms']['p99'] > args.max_p99_ms:
+        failures.append(f"p99 {result['latency_ms']['p99']:.2f}ms 超过 {args.max_p99_ms}ms")
+    if args.min_rps is not None and result['throughput_rps'] < args.min_rps:
+        failures.append(f"吞吐 {result['throughput_rps']:.1f} 次/秒 低于 {args.min_rps}")
+    if args.max_loop_lag_ms is not None and result['loop_lag_ms']['p99'] > args.max_loop_lag_ms:
+        failures.append(f"事件循环延迟 p99 {result['loop_lag_ms']['p99']:.2f}ms 超过 {args.max_loop_lag_ms}ms")
+    if result['errors'] > args.max_errors:
+        failures.append(f"异常 {result['errors']} 次 超过 {args.max_errors}")
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="宠物插件离线压测")
+    parser.add_argument("--users", type=int, default=2000, help="模拟用户数")
+    parser.add_argument("--groups", type=int, default=200, help="模拟群数")
+    parser.add_argument("--concurrency", type=int, default=32, help="并发虚拟用户数")
+    parser.add_argument("--duration", type=float, default=20.0, help="压测时长 (秒)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="命令权重，如 walk=25,duel=15")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="每次命令之间的平均间隔 (毫秒)")
+    parser.add_argument("--seed", type=int, default=1, help="随机种子")
+    parser.add_argument("--no-seed", action="store_true", help="不预先领养宠物")
+    parser.add_argument("--no-cooldowns", action="store_true", help="关闭散步/对决冷却，让每次都走完整逻辑")
+    parser.add_argument("--shards", type=int, default=1, help="数据库分片数")
+    parser.add_argument("--rate-limit", action="store_true", help="保留命令限流 (默认关闭以测量原始吞吐)")
+    parser.add_argument("--lag-interval-ms", type=float, default=10.0, help="事件循环延迟采样间隔 (毫秒)")
+    parser.add_argument("--log-level", default="CRITICAL", help="插件日志级别 (默认只输出致命错误)")
+    parser.add_argument("--keep-data", action="store_true", help="保留临时数据目录")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    parser.add_argument("--max-p99-ms", type=float, help="门禁：整体 p99 延迟上限")
+    parser.add_argument("--min-rps", type=float, help="门禁：最低吞吐")
+    parser.add_argument("--max-loop-lag-ms", type=float, help="门禁：事件循环延迟 p99 上限")
+    parser.add_argument("--max-errors", type=int, default=0, help="门禁：允许的异常次数")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format="%(levelname)s %(message)s")
+    logging.getLogger("astrbot_plugin_pet").setLevel(args.log_level.upper())
+    if not (REPO_ROOT / "assets" / "font.ttf").exists():
+        print("提示: assets/font.ttf 不存在，状态图会在加载字体时失败，status 命令的耗时偏低。", file=sys.stderr)
+    result = asyncio.run(run_load(args))
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_report(result)
+
+    failures = check_gates(result, args)
+    for failure in failures:
+        print(f"门禁未通过: {failure}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
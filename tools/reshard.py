@@ -0,0 +1,219 @@
+"""
+宠物插件数据库离线重新分片工具。
+
+把数据目录中的 pets.db / pets_shard*.db 按群号重新分布到 N 个分片，
+并同步更新 settings.json 中的 storage.shards。必须在 AstrBot 停机时运行。
+
+用法:
+    python tools/reshard.py --data-dir data/plugin_data/astrbot_plugin_pet --shards 8
+    python tools/reshard.py --data-dir ... --shards 1          # 合并回单个 pets.db
+    python tools/reshard.py --data-dir ... --shards 8 --dry-run
+
+原文件会移动到数据目录下的 reshard_backup_<时间>/ 中，确认无误后可自行删除。
+"""
+import argparse
+import heapq
+import json
+import re
+import shutil
+import sqlite3
+import sys
+import time
+import zlib
+from itertools import chain, islice
+from pathlib import Path
+
+BATCH_SIZE = 5000
+
+
+def shard_index(group_id, shard_count: int) -> int:
+    """必须与 main.py 中的 shard_index 保持一致。"""
+    if shard_count <= 1:
+        return 0
+    return zlib.crc32(str(group_id).encode()) % shard_count
+
+
+def shard_db_paths(data_dir: Path, shard_count: int) -> list[Path]:
+    """必须与 main.py 中的 shard_db_paths 保持一致。"""
+    if shard_count <= 1:
+        return [data_dir / "pets.db"]
+    return [data_dir / f"pets_shard{i}.db" for i in range(shard_count)]
+
+
+def current_sources(data_dir: Path) -> list[Path]:
+    legacy = data_dir / "pets.db"
+    shards = sorted(data_dir.glob("pets_shard*.db"))
+    if legacy.exists() and shards:
+        raise SystemExit("数据目录中同时存在 pets.db 和分片文件，请先人工确认哪一份是最新数据。")
+    return [legacy] if legacy.exists() else shards
+
+
+def read_schema(conn: sqlite3.Connection) -> tuple[list[str], list[str]]:
+    """返回 (建表语句, 索引/触发器等其余语句)。其余语句在数据复制完成后再执行。"""
+    tables, others = [], []
+    for kind, name, sql in conn.execute(
+            "SELECT type, name, sql FROM sqlite_master WHERE sql IS NOT NULL ORDER BY rowid"):
+        if name.startswith("sqlite_"):
+            continue
+        (tables if kind == "table" else others).append(sql)
+    return tables, others
+
+
+def table_columns(conn: sqlite3.Connection, table: str) -> list[str]:
+    return [row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')]
+
+
+def autoincrement_column(conn: sqlite3.Connection, table: str) -> str | None:
+    """
+    AUTOINCREMENT 主键列 (如 money_ledger.id)。各源分片独立编号，合并时会撞键，
+    因此复制时不保留该列，由目标库按 (created_at, id) 顺序重新编号。
+    """
+    sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+    match = re.search(r'"?(\w+)"?\s+INTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT', sql, re.IGNORECASE)
+    return match.group(1) if match else None
+
+
+def source_rows(source: Path, table: str, cols: list[str], order: list[str]):
+    """逐批读取一个源文件中的行 (附带排序键列)，读完后关闭连接。"""
+    src = sqlite3.connect(source)
+    try:
+        sql = f'SELECT {", ".join(cols + order)} FROM "{table}"'
+        if order:
+            sql += f' ORDER BY {", ".join(order)}'
+        cursor = src.execute(sql)
+        while rows := cursor.fetchmany(BATCH_SIZE):
+            yield from rows
+    finally:
+        src.close()
+
+
+def reshard(data_dir: Path, shard_count: int, dry_run: bool) -> int:
+    sources = current_sources(data_dir)
+    if not sources:
+        raise SystemExit(f"{data_dir} 中没有找到宠物数据库。")
+
+    # 先合并 WAL，保证复制的是完整数据
+    for source in sources:
+        conn = sqlite3.connect(source)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.close()
+
+    schema_conn = sqlite3.connect(sources[0])
+    table_sql, other_sql = read_schema(schema_conn)
+    tables = [row[0] for row in schema_conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' AND name != 'shard_meta'")]
+    columns = {table: table_columns(schema_conn, table) for table in tables}
+    renumbered = {table: autoincrement_column(schema_conn, table) for table in tables}
+    schema_conn.close()
+
+    print(f"源文件: {', '.join(p.name for p in sources)} -> 目标分片数: {shard_count}")
+    staging = data_dir / "reshard_staging"
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir()
+    targets = [sqlite3.connect(staging / path.name) for path in shard_db_paths(data_dir, shard_count)]
+    for conn in targets:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        for sql in table_sql:
+            conn.execute(sql)
+
+    start = time.perf_counter()
+    expected: dict[str, int] = {}
+    for table in tables:
+        alias = renumbered[table]
+        cols = [col for col in columns[table] if col != alias]
+        routed = "group_id" in cols
+        if not routed:
+            print(f"表 {table} 没有 group_id 列，将完整复制到每个分片。")
+        placeholders = ", ".join("?" for _ in cols)
+        insert_sql = f'INSERT INTO "{table}" ({", ".join(cols)}) VALUES ({placeholders})'
+        group_pos = cols.index("group_id") if routed else None
+        expected[table] = 0
+        if alias:
+            # 按时间归并所有源文件，使重新编号后的 id 仍保持先后顺序
+            order = (["created_at"] if "created_at" in cols else []) + [alias]
+            width = len(cols)
+            merged = heapq.merge(*(source_rows(source, table, cols, order) for source in sources),
+                                 key=lambda row: row[width:])
+            stream = (row[:width] for row in merged)
+        else:
+            stream = chain.from_iterable(source_rows(source, table, cols, []) for source in sources)
+        while rows := list(islice(stream, BATCH_SIZE)):
+            expected[table] += len(rows)
+            if routed:
+                buckets: dict[int, list] = {}
+                for row in rows:
+                    buckets.setdefault(shard_index(row[group_pos], shard_count), []).append(row)
+                for index, bucket in buckets.items():
+                    targets[index].executemany(insert_sql, bucket)
+            else:
+                for conn in targets:
+                    conn.executemany(insert_sql, rows)
+
+    for index, conn in enumerate(targets):
+        for sql in other_sql:
+            conn.execute(sql)
+        conn.execute("CREATE TABLE IF NOT EXISTS shard_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        conn.execute("DELETE FROM shard_meta")
+        conn.executemany("INSERT INTO shard_meta (key, value) VALUES (?, ?)",
+                         [("shard_count", str(shard_count)), ("shard_index", str(index))])
+        conn.commit()
+
+    # --- 校验行数 ---
+    ok = True
+    for table in tables:
+        counts = [conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for conn in targets]
+        total = sum(counts) if "group_id" in columns[table] else counts[0]
+        status = "✓" if total == expected[table] else "✗"
+        ok &= total == expected[table]
+        print(f"{status} {table}: {expected[table]} 行 -> 各分片 {'/'.join(map(str, counts))}")
+    for conn in targets:
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.close()
+    print(f"复制耗时 {time.perf_counter() - start:.2f}s")
+
+    if not ok:
+        print(f"行数校验失败，原数据未改动，临时文件保留在 {staging}。", file=sys.stderr)
+        return 1
+    if dry_run:
+        shutil.rmtree(staging)
+        print("试运行结束，原数据未改动。")
+        return 0
+
+    # --- 替换文件并更新配置 ---
+    backup = data_dir / f"reshard_backup_{time.strftime('%Y%m%d_%H%M%S')}"
+    suffix = 1
+    while backup.exists():
+        backup = backup.with_name(f"{backup.name.split('.')[0]}.{suffix}")
+        suffix += 1
+    backup.mkdir()
+    for source in sources:
+        for path in (source, source.with_name(source.name + "-wal"), source.with_name(source.name + "-shm")):
+            if path.exists():
+                path.rename(backup / path.name)
+    for path in staging.iterdir():
+        path.rename(data_dir / path.name)
+    staging.rmdir()
+
+    settings_path = data_dir / "settings.json"
+    settings = json.loads(settings_path.read_text(encoding="utf-8")) if settings_path.exists() else {}
+    settings.setdefault("storage", {})["shards"] = shard_count
+    settings_path.write_text(json.dumps(settings, ensure_ascii=False, indent=2), encoding="utf-8")
+    print(f"完成。原文件已移动到 {backup.name}/，settings.json 已更新为 {shard_count} 个分片。")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="宠物插件数据库离线重新分片 (需停机运行)")
+    parser.add_argument("--data-dir", required=True, type=Path, help="插件数据目录 (包含 pets.db 或 pets_shard*.db)")
+    parser.add_argument("--shards", required=True, type=int, help="目标分片数 (1 表示合并为单个 pets.db)")
+    parser.add_argument("--dry-run", action="store_true", help="只复制并校验，不替换原文件")
+    args = parser.parse_args(argv)
+    if args.shards < 1:
+        parser.error("--shards 至少为 1")
+    return reshard(args.data_dir, args.shards, args.dry_run)
+
+
+if __name__ == "__main__":
+    sys.exit(main())